@@ -2,14 +2,14 @@
 import json
 import time
 import uuid
-import requests
 
 from config import *
-from joy_inside_py import auth
+from joy_inside_py import auth, http_client
 from joy_inside_py.api_config import URL_AUTH_GET_TOKEN, URL_AUTH_REFRESH_TOKEN
+from joy_inside_py.token_manager import TokenManager
 
 
-def get_token():
+def _request_token():
     params = {
         "accessKeyId": ACCESS_KEY,
         "accessTimestamp": str(int(round(time.time() * 1000))),
@@ -20,29 +20,50 @@ def get_token():
     params['accessSign'] = auth.generate_sign(ACCESS_VERSION, params["accessTimestamp"], params["accessNonce"],
                                               ACCESS_KEY, ACCESS_KEY_SECRET)
     params["botId"] = BOT_ID
-    res = requests.post(URL_AUTH_GET_TOKEN, json=params)
+    res = http_client.post(URL_AUTH_GET_TOKEN, json=params)
     if res.status_code != 200:
         print("请求异常", res.status_code)
         return None
 
     print('获取授权结果：', res.text)
-    res_json = json.loads(res.text)
-    return res_json["accessToken"]
+    return json.loads(res.text)
 
 
-def refresh_token(refreshToken):
+def _request_refresh(refreshToken):
     params = {
         "accessKeyId": ACCESS_KEY,
         "refreshToken": refreshToken,
         "botId": BOT_ID
     }
 
-    res = requests.post(URL_AUTH_REFRESH_TOKEN, json=params)
+    res = http_client.post(URL_AUTH_REFRESH_TOKEN, json=params)
     if res.status_code != 200:
         print("请求异常", res.status_code)
         return None
 
     print('刷新授权结果：', res.text)
-    res_json = json.loads(res.text)
+    return json.loads(res.text)
+
+
+def get_token():
+    res_json = _request_token()
+    if res_json is None:
+        return None
+    return res_json["accessToken"]
+
+
+def refresh_token(refreshToken):
+    res_json = _request_refresh(refreshToken)
+    if res_json is None:
+        return None
     return res_json["accessToken"]
 
+
+# 进程内共享的 token 缓存：到期前后台用 refreshToken 续期
+token_manager = TokenManager(_request_token, _request_refresh)
+
+
+def get_cached_token():
+    """与 get_token() 返回值相同，但命中缓存时不发起网络请求。"""
+    return token_manager.get()
+
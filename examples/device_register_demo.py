@@ -8,10 +8,9 @@
 import json
 import time
 import uuid
-import requests
 
 from config import *
-from joy_inside_py import auth
+from joy_inside_py import auth, http_client
 from joy_inside_py.api_config import URL_AUTH_GET_TOKEN, URL_DEVICE_REGISTER
 
 
@@ -26,7 +25,7 @@ def register_bot():
         "name": "测试"
     }
 
-    res = requests.post(URL_DEVICE_REGISTER, headers=headers, json=params)
+    res = http_client.post(URL_DEVICE_REGISTER, headers=headers, json=params)
     if res.status_code != 200:
         print("请求异常", res.status_code)
         return None
@@ -41,7 +40,7 @@ def get_vendor_token():
     params['accessSign'] = auth.generate_sign(ACCESS_VERSION, params["accessTimestamp"], params["accessNonce"],
                                               ACCESS_KEY, ACCESS_KEY_SECRET)
     params["vendorId"] = VENDOR_ID
-    res = requests.post(URL_AUTH_GET_TOKEN, json=params)
+    res = http_client.post(URL_AUTH_GET_TOKEN, json=params)
     if res.status_code != 200:
         print("请求异常", res.status_code)
         return None
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+上行帧时长基准：对 api_config.FRAME_MS_CHOICES 中各档帧时长分别统计
+- 说完判定时延：Endpointer 对 PCM 文件（末尾补静音）判定“说完”的平均/最大时延（音频时长，ms）
+- 每帧 CPU：float32→PCM16 + JSON 编码 + 端点检测，单位 µs/帧 与 每秒音频耗时 ms
+- 带宽：AUDIO JSON 帧 + 每消息协议开销（WS 帧头 + TLS 记录 + TCP/IP 头）折算 kbps，及相对裸 PCM 的开销比例
+
+python frame_bench.py
+python frame_bench.py --pcm test.pcm --repeat 20
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from joy_inside_py.api_config import BYTES_PER_MS, FRAME_MS_CHOICES, frame_bytes
+from joy_inside_py.endpointer import Endpointer, HANGOVER_MS
+from joy_inside_py.frame_encoder import AudioFrameEncoder
+
+PCM_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.pcm")
+SR = 16000
+TRAILING_SILENCE_MS = 1500
+
+# 每条 WS 消息的额外开销（字节，粗略值）：客户端掩码帧头 + TLS 1.2/1.3 AEAD 记录 + IPv4/TCP 头
+WS_HEADER = 8
+TLS_RECORD = 22
+TCP_IP_HEADER = 40
+
+
+def _load_pcm(path: str) -> np.ndarray:
+    with open(path, "rb") as f:
+        pcm = np.frombuffer(f.read(), dtype=np.int16)
+    pad = np.zeros(int(SR * TRAILING_SILENCE_MS / 1000), dtype=np.int16)
+    return np.concatenate([pcm, pad]).astype(np.float32) * (1.0 / 32768.0)
+
+
+def _blocks(x: np.ndarray, frame_samples: int):
+    for off in range(0, x.size - frame_samples + 1, frame_samples):
+        yield x[off:off + frame_samples]
+
+
+def bench(x: np.ndarray, frame_ms: int, repeat: int):
+    fb = frame_bytes(frame_ms)
+    frame_samples = fb // 2
+    blocks = list(_blocks(x, frame_samples))
+    encoder = AudioFrameEncoder("bench-uid", fb)
+
+    # 端点判定时延（只跑一遍，结果与 repeat 无关）
+    ep = Endpointer(frame_ms=frame_ms)
+    for block in blocks:
+        ep.process(block)
+    latencies = ep.decision_latencies_ms
+
+    # 每帧 CPU：与推流线程的逐帧工作一致
+    msg_len = 0
+    t0 = time.process_time()
+    for _ in range(repeat):
+        ep = Endpointer(frame_ms=frame_ms)
+        for i, block in enumerate(blocks):
+            encoder.load_float32(block)
+            msg_len = len(encoder.encode(i))
+            ep.process(block)
+    cpu = time.process_time() - t0
+    n = len(blocks) * repeat
+
+    msgs_per_s = 1000.0 / frame_ms
+    wire = (msg_len + WS_HEADER + TLS_RECORD + TCP_IP_HEADER) * msgs_per_s
+    raw = BYTES_PER_MS * 1000
+    return {
+        "frame_ms": frame_ms,
+        "ends": len(latencies),
+        "lat_mean": sum(latencies) / len(latencies) if latencies else float("nan"),
+        "lat_max": max(latencies) if latencies else float("nan"),
+        "us_per_frame": cpu / n * 1e6 if n else float("nan"),
+        "ms_per_audio_s": cpu / n * msgs_per_s * 1000 if n else float("nan"),
+        "msg_bytes": msg_len,
+        "kbps": wire * 8 / 1000,
+        "overhead_pct": (wire - raw) / raw * 100,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上行帧时长：说完判定时延 / CPU / 带宽")
+    parser.add_argument("--pcm", default=PCM_FILE_PATH)
+    parser.add_argument("--repeat", type=int, default=10, help="CPU 统计时重复处理整段音频的次数")
+    args = parser.parse_args()
+
+    x = _load_pcm(args.pcm)
+    print(f"音频: {args.pcm}（{x.size / SR:.2f}s，含末尾 {TRAILING_SILENCE_MS}ms 静音），hangover={HANGOVER_MS}ms")
+    print(f"{'帧长':>6} {'说完次数':>6} {'判定均值':>8} {'判定最大':>8} {'µs/帧':>8} {'ms/音频s':>9} "
+          f"{'消息字节':>8} {'kbps':>7} {'开销%':>7}")
+    for frame_ms in FRAME_MS_CHOICES:
+        r = bench(x, frame_ms, args.repeat)
+        print(f"{r['frame_ms']:>4}ms {r['ends']:>10} {r['lat_mean']:>10.1f} {r['lat_max']:>10.1f} "
+              f"{r['us_per_frame']:>9.1f} {r['ms_per_audio_s']:>10.2f} {r['msg_bytes']:>12} "
+              f"{r['kbps']:>7.1f} {r['overhead_pct']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
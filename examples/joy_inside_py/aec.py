@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+回声消除（AEC）：把扬声器播放的 TTS 从麦克风采集里减掉，再做端点检测 / 上行，
+避免对方自己的声音被当成我方开口而触发打断。
+- EchoReference：远端参考。PcmOutput 的输出回调把实际送进声卡的 PCM（48kHz）连同到达 DAC 的时刻
+  （monotonic）写进来，低通 + 抽取到 16kHz，按绝对时间存入环形缓冲
+- EchoCanceller：分块频域 NLMS（PBFDAF，10ms 子块、默认 64ms 回声尾长），
+  参考信号按采集时刻（CapturePacer 的 capture_ts）对齐后逐子块滤波：e = d - ŷ
+  双讲检测：滤波器收敛（平滑 ERLE 首次超过 DT_MIN_ERLE_DB，reset() 前一直有效）后，若麦克风能量明显高于
+  估计回声 + 底噪（近端有人说话）则暂停自适应；参考信号的功率估计照常更新，恢复自适应时步长不会失准
+  发散保护：某子块减完回声反而比麦克风更响（没有回声路径 / 路径突变时），该子块输出麦克风原样，自适应照常
+- 统计：ERLE（只在远端单讲、参考有声时计）与每帧 CPU 耗时（µs）
+依赖: numpy
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from joy_inside_py.player import OUTPUT_SR
+
+SR = 16000
+BLOCK_MS = 10             # 子块时长：各档上行帧时长（20/40/60/120ms）都是它的整数倍
+TAIL_MS = 64              # 回声尾长（滤波器覆盖的回声路径时长）
+MU = 0.5                  # 步长（按分块数归一化前）
+POWER_SMOOTH = 0.9        # 参考信号逐频点功率的平滑系数
+REF_ACTIVE_RMS = 1e-3     # 参考信号低于该 RMS 时视为远端静音，不自适应、不计 ERLE
+REG_RMS = 7e-3            # 步长归一化的正则项（按参考信号 RMS 计）：参考很弱的频点不致放大成巨大更新，
+                          # 否则没有回声路径时（戴耳机）滤波器会发散，把参考信号“消”进上行里
+DIVERGENCE_RATIO = 1.05   # 残差能量 > 麦克风能量 × 该值 → 本子块不减（估计回声在加噪声而不是消回声）
+DT_MIN_ERLE_DB = 6.0      # 平滑 ERLE 首次超过该值视为已收敛，之后才启用双讲检测
+DT_RATIO = 3.0            # 麦克风能量 > (估计回声 + 底噪) × 该值 → 判为双讲（约 5dB）
+DT_HANGOVER_BLOCKS = 15   # 双讲判定后保持的子块数（150ms，盖住字与字之间的短停顿）
+NOISE_RISE = 0.01         # 麦克风底噪估计（远端静音的子块上跟踪最小值）的上升系数，下降立即跟随
+ERLE_SMOOTH = 0.95
+REF_CAPACITY_MS = 2000
+REF_RESYNC_MS = 5.0       # 参考写入 / 读取时刻与连续位置偏差超过该值时重新锚定（否则按采样连续，时间戳抖动不影响对齐）
+LOWPASS_TAPS = 63
+
+
+def _lowpass(taps: int, cutoff: float) -> np.ndarray:
+    """窗函数法 FIR 低通，cutoff 为相对采样率的归一化截止频率（0~0.5）。"""
+    n = np.arange(taps) - (taps - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (h / h.sum()).astype(np.float32)
+
+
+class EchoReference:
+    """线程安全：push() 在声卡输出回调线程，read() 在推流线程。"""
+
+    def __init__(self, sample_rate: int = SR, out_rate: int = OUTPUT_SR, capacity_ms: int = REF_CAPACITY_MS):
+        if out_rate % sample_rate:
+            raise ValueError("输出采样率须为参考采样率的整数倍：%d / %d" % (out_rate, sample_rate))
+        self.sample_rate = sample_rate
+        self.factor = out_rate // sample_rate
+        self._h = _lowpass(LOWPASS_TAPS, 0.45 / self.factor)
+        self._hist = np.zeros(LOWPASS_TAPS - 1, dtype=np.float32)
+        self._phase = 0            # 下一块中第一个保留采样的偏移（抽取相位）
+        self._group_delay = (LOWPASS_TAPS - 1) / 2 / out_rate
+        self._ring = np.zeros(int(sample_rate * capacity_ms / 1000), dtype=np.float32)
+        self._wpos = None          # 下一个写入采样的绝对序号（monotonic 秒 × sample_rate）
+        self._lock = threading.Lock()
+        self.resyncs = 0
+
+    def push(self, pcm, t_start: float):
+        """pcm: 本次输出回调写给声卡的 int16 采样；t_start: 首个采样到达 DAC 的时刻（monotonic）。"""
+        x = np.concatenate([self._hist, pcm.astype(np.float32) * (1.0 / 32768.0)])
+        self._hist = x[-(LOWPASS_TAPS - 1):]
+        y = np.convolve(x, self._h, mode="valid")[self._phase::self.factor]
+        self._phase = (self._phase - pcm.size) % self.factor
+        # 扣除低通滤波器的群时延，参考采样与实际发声时刻对齐
+        start = int(round((t_start - self._group_delay) * self.sample_rate))
+        with self._lock:
+            if self._wpos is None or abs(start - self._wpos) > REF_RESYNC_MS * self.sample_rate / 1000:
+                if self._wpos is not None:
+                    self.resyncs += 1
+                    # 向前跳：中间没有播放数据，补零
+                    gap = min(max(0, start - self._wpos), self._ring.size)
+                    self._write(self._wpos, np.zeros(gap, dtype=np.float32))
+                self._wpos = start
+            self._write(self._wpos, y)
+            self._wpos += y.size
+
+    def _write(self, pos: int, y: np.ndarray):
+        n = self._ring.size
+        y = y[-n:]
+        i = pos % n
+        k = min(y.size, n - i)
+        self._ring[i:i + k] = y[:k]
+        self._ring[:y.size - k] = y[k:]
+
+    def read(self, start: int, n: int) -> np.ndarray:
+        """取绝对序号 [start, start + n) 的参考采样；还没写到 / 已被覆盖的部分为 0。"""
+        out = np.zeros(n, dtype=np.float64)
+        with self._lock:
+            if self._wpos is None:
+                return out
+            lo = max(start, self._wpos - self._ring.size)
+            hi = min(start + n, self._wpos)
+            size = self._ring.size
+            pos = lo
+            while pos < hi:
+                i = pos % size
+                k = min(hi - pos, size - i)
+                out[pos - start:pos - start + k] = self._ring[i:i + k]
+                pos += k
+        return out
+
+
+class EchoCanceller:
+    """
+    process(block, capture_ts) 返回去掉回声后的 float32 采集块（一维，长度不变）；capture_ts 为块首采样的采集时刻。
+    bulk_delay_ms：参考信号相对时间戳的额外固定延迟（时间戳不准的后端可手动补偿）。
+    """
+
+    def __init__(self, reference: EchoReference = None, sample_rate: int = SR, block_ms: int = BLOCK_MS,
+                 tail_ms: int = TAIL_MS, mu: float = MU, bulk_delay_ms: float = 0.0):
+        self.reference = reference if reference is not None else EchoReference(sample_rate)
+        self.sample_rate = sample_rate
+        self.B = int(sample_rate * block_ms / 1000)
+        self.P = max(1, -(-int(sample_rate * tail_ms / 1000) // self.B))
+        self.mu = mu / self.P
+        self.bulk_delay = int(round(bulk_delay_ms * sample_rate / 1000))
+        bins = self.B + 1
+        self._W = np.zeros((self.P, bins), dtype=np.complex128)
+        self._X = np.zeros((self.P, bins), dtype=np.complex128)
+        self._power = np.full(bins, 1e-6)
+        self._delta = 2 * self.B * REG_RMS ** 2  # 2B 点 rfft 的逐频点功率
+        self._dt_hold = 0
+        self._converged = False
+        self._noise = None  # 麦克风底噪（每采样能量）
+        self._rpos = None  # 下一子块参考的绝对序号：采集时刻抖动不超过 REF_RESYNC_MS 时保持连续
+
+        # 统计
+        self.frames = 0
+        self.blocks = 0
+        self.cpu_ns = 0
+        self.erle_db = 0.0
+        self._erle_sum = 0.0
+        self._erle_n = 0
+        self.double_talk_blocks = 0
+        self.active_blocks = 0
+        self.bypass_blocks = 0
+
+    def reset(self):
+        self._W[:] = 0
+        self._X[:] = 0
+        self.erle_db = 0.0
+        self._converged = False
+
+    def process(self, block, capture_ts: float) -> np.ndarray:
+        t0 = time.perf_counter_ns()
+        d = block.reshape(-1).astype(np.float64)
+        out = d.astype(np.float32)
+        B = self.B
+        start = int(round(capture_ts * self.sample_rate)) - self.bulk_delay
+        if self._rpos is not None and abs(start - self._rpos) <= REF_RESYNC_MS * self.sample_rate / 1000:
+            start = self._rpos
+        self._rpos = start + d.size
+        # 帧长不是子块整数倍时，尾部不足一个子块的采样原样输出
+        for off in range(0, d.size // B * B, B):
+            out[off:off + B] = self._process_block(d[off:off + B], start + off)
+        self.frames += 1
+        self.cpu_ns += time.perf_counter_ns() - t0
+        return out
+
+    def _process_block(self, d: np.ndarray, start: int) -> np.ndarray:
+        B = self.B
+        x2 = self.reference.read(start - B, 2 * B)  # 上一子块 + 当前子块
+        self._X[1:] = self._X[:-1]
+        self._X[0] = np.fft.rfft(x2)
+        y = np.fft.irfft((self._W * self._X).sum(axis=0), 2 * B)[B:]
+        e = d - y
+        self.blocks += 1
+        d_energy = float(np.dot(d, d))
+        e_energy = float(np.dot(e, e))
+        out = e
+        if e_energy > DIVERGENCE_RATIO * d_energy:
+            out = d
+            self.bypass_blocks += 1
+
+        x_energy = float(np.dot(x2[B:], x2[B:])) / B
+        if x_energy < REF_ACTIVE_RMS ** 2:
+            level = d_energy / B
+            if self._noise is None or level < self._noise:
+                self._noise = level
+            else:
+                self._noise += NOISE_RISE * (level - self._noise)
+            return out
+
+        self.active_blocks += 1
+        X0 = self._X[0]
+        self._power = POWER_SMOOTH * self._power + (1 - POWER_SMOOTH) * (X0.real ** 2 + X0.imag ** 2)
+        y_energy = float(np.dot(y, y))
+        floor = (self._noise or 0.0) * B
+        # 近端开口：麦克风明显比估计回声 + 底噪响（不看本子块 ERLE：回声路径突变时它也会骤降，会被误判成双讲）
+        if self._converged and d_energy > DT_RATIO * (y_energy + floor):
+            self._dt_hold = DT_HANGOVER_BLOCKS
+        if self._dt_hold:
+            self._dt_hold -= 1
+            self.double_talk_blocks += 1
+            return out
+
+        # 远端单讲：统计 ERLE 并自适应
+        erle = 10 * np.log10((d_energy + 1e-12) / (e_energy + 1e-12))
+        self.erle_db = ERLE_SMOOTH * self.erle_db + (1 - ERLE_SMOOTH) * erle
+        self._erle_sum += erle
+        self._erle_n += 1
+        if self.erle_db > DT_MIN_ERLE_DB:
+            self._converged = True
+
+        E = np.fft.rfft(np.concatenate([np.zeros(B), e]))
+        G = self.mu * np.conj(self._X) * (E / (self._power + self._delta))
+        # 梯度约束：只保留前 B 个时域系数（线性卷积，而非循环卷积）
+        g = np.fft.irfft(G, 2 * B, axis=1)
+        g[:, B:] = 0
+        self._W += np.fft.rfft(g, axis=1)
+        return out
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "us_per_frame": self.cpu_ns / self.frames / 1000 if self.frames else float("nan"),
+            "us_per_block": self.cpu_ns / self.blocks / 1000 if self.blocks else float("nan"),
+            "erle_db": self.erle_db,
+            "erle_mean_db": self._erle_sum / self._erle_n if self._erle_n else float("nan"),
+            "double_talk_pct": 100.0 * self.double_talk_blocks / self.active_blocks if self.active_blocks else 0.0,
+            "bypass_pct": 100.0 * self.bypass_blocks / self.blocks if self.blocks else 0.0,
+            "ref_resyncs": self.reference.resyncs,
+        }
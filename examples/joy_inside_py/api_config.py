@@ -11,3 +11,9 @@ URL_VOICE_CHAT = "wss://joyinside.jd.com/soulmate/voiceChat/v1"
 BYTES_PER_MS = 16000 * 2 / 1000  # 16000的采样率，16bits=2bytes， 1000ms
 FRAME_MS = 120  # websocket一个数据帧
 BYTES_PER_FRAME = int(BYTES_PER_MS * FRAME_MS)  # 一个数据帧的大小
+FRAME_MS_CHOICES = (20, 40, 60, 120)  # 可按会话选择的帧时长：帧越短说完后等待越少，但每帧开销占比越高
+
+
+def frame_bytes(frame_ms):
+    """帧时长（ms）对应的数据帧大小"""
+    return int(BYTES_PER_MS * frame_ms)
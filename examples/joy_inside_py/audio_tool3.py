@@ -1,177 +1,190 @@
-# -*- coding: utf-8 -*-
-"""
-麦克风推流（JSON + base64），支持半双工：
-- gate_can_send(): 对方说话时返回 False → 我方暂停推流
-- request_interrupt(): 我在对方说话时开口 → 先发 CLIENT_INTERRUPT 再继续
-依赖: sounddevice, numpy
-"""
-
-import time
-import queue
-import json
-import base64
-import numpy as np
-import uuid
-
-from joy_inside_py.api_config import BYTES_PER_FRAME, FRAME_MS
-
-# 采样参数
-SR = 16000
-CHANNELS = 1
-SAMPLE_WIDTH = 2  # PCM16
-FRAME_SAMPLES = max(1, BYTES_PER_FRAME // (SAMPLE_WIDTH * CHANNELS))
-
-# 语音检测 & 结束判定
-ENERGY_THRESH = 0.01     # 开口门限
-SILENCE_MS = 700         # 判定"说完"的静音时间
-INTERRUPT_DEBOUNCE_MS = 800  # 打断节流（避免狂发）
-
-try:
-    import sounddevice as sd
-except Exception as e:
-    sd = None
-    print("[send_audio] sounddevice 导入失败：", e)
-
-
-def _float32_to_pcm16_bytes(block: np.ndarray) -> bytes:
-    block = np.clip(block, -1.0, 1.0)
-    int16 = (block * 32767.0).astype(np.int16)
-    raw = int16.tobytes()
-    if len(raw) > BYTES_PER_FRAME:
-        raw = raw[:BYTES_PER_FRAME]
-    elif len(raw) < BYTES_PER_FRAME:
-        raw = raw + b"\x00" * (BYTES_PER_FRAME - len(raw))
-    return raw
-
-
-def _rms(block: np.ndarray) -> float:
-    return float(np.sqrt((block.astype(np.float32) ** 2).mean() + 1e-12))
-
-
-def _json_audio_frame(uid: str, index: int, b64: str) -> str:
-    return json.dumps({
-        "mid": str(uuid.uuid4()),
-        "contentType": "AUDIO",
-        "content": {
-            "audioBase64": b64,
-            "index": index
-        },
-        "uid": uid
-    }, ensure_ascii=False)
-
-
-def _json_client_finish() -> str:
-    return json.dumps({"contentType": "CLIENT_AUDIO_FINISH"})
-
-
-def _json_client_start(uid: str) -> str:
-    # 有些服务端在 needManualCall=true 模式下建议显式声明开始
-    return json.dumps({"mid": str(uuid.uuid4()), "contentType": "CLIENT_AUDIO_START", "uid": uid})
-
-
-def send_audio(ws,
-               uid: str,
-               gate_can_send=None,        # -> bool，None 表示永远允许发送
-               request_interrupt=None,    # -> callable()，我方在对方说话时开口；可为 None
-               audio_callback=None        # -> callable(bytes) -> bytes，音频处理回调；可为 None
-               ):
-    """
-    半双工推流主循环：
-    - gate_can_send() 为 False → 不推帧；若此时能量 > 阈值，且提供了 request_interrupt()，则打断一次
-    - 进入"说话"状态后持续推帧，静音 >= SILENCE_MS 时只发一次 CLIENT_AUDIO_FINISH
-    - audio_callback() 可用于处理音频数据，如检测语音结束
-    """
-    if sd is None:
-        print("[send_audio] 未检测到 sounddevice，无法采集麦克风。")
-        return
-
-    q = queue.Queue(maxsize=50)
-
-    def _cb(indata, frames, time_info, status):
-        if status:
-            pass
-        try:
-            q.put_nowait(indata.copy())
-        except queue.Full:
-            pass
-
-    with sd.InputStream(samplerate=SR, channels=CHANNELS, blocksize=FRAME_SAMPLES,
-                        dtype='float32', callback=_cb):
-        print(f"[send_audio] 推流开始：{SR}Hz, {CHANNELS}ch, 帧≈{FRAME_MS}ms（{BYTES_PER_FRAME}B/帧）")
-
-        talking = False
-        last_voice_ts = time.time()
-        index = 0
-        last_interrupt_ts = 0.0
-
-        frame_interval = FRAME_MS / 1000.0
-        last_sent = time.time()
-
-        while True:
-            try:
-                block = q.get(timeout=1.0)
-            except queue.Empty:
-                continue
-
-            energy = _rms(block)
-            now = time.time()
-
-            # 如果有音频回调，处理音频数据
-            pcm = _float32_to_pcm16_bytes(block)
-            if audio_callback:
-                try:
-                    audio_callback(pcm)
-                except Exception as e:
-                    print("[AUDIO_CALLBACK][ERR]", e)
-
-            # —— 半双工门控：对方在讲，我方先别发；若我确实开口可请求打断 ——
-            can_send = True if gate_can_send is None else bool(gate_can_send())
-            if not can_send:
-                if energy > ENERGY_THRESH and request_interrupt is not None:
-                    if (now - last_interrupt_ts) * 1000 >= INTERRUPT_DEBOUNCE_MS:
-                        request_interrupt()
-                        last_interrupt_ts = now
-                time.sleep(0.01)
-                continue  # 不推流
-
-            # —— 我方开口的起点（从静默进入说话）——
-            if not talking and energy > ENERGY_THRESH:
-                talking = True
-                last_voice_ts = now
-                index = 0
-                # 可选：声明开始（服务端如有建议）
-                start_msg = _json_client_start(uid)
-                ws.send(start_msg)
-                print("[TX-TEXT]", start_msg)
-                print("[send_audio] CLIENT_AUDIO_START")
-
-            if not talking:
-                # 还没开口
-                time.sleep(0.005)
-                continue
-
-            # —— 持续推帧 —— 
-            b64 = base64.b64encode(pcm).decode("ascii")
-            payload = _json_audio_frame(uid, index, b64)
-            ws.send(payload)
-            if index % 10 == 0:
-                print(f"序号: {index}, 音频字节数: {len(pcm)}")
-            index += 1
-
-            if energy > ENERGY_THRESH:
-                last_voice_ts = now
-
-            # —— 结束判定：静音超阈值 → 只发一次 FINISH —— 
-            if (now - last_voice_ts) * 1000 >= SILENCE_MS:
-                ws.send(_json_client_finish())
-                print("[send_audio] CLIENT_AUDIO_FINISH")
-                talking = False
-                # 给服务端一点收尾时间，避免尾部噪声又被当成新一句
-                time.sleep(0.15)
-
-            # 节奏对齐
-            now2 = time.time()
-            sleep_left = frame_interval - (now2 - last_sent)
-            if sleep_left > 0:
-                time.sleep(sleep_left)
-            last_sent = time.time()
\ No newline at end of file
+# -*- coding: utf-8 -*-
+"""
+麦克风推流（JSON + base64），支持半双工：
+- gate_can_send(): 对方说话时返回 False → 我方暂停推流
+- request_interrupt(): 我在对方说话时开口 → 先发 CLIENT_INTERRUPT 再继续
+- speech_events(kind, ts): 开口 / 说完时回调，全双工打断与轮次时延统计用（见 duplex.py）
+依赖: sounddevice, numpy
+"""
+
+import functools
+import queue
+import time
+
+from joy_inside_py.api_config import BYTES_PER_FRAME, FRAME_MS, frame_bytes
+from joy_inside_py.preroll import PreRollBuffer, PREROLL_MS
+from joy_inside_py.codec import UplinkSender
+from joy_inside_py.endpointer import Endpointer
+from joy_inside_py.pacer import CapturePacer
+from joy_inside_py.protocol import CLIENT_AUDIO_START, client_audio_finish, control
+from joy_inside_py.duplex import SPEECH_START, SPEECH_FIRST_FRAME, SPEECH_END
+
+# 采样参数
+SR = 16000
+CHANNELS = 1
+SAMPLE_WIDTH = 2  # PCM16
+FRAME_SAMPLES = max(1, BYTES_PER_FRAME // (SAMPLE_WIDTH * CHANNELS))
+
+# 语音检测 & 结束判定（自适应噪底 + 频谱特征，见 endpointer.py）
+HANGOVER_MS = 300        # 开口后连续非语音多久判定"说完"
+INTERRUPT_DEBOUNCE_MS = 800  # 打断节流（避免狂发）
+
+try:
+    import sounddevice as sd
+except Exception as e:
+    sd = None
+    print("[send_audio] sounddevice 导入失败：", e)
+
+
+def _json_client_finish() -> str:
+    return client_audio_finish()
+
+
+def _json_client_start(uid: str) -> str:
+    # 有些服务端在 needManualCall=true 模式下建议显式声明开始
+    return control(uid, CLIENT_AUDIO_START)
+
+
+def _notify(speech_events, kind: str, ts: float):
+    if speech_events is None:
+        return
+    try:
+        speech_events(kind, ts)
+    except Exception as e:
+        print("[SPEECH_EVENTS][ERR]", e)
+
+
+def _first_frame_sent(speech_events, on_sent=None):
+    """首帧的 on_sent：写入 WS 后再通知 SPEECH_FIRST_FRAME。"""
+    def _cb():
+        if on_sent is not None:
+            on_sent()
+        _notify(speech_events, SPEECH_FIRST_FRAME, time.monotonic())
+    return _cb
+
+
+def send_audio(ws,
+               uid: str,
+               gate_can_send=None,        # -> bool，None 表示永远允许发送
+               request_interrupt=None,    # -> callable()，我方在对方说话时开口；可为 None
+               audio_callback=None,       # -> callable(bytes, EndpointFrame)，音频处理回调；可为 None
+               preroll_ms=PREROLL_MS,     # 开口前回看时长（ms），0 表示不回看
+               frame_ms=FRAME_MS,         # 上行帧时长（ms），见 api_config.FRAME_MS_CHOICES
+               pacer=None,                # 可传入 CapturePacer，以便外部读取发送滞后统计
+               aec=None,                  # 可传入 aec.EchoCanceller：端点检测 / 上行前先减掉扬声器回声
+               audio_backend=None,        # 提供 InputStream 的 sounddevice 兼容对象（如 loopback.VirtualDevices），None 用 sounddevice
+               speech_events=None,        # -> callable(kind, capture_ts)，我方开口 / 首帧发出 / 说完（见 duplex.SPEECH_*）
+               codec="pcm",               # 上行编码："pcm" / "opus"（需服务端支持，不可用时回退 PCM）
+               stop_event=None            # threading.Event，set 后推流循环在 1 帧内退出；None 表示一直推到发送失败
+               ):
+    """
+    推流主循环（全双工时 gate_can_send 恒为 True，打断由调用方在 speech_events 里决定）：
+    - gate_can_send() 为 False → 不推帧；若此时检测到语音，且提供了 request_interrupt()，则打断一次；
+      说到一半被门控截断时先发 CLIENT_AUDIO_FINISH 结束本句，下一句重新 START、序号从 0 开始
+    - 端点检测判定开口后持续推帧，判定说完（HANGOVER_MS）时只发一次 CLIENT_AUDIO_FINISH
+    - audio_callback(pcm, vad) 与推流共用同一帧的端点检测结果（EndpointFrame），可用于检测语音结束
+    - 采集块到达即处理、即发送，不再 sleep 对齐；每帧发送滞后记在 pacer 上（超过两帧时长会告警）
+    """
+    backend = audio_backend if audio_backend is not None else sd
+    if backend is None:
+        print("[send_audio] 未检测到 sounddevice，无法采集麦克风。")
+        return
+
+    # 本会话的帧参数：采集块大小、节奏、编码长度都按 frame_ms 走
+    bytes_per_frame = frame_bytes(frame_ms)
+    frame_samples = max(1, bytes_per_frame // (SAMPLE_WIDTH * CHANNELS))
+
+    if pacer is None:
+        pacer = CapturePacer(SR, lag_warn_ms=2 * frame_ms)
+
+    # 上行发送器：复用编码缓冲，逐帧只改写负载 / mid / index；压缩编码在独立线程上进行，推流结束（含异常）时关闭
+    with backend.InputStream(samplerate=SR, channels=CHANNELS, blocksize=frame_samples,
+                        dtype='float32', callback=pacer.callback), \
+            UplinkSender(ws, uid, frame_ms, codec) as sender:
+        print(f"[send_audio] 推流开始：{SR}Hz, {CHANNELS}ch, 帧≈{frame_ms}ms（{bytes_per_frame}B/帧）, "
+              f"编码 {sender.codec.name}")
+
+        talking = False
+        index = 0
+        last_interrupt_ts = 0.0
+        # 开口前的回看缓冲：开口后先冲刷，避免首个音节被截掉
+        preroll = PreRollBuffer(preroll_ms, frame_ms, frame_samples)
+        endpointer = Endpointer(frame_ms=frame_ms, hangover_ms=HANGOVER_MS)
+
+        while stop_event is None or not stop_event.is_set():
+            try:
+                paced = pacer.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            block = paced.block
+            if aec is not None:
+                # 去掉 TTS 回声后再判开口，避免自己的播放触发打断
+                block = aec.process(block, paced.capture_ts)
+
+            # 每帧只做一次端点检测（能量 / 噪底 / 频谱特征）
+            vad = endpointer.process(block)
+            now = paced.capture_ts  # 采集时刻（monotonic）
+
+            # 如果有音频回调，处理音频数据
+            pcm = sender.load_float32(block)
+            if audio_callback:
+                try:
+                    audio_callback(pcm, vad)
+                except Exception as e:
+                    print("[AUDIO_CALLBACK][ERR]", e)
+
+            # —— 半双工门控：对方在讲，我方先别发；若我确实开口可请求打断 ——
+            can_send = True if gate_can_send is None else bool(gate_can_send())
+            if not can_send:
+                if talking:
+                    # 说到一半门控关闭：先结束本句，否则服务端等不到 FINISH，序号也会接到下一句上
+                    sender.send_text(_json_client_finish())
+                    print("[send_audio] CLIENT_AUDIO_FINISH（门控关闭，本句截断）")
+                    _notify(speech_events, SPEECH_END, now)
+                    talking = False
+                    endpointer.reset()  # 门控打开后需重新满足开口条件才算新一句
+                if vad.is_speech and request_interrupt is not None:
+                    if (now - last_interrupt_ts) * 1000 >= INTERRUPT_DEBOUNCE_MS:
+                        request_interrupt()
+                        last_interrupt_ts = now
+                preroll.clear()  # 对方说话期间的音频不作为下一句的开头
+                continue  # 不推流
+
+            # —— 我方开口的起点（端点检测进入说话状态）——
+            if not talking and vad.in_speech:
+                talking = True
+                index = 0
+                # 可选：声明开始（服务端如有建议）
+                start_msg = _json_client_start(uid)
+                sender.send_text(start_msg)
+                print("[TX-TEXT]", start_msg)
+                print("[send_audio] CLIENT_AUDIO_START")
+                _notify(speech_events, SPEECH_START, now)
+                # 先按时间顺序补发开口前的回看帧
+                n_pre = len(preroll)
+                for pre in preroll.drain():
+                    sender.send_frame(index, pre, on_sent=_first_frame_sent(speech_events) if index == 0 else None)
+                    index += 1
+                if n_pre:
+                    print(f"[send_audio] pre-roll {n_pre} 帧（{n_pre * frame_ms}ms）")
+
+            if not talking:
+                # 还没开口：写入回看缓冲
+                preroll.push(block)
+                continue
+
+            # —— 持续推帧 —— 
+            on_sent = functools.partial(pacer.sent, paced)
+            if index == 0:
+                on_sent = _first_frame_sent(speech_events, on_sent)
+            sender.send_frame(index, on_sent=on_sent)
+            if index % 10 == 0:
+                print(f"序号: {index}, 音频字节数: {len(pcm)}, 发送滞后: {pacer.last_lag_ms:.1f}ms")
+            index += 1
+
+            # —— 结束判定：端点检测判定说完 → 只发一次 FINISH（尾部噪声需重新满足开口条件才算新一句）——
+            if vad.end:
+                sender.send_text(_json_client_finish())
+                print(f"[send_audio] CLIENT_AUDIO_FINISH（判定时延 {vad.latency_ms:.0f}ms）")
+                _notify(speech_events, SPEECH_END, now)
+                talking = False
\ No newline at end of file
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+上行音频编码层（PCM16 / Opus 可插拔）：
+- PcmCodec：原样 PCM16（默认），与原协议逐字节一致；编码零拷贝，直接在推流线程内完成
+- OpusCodec：libopus（opuslib）16kHz 单声道 VOIP 模式，默认 24kbps，约为 PCM16（256kbps）的 1/10
+- make_codec()：未安装 opuslib / 帧长不被 Opus 支持时回退 PCM 并打印原因
+- UplinkSender：ws + AudioFrameEncoder + 编码器；PCM 在调用线程直接发送，压缩编码交给独立的编码线程，
+  采集/端点检测循环不被编码耗时拖慢；控制消息与音频帧走同一队列，发送顺序不变；
+  ws 带 queued 标记（send_queue.ConnectionWriter / reconnect.UplinkRelay）时只入队，
+  on_sent 在该帧真正交给底层 ws.send 后才调用（发送滞后统计不失真）
+
+压缩格式需服务端支持（AUDIO 消息 content.audioFormat 标明格式），不确定时保持默认 "pcm"
+依赖: numpy；opuslib + libopus（可选）
+"""
+
+import functools
+import queue
+import threading
+
+from joy_inside_py.api_config import FRAME_MS, frame_bytes
+from joy_inside_py.frame_encoder import AudioFrameEncoder
+
+try:
+    import opuslib
+except Exception as e:
+    opuslib = None
+    _OPUS_IMPORT_ERROR = e
+
+SR = 16000
+CHANNELS = 1
+OPUS_BITRATE = 24000
+OPUS_FRAME_MS = (10, 20, 40, 60, 80, 100, 120)  # libopus >= 1.2 支持 80~120ms 多帧包
+OPUS_MAX_PACKET = 1275                          # 每 20ms 子帧的最大包长
+SEND_QUEUE_SIZE = 50
+
+CODECS = ("pcm", "opus")
+
+_STOP = object()
+
+
+class PcmCodec:
+    name = "pcm"
+    audio_format = None  # 不带 audioFormat 字段
+    inline = True
+
+    def __init__(self, frame_ms: float = FRAME_MS):
+        self.frame_ms = frame_ms
+        self.max_packet_bytes = frame_bytes(frame_ms)
+
+    def encode(self, pcm):
+        return pcm
+
+
+class OpusCodec:
+    name = "opus"
+    audio_format = "opus"
+    inline = False
+
+    def __init__(self, frame_ms: float = FRAME_MS, bitrate: int = OPUS_BITRATE):
+        if opuslib is None:
+            raise RuntimeError("opuslib 导入失败：%s" % _OPUS_IMPORT_ERROR)
+        if frame_ms not in OPUS_FRAME_MS:
+            raise ValueError("Opus 不支持 %sms 帧" % frame_ms)
+        self.frame_ms = frame_ms
+        self.frame_samples = int(SR * frame_ms / 1000)
+        self.max_packet_bytes = OPUS_MAX_PACKET * max(1, int(frame_ms + 19) // 20)
+        self._enc = opuslib.Encoder(SR, CHANNELS, opuslib.APPLICATION_VOIP)
+        self._enc.bitrate = bitrate
+
+    def encode(self, pcm) -> bytes:
+        """整帧 PCM16 → 一个 Opus 包。"""
+        return self._enc.encode(bytes(pcm), self.frame_samples)
+
+
+def make_codec(name: str = "pcm", frame_ms: float = FRAME_MS, **kwargs):
+    if name == "pcm":
+        return PcmCodec(frame_ms)
+    if name == "opus":
+        try:
+            return OpusCodec(frame_ms, **kwargs)
+        except Exception as e:
+            print("[codec] Opus 不可用，回退 PCM：", e)
+            return PcmCodec(frame_ms)
+    raise ValueError("未知编码: %s（可选 %s）" % (name, ", ".join(CODECS)))
+
+
+class UplinkSender:
+    """
+    单个会话的上行发送器（推流线程使用）。
+    send_frame() 的 on_sent 在该帧交给 ws.send 之后调用（压缩编码时在编码线程上）。
+    编码线程发送失败后，后续 send_text / send_frame 会在调用线程抛出同一异常。
+    推流结束时 close()（或用 with）结束编码线程，否则每个会话留下一条空等的线程。
+    """
+
+    def __init__(self, ws, uid: str, frame_ms: float = FRAME_MS, codec="pcm"):
+        self.ws = ws
+        self._queued = getattr(ws, "queued", False)
+        self.codec = make_codec(codec, frame_ms) if isinstance(codec, str) else codec
+        self.encoder = AudioFrameEncoder(uid, frame_bytes(frame_ms),
+                                         self.codec.audio_format, self.codec.max_packet_bytes)
+        self.frames_sent = 0
+        self.bytes_sent = 0  # 音频消息的 JSON 字节数
+        self._error = None
+        self._closed = False
+        self._q = None
+        if not self.codec.inline:
+            self._q = queue.Queue(maxsize=SEND_QUEUE_SIZE)
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def load_float32(self, block) -> memoryview:
+        return self.encoder.load_float32(block)
+
+    def send_text(self, message):
+        if self._q is None:
+            self.ws.send(message)
+            return
+        self._check()
+        self._q.put((None, message, None))
+
+    def send_frame(self, index: int, pcm=None, on_sent=None):
+        """pcm 为 None 时发送最近一次 load_float32 的数据。"""
+        if self._q is None:
+            self._send_audio(self.encoder.encode(index, pcm), on_sent)
+            return
+        self._check()
+        # 工作缓冲 / 回看环形缓冲都会被复用，交给编码线程前先拷贝
+        self._q.put((index, bytes(self.encoder.pcm if pcm is None else pcm), on_sent))
+
+    def close(self):
+        """已排队的帧发完后编码线程退出；可重复调用。编码线程已因发送失败退出时直接返回（队列可能已满）。"""
+        if self._q is not None and not self._closed and self._error is None:
+            self._closed = True
+            self._q.put((None, _STOP, None))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def _send_audio(self, data, on_sent):
+        if self._queued:
+            self.ws.send(data, on_sent=functools.partial(self._sent, len(data), on_sent))
+            return
+        self.ws.send(data)
+        self._sent(len(data), on_sent)
+
+    def _sent(self, nbytes, on_sent):
+        self.frames_sent += 1
+        self.bytes_sent += nbytes
+        if on_sent is not None:
+            on_sent()
+
+    def _worker(self):
+        while True:
+            index, item, on_sent = self._q.get()
+            if item is _STOP:
+                return
+            try:
+                if index is None:
+                    self.ws.send(item)
+                    continue
+                self._send_audio(self.encoder.encode_payload(index, self.codec.encode(item)), on_sent)
+            except Exception as e:
+                print("[codec][ERR]", e)
+                self._error = e
+                return
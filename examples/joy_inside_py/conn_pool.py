@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+预热连接池：提前建好若干条已鉴权、带心跳的语音 WebSocket，新会话直接取用，首轮不再串行等 DNS / TCP / TLS / 升级 / 鉴权
+- VoiceConnectionPool(url, bot_id, token_fn, size, uid)：后台线程把空闲连接补到 size 条；每条连接建连时生成自己的
+  sessionId / requestId（URL 在握手时就定了），取用的会话沿用这两个 ID
+- 空闲连接：写线程（send_queue.ConnectionWriter）+ 登记到共享心跳时间轮，PING 携带 uid（不传时用连接的 requestId），
+  下行消息按 contentType 解析，PONG 交给心跳（按 mid 配对），其余丢弃；
+  空闲超过 max_idle_s 的连接主动关掉换新（服务端可能按空闲超时断开），被对端断开的从池里移除并补上
+- take()：有就绪连接立即返回（命中），没有返回 None（未命中，调用方自己直连；池照常在后台补）
+- PooledConnection.hand_over(target, uid, on_dead)：交给会话，之后的下行消息 / 错误 / 关闭转给 target（on_message / on_error / on_close），
+  心跳的 uid 与失活回调换成会话自己的
+- 建连失败按 reconnect.Backoff 退避，不空转
+- 统计：命中 / 未命中、就绪数、建连次数与握手耗时（命中即省下的时延）、失败、到期换新、空闲时被断开数
+依赖: websocket-client
+"""
+
+import threading
+import time
+import uuid
+
+import websocket
+
+from joy_inside_py.event_handler import ping
+from joy_inside_py.protocol import PONG, decode
+from joy_inside_py.reconnect import Backoff
+from joy_inside_py.send_queue import ConnectionWriter
+from joy_inside_py.timeline import Histogram
+
+POOL_SIZE = 2          # 保持就绪的空闲连接数
+MAX_IDLE_S = 240.0     # 空闲连接最长保留时间，超过即换新
+MAINTAIN_TICK_S = 1.0  # 后台线程检查间隔（连接关闭 / 被取走时立即唤醒）
+
+
+class PooledConnection:
+    def __init__(self, pool, url: str, bot_id: str, token: str):
+        self.pool = pool
+        self.session_id = bot_id + str(uuid.uuid4())  # 同官方示例：sessionId = BOT_ID + UUID
+        self.request_id = str(uuid.uuid4())
+        self.app = websocket.WebSocketApp(
+            "%s?botId=%s&sessionId=%s&requestId=%s" % (url, bot_id, self.session_id, self.request_id),
+            header=["Authorization: Bearer " + token],
+            on_open=self._on_open,
+            on_message=self._on_message,
+            on_error=self._on_error,
+            on_close=self._on_close,
+        )
+        self.writer = None
+        self.heartbeat = None
+        self.target = None
+        self._lock = threading.Lock()  # hand_over 与 _on_close 互斥：交出去之前关掉的连接不会交给会话
+        self.opened = False
+        self.closed = threading.Event()
+        self.started_ts = time.monotonic()
+        self.ready_ts = None
+        self._thread = threading.Thread(target=self._run, name="pool-conn", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        # 读线程：连接的整个生命周期（含交给会话之后）都在这里；ping_timeout 让 close() 后及时退出
+        self.app.run_forever(ping_timeout=1)
+        if not self.closed.is_set():
+            self._on_close(self.app, None, None)
+
+    def hand_over(self, target, uid: str, on_dead=None) -> bool:
+        """交给会话：之后的回调转给 target。连接已关闭时返回 False（调用方改走直连）。"""
+        with self._lock:
+            if self.closed.is_set():
+                return False
+            self.heartbeat.uid = uid
+            self.heartbeat.on_dead = on_dead
+            self.writer.name = "tx"
+            self.target = target
+            return True
+
+    def close(self):
+        # 先停心跳：关闭过程中不再往正在关的连接上发 PING
+        if self.heartbeat is not None:
+            self.heartbeat.close()
+        self.app.close()
+
+    # ---------- WebSocketApp 回调（读线程）----------
+    def _on_open(self, ws):
+        self.opened = True
+        self.ready_ts = time.monotonic()
+        self.writer = ConnectionWriter(ws, name="pool")
+        self.heartbeat = ping(self.writer, self.pool.uid or self.request_id, on_dead=self.pool._on_dead)
+        self.pool._on_ready(self)
+
+    def _on_message(self, ws, message):
+        target = self.target
+        if target is not None:
+            target.on_message(ws, message)
+        elif isinstance(message, str):
+            msg = decode(message)
+            if msg is not None and msg.content_type == PONG:
+                self.heartbeat.pong(msg.data.get("mid"))
+
+    def _on_error(self, ws, error):
+        target = self.target
+        if target is not None:
+            target.on_error(ws, error)
+        else:
+            print("[pool][ERR]", error)
+
+    def _on_close(self, ws, close_status_code, close_msg):
+        with self._lock:
+            if self.closed.is_set():
+                return
+            self.closed.set()
+            target = self.target
+        if target is not None:
+            target.on_close(ws, close_status_code, close_msg)
+            return
+        if self.heartbeat is not None:
+            self.heartbeat.close()
+        if self.writer is not None:
+            self.writer.stop()
+        self.pool._on_closed(self)
+
+
+class VoiceConnectionPool:
+    """
+    token_fn() -> str | None：每次建连时调用（传缓存 token 的取法，如 auth_token_demo.get_cached_token）。
+    uid：空闲连接心跳 PING 携带的用户 ID，一般与取用连接的会话相同；交给会话后换成会话自己的。
+    """
+
+    def __init__(self, url: str, bot_id: str, token_fn, size: int = POOL_SIZE, max_idle_s: float = MAX_IDLE_S,
+                 uid: str = None):
+        self.url = url
+        self.bot_id = bot_id
+        self.token_fn = token_fn
+        self.uid = uid
+        self.size = size
+        self.max_idle_s = max_idle_s
+        self._cond = threading.Condition()
+        self._ready = []           # 就绪的空闲连接（先建好的先取走）
+        self._connecting = set()
+        self._backoff = Backoff(attempts=None)  # 池不放弃：退避封顶后一直重试
+        self._next_try = 0.0
+        self._running = False
+        self._thread = None
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.connects = 0
+        self.failures = 0
+        self.recycled = 0
+        self.lost = 0
+        self._connect_ms = Histogram("pool_connect")  # 有界样本 + 全程计数 / 均值 / 最大值
+
+    # ---------- 对外 ----------
+    def start(self):
+        with self._cond:
+            if self._running:
+                return self
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="conn-pool", daemon=True)
+        self._thread.start()
+        return self
+
+    def wait_ready(self, n: int = None, timeout: float = None) -> bool:
+        """等到至少 n 条（默认 size 条）就绪。"""
+        n = self.size if n is None else n
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self._ready) >= n, timeout)
+
+    def take(self):
+        """取一条就绪连接；没有就绪的返回 None（未命中）。"""
+        with self._cond:
+            while self._ready:
+                conn = self._ready.pop(0)
+                if conn.closed.is_set():
+                    continue
+                self.hits += 1
+                self._cond.notify_all()  # 立即补上
+                return conn
+            self.misses += 1
+            self._cond.notify_all()
+            return None
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            conns = self._ready + list(self._connecting)
+            self._ready = []
+            self._cond.notify_all()
+        for conn in conns:
+            conn.close()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+
+    @property
+    def ready(self) -> int:
+        return len(self._ready)
+
+    # ---------- 后台补池 ----------
+    def _run(self):
+        while True:
+            expired = []
+            with self._cond:
+                if not self._running:
+                    return
+                now = time.monotonic()
+                for conn in list(self._ready):
+                    if now - conn.ready_ts > self.max_idle_s:
+                        self._ready.remove(conn)
+                        expired.append(conn)
+                        self.recycled += 1
+                deficit = self.size - len(self._ready) - len(self._connecting)
+                wait = MAINTAIN_TICK_S
+                if deficit > 0 and now < self._next_try:
+                    wait = min(wait, self._next_try - now)
+                    deficit = 0
+            for conn in expired:
+                conn.close()
+            for _ in range(max(0, deficit)):
+                self._connect()
+            with self._cond:
+                if self._running:
+                    self._cond.wait(wait)
+
+    def _connect(self):
+        token = self.token_fn()
+        if token is None:
+            print("[pool] 获取 token 失败")
+            self._failed()
+            return
+        conn = PooledConnection(self, self.url, self.bot_id, token)
+        with self._cond:
+            if not self._running:
+                return
+            self._connecting.add(conn)
+            self.connects += 1
+        conn.start()
+
+    def _failed(self):
+        with self._cond:
+            self.failures += 1
+            self._next_try = time.monotonic() + self._backoff.next()
+
+    # ---------- 连接回调（各连接的读线程）----------
+    def _on_ready(self, conn):
+        with self._cond:
+            self._connecting.discard(conn)
+            self._connect_ms.add((conn.ready_ts - conn.started_ts) * 1000)
+            self._backoff.reset()
+            stale = not self._running
+            if not stale:
+                self._ready.append(conn)
+                self._cond.notify_all()
+        if stale:
+            conn.close()
+
+    def _on_closed(self, conn):
+        failed = False
+        with self._cond:
+            if conn in self._connecting:
+                self._connecting.discard(conn)
+                failed = not conn.opened
+            elif conn in self._ready:
+                self._ready.remove(conn)
+                self.lost += 1
+            self._cond.notify_all()
+        if failed:
+            self._failed()
+
+    def _on_dead(self, hb):
+        # 空闲连接心跳失活：关掉，_on_closed 里移出并补上（时间轮线程上回调，关连接另起线程）
+        with self._cond:
+            conns = [c for c in self._ready if c.heartbeat is hb]
+        for conn in conns:
+            threading.Thread(target=conn.close, daemon=True).start()
+
+    # ---------- 统计 ----------
+    def stats(self) -> dict:
+        with self._cond:
+            ms = self._connect_ms
+            taken = self.hits + self.misses
+            return {
+                "size": self.size,
+                "ready": len(self._ready),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / taken if taken else float("nan"),
+                "connects": self.connects,
+                "connect_ms": ms.total_ms / ms.n if ms.n else float("nan"),
+                "connect_max_ms": ms.max_ms if ms.n else float("nan"),
+                "failures": self.failures,
+                "recycled": self.recycled,
+                "lost": self.lost,
+            }
+
+
+def format_pool_stats(pool: VoiceConnectionPool) -> str:
+    s = pool.stats()
+    return ("hits %d / misses %d (hit rate %.0f%%), ready %d/%d, %d connects, handshake mean %.0fms (max %.0fms), "
+            "failures %d, recycled %d, lost while idle %d") % (
+        s["hits"], s["misses"], 100 * s["hit_rate"], s["ready"], s["size"], s["connects"], s["connect_ms"],
+        s["connect_max_ms"], s["failures"], s["recycled"], s["lost"])
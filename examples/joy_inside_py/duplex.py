@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+双工模式与轮次时延统计：
+- HALF_DUPLEX（默认）：对方说话期间不推流，我方开口只触发 CLIENT_INTERRUPT（原有行为）
+- FULL_DUPLEX：对方说话期间照常推流，由 barge_in 决定谁来打断：
+    BARGE_IN_CLIENT  本地端点检测判定我方开口 → 立即发 CLIENT_INTERRUPT 并停播
+    BARGE_IN_SERVER  只推流，等服务端下发 INTERRUPT 事件再停播
+  全双工依赖回声消除（aec.py），否则扬声器里的 TTS 会被当成我方开口
+- TurnMetrics：按模式统计
+    轮次时延   我方说完（发 CLIENT_AUDIO_FINISH 的采集时刻）→ 对方首句 TTS_SENTENCE_START
+    打断时延   对方说话期间我方开口（CLIENT_AUDIO_START 的采集时刻）→ 打断生效（本地发出 / 收到服务端 INTERRUPT）
+  时刻统一用 time.monotonic()
+依赖: 无
+"""
+
+import threading
+
+from joy_inside_py.timeline import percentile
+
+HALF_DUPLEX = "half"
+FULL_DUPLEX = "full"
+DUPLEX_MODES = (HALF_DUPLEX, FULL_DUPLEX)
+
+BARGE_IN_CLIENT = "client"
+BARGE_IN_SERVER = "server"
+BARGE_IN_CHOICES = (BARGE_IN_CLIENT, BARGE_IN_SERVER)
+
+# send_audio 的 speech_events(kind, capture_ts) 回调
+SPEECH_START = "start"              # 发出 CLIENT_AUDIO_START
+SPEECH_FIRST_FRAME = "first_frame"  # 本句首个音频帧已写入 WS（ts 为写入时刻，可能在编码线程上回调）
+SPEECH_END = "end"                  # 发出 CLIENT_AUDIO_FINISH
+
+
+def mode_label(duplex: str, barge_in: str = BARGE_IN_CLIENT) -> str:
+    if duplex not in DUPLEX_MODES:
+        raise ValueError("未知双工模式: %s（可选 %s）" % (duplex, ", ".join(DUPLEX_MODES)))
+    if barge_in not in BARGE_IN_CHOICES:
+        raise ValueError("未知打断方式: %s（可选 %s）" % (barge_in, ", ".join(BARGE_IN_CHOICES)))
+    return "half-duplex" if duplex == HALF_DUPLEX else "full-duplex/%s" % barge_in
+
+
+def _summary(xs) -> dict:
+    if not xs:
+        return {"n": 0, "mean": float("nan"), "p50": float("nan"), "p95": float("nan"), "max": float("nan")}
+    s = sorted(xs)
+    return {
+        "n": len(s),
+        "mean": sum(s) / len(s),
+        "p50": percentile(s, 50),
+        "p95": percentile(s, 95),
+        "max": s[-1],
+    }
+
+
+class TurnMetrics:
+    """线程安全：user_* 在推流线程，agent_* / interrupted 在 rx 线程。"""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._end_ts = None    # 我方说完、等对方开口
+        self._barge_ts = None  # 对方说话时我方开口、等打断生效
+        self.turn_ms = []
+        self.barge_in_ms = []
+        self.overlaps = 0      # 对方说话期间我方开口的次数
+        self.interrupts = {BARGE_IN_CLIENT: 0, BARGE_IN_SERVER: 0}
+
+    def user_start(self, ts: float, agent_speaking: bool):
+        with self._lock:
+            if agent_speaking and self._barge_ts is None:
+                self._barge_ts = ts
+                self.overlaps += 1
+
+    def user_end(self, ts: float):
+        with self._lock:
+            self._end_ts = ts
+
+    def agent_start(self, ts: float):
+        """对方每句开始都可调用，只有我方说完后的第一句计入轮次时延。"""
+        with self._lock:
+            if self._end_ts is not None:
+                self.turn_ms.append((ts - self._end_ts) * 1000)
+                self._end_ts = None
+
+    def agent_done(self):
+        """对方整轮结束：期间的开口没有引起打断，不再等待。"""
+        with self._lock:
+            self._barge_ts = None
+
+    def interrupted(self, ts: float, origin: str):
+        with self._lock:
+            self.interrupts[origin] += 1
+            if self._barge_ts is not None:
+                self.barge_in_ms.append(max(0.0, ts - self._barge_ts) * 1000)
+                self._barge_ts = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "turn_ms": _summary(self.turn_ms),
+                "barge_in_ms": _summary(self.barge_in_ms),
+                "overlaps": self.overlaps,
+                "interrupts": dict(self.interrupts),
+            }
+
+    def format(self) -> str:
+        s = self.stats()
+        turn, barge = s["turn_ms"], s["barge_in_ms"]
+        if turn["n"]:
+            line = "%s: turn latency mean %.0fms, p50 %.0fms, p95 %.0fms, max %.0fms (n=%d)" % (
+                s["mode"], turn["mean"], turn["p50"], turn["p95"], turn["max"], turn["n"])
+        else:
+            line = "%s: no completed turns" % s["mode"]
+        line += "; interrupts client %d / server %d" % (s["interrupts"][BARGE_IN_CLIENT],
+                                                        s["interrupts"][BARGE_IN_SERVER])
+        if barge["n"]:
+            line += ", barge-in mean %.0fms, max %.0fms (n=%d of %d overlaps)" % (
+                barge["mean"], barge["max"], barge["n"], s["overlaps"])
+        return line
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+自适应端点检测（替代固定 ENERGY_THRESH + SILENCE_MS + sleep(0.15)）：
+- 每个采集块切成 20ms 子帧，向量化计算能量（dB）、谱平坦度、100~4000Hz 语音频带能量占比
+- 噪声底随环境自适应：低于噪底快速下调，非语音子帧缓慢上调
+- 子帧判为语音：高出噪底 SNR_DB 且频带占比高、谱平坦度低（稳态噪声/低频轰鸣的平坦度高或带外能量大）
+- 连续 ONSET_MS 语音 → 开口；开口后连续 HANGOVER_MS 非语音 → 说完
+- 说完事件附带判定时延（最后一个语音子帧结束到判定的音频时长）
+依赖: numpy
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from joy_inside_py.api_config import FRAME_MS
+
+SR = 16000
+SUBFRAME_MS = 20
+ONSET_MS = 60            # 连续语音多久判定开口
+HANGOVER_MS = 300        # 开口后连续非语音多久判定说完
+SNR_DB = 9.0             # 高出噪底多少 dB 才可能是语音
+MIN_ENERGY_DB = -55.0    # 绝对能量下限（dBFS），噪底也不会低于它
+FLATNESS_MAX = 0.45      # 谱平坦度上限（白噪声周期图约 0.56，浊音通常 < 0.3）
+BAND_RATIO_MIN = 0.5     # 100~4000Hz 能量占比下限（低于 100Hz 多为空调/车载轰鸣）
+NOISE_DOWN = 0.3         # 噪底下调系数（快）
+NOISE_UP = 0.02          # 噪底上调系数（慢，约 1s 时间常数）
+NOISE_UP_IN_SPEECH = 0.001
+
+# energy: 整块归一化 RMS；is_speech: 块内是否有语音子帧；silence_ms: 距最近语音子帧的静音时长
+# in_speech: 是否处于“说话中”状态；onset/end: 本块是否触发开口/说完；latency_ms: 说完判定时延
+EndpointFrame = namedtuple("EndpointFrame",
+                           ["energy", "is_speech", "silence_ms", "in_speech", "onset", "end", "latency_ms"])
+
+
+class Endpointer:
+    def __init__(self, sample_rate: int = SR, frame_ms: float = FRAME_MS,
+                 subframe_ms: int = SUBFRAME_MS,
+                 onset_ms: int = ONSET_MS,
+                 hangover_ms: int = HANGOVER_MS,
+                 snr_db: float = SNR_DB,
+                 min_energy_db: float = MIN_ENERGY_DB,
+                 flatness_max: float = FLATNESS_MAX,
+                 band_ratio_min: float = BAND_RATIO_MIN):
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.subframe_ms = subframe_ms
+        self.sub_len = int(sample_rate * subframe_ms / 1000)
+        self.onset_ms = onset_ms
+        self.hangover_ms = hangover_ms
+        self.snr_db = snr_db
+        self.min_energy_db = min_energy_db
+        self.flatness_max = flatness_max
+        self.band_ratio_min = band_ratio_min
+
+        self._window = np.hanning(self.sub_len).astype(np.float32)
+        freqs = np.fft.rfftfreq(self.sub_len, 1.0 / sample_rate)
+        self._band = (freqs >= 100) & (freqs <= 4000)
+
+        self.noise_db = min_energy_db
+        self.in_speech = False
+        self._speech_run_ms = 0.0
+        self._silence_ms = 0.0
+        self.decision_latencies_ms = []
+
+    def reset(self):
+        """保留噪底，只清空开口/说完状态。"""
+        self.in_speech = False
+        self._speech_run_ms = 0.0
+        self._silence_ms = 0.0
+
+    # ---------- 特征 ----------
+    def _features(self, x: np.ndarray):
+        k = x.size // self.sub_len
+        sub = x[:k * self.sub_len].reshape(k, self.sub_len)
+        energy = np.einsum("ij,ij->i", sub, sub) / self.sub_len
+        energy_db = 10.0 * np.log10(energy + 1e-10)
+        spec = np.abs(np.fft.rfft(sub * self._window, axis=1)) ** 2 + 1e-12
+        flatness = np.exp(np.log(spec).mean(axis=1)) / spec.mean(axis=1)
+        band_ratio = spec[:, self._band].sum(axis=1) / spec.sum(axis=1)
+        return energy, energy_db, flatness, band_ratio
+
+    # ---------- 对外 ----------
+    def process(self, block) -> EndpointFrame:
+        """block 为 float32（[-1, 1]）或 int16 的 ndarray / PCM16 bytes，长度任意（按 20ms 子帧处理）。"""
+        if isinstance(block, (bytes, bytearray, memoryview)):
+            block = np.frombuffer(block, dtype=np.int16)
+        x = block.reshape(-1)
+        if x.dtype == np.int16:
+            x = x.astype(np.float32) * (1.0 / 32768.0)
+        elif x.dtype != np.float32:
+            x = x.astype(np.float32)
+
+        energy, energy_db, flatness, band_ratio = self._features(x)
+        frame_energy = float(np.sqrt(energy.mean() + 1e-12)) if energy.size else 0.0
+        speech_mask = ((energy_db > max(self.noise_db, self.min_energy_db) + self.snr_db)
+                       & (flatness < self.flatness_max)
+                       & (band_ratio > self.band_ratio_min))
+
+        onset = end = False
+        latency_ms = None
+        k = energy.size
+        # 块内最后一个子帧之后不足 20ms 的尾巴（说完事件要等整块到齐后才能发出）
+        trailing_ms = x.size * 1000.0 / self.sample_rate - k * self.subframe_ms
+        for i, (e_db, is_sp) in enumerate(zip(energy_db.tolist(), speech_mask.tolist())):
+            # 噪底跟踪
+            if e_db < self.noise_db:
+                self.noise_db += NOISE_DOWN * (e_db - self.noise_db)
+            else:
+                self.noise_db += (NOISE_UP_IN_SPEECH if is_sp else NOISE_UP) * (e_db - self.noise_db)
+            self.noise_db = max(self.noise_db, self.min_energy_db)
+
+            if is_sp:
+                self._speech_run_ms += self.subframe_ms
+                self._silence_ms = 0.0
+                if not self.in_speech and self._speech_run_ms >= self.onset_ms:
+                    self.in_speech = True
+                    onset = True
+            else:
+                self._speech_run_ms = 0.0
+                self._silence_ms += self.subframe_ms
+                if self.in_speech and self._silence_ms >= self.hangover_ms:
+                    self.in_speech = False
+                    end = True
+                    # 判定时延 = 最后一个语音子帧结束 → 本块结束
+                    latency_ms = self._silence_ms + (k - i - 1) * self.subframe_ms + trailing_ms
+                    self.decision_latencies_ms.append(latency_ms)
+
+        return EndpointFrame(frame_energy, bool(speech_mask.any()), self._silence_ms,
+                             self.in_speech, onset, end, latency_ms)
@@ -1,24 +1,16 @@
 # -*- coding: utf-8 -*-
 
-import json
-import time
-import uuid
+from joy_inside_py.heartbeat import default_service
+from joy_inside_py.protocol import event
 
 
-def ping(ws, uid):
-    PING = {"mid": str(uuid.uuid4()), "contentType": "PING", "uid": uid}
-    while True:
-        ws.send(json.dumps(PING))
-        time.sleep(10)
+def ping(ws, uid, on_dead=None):
+    """
+    登记到进程共享的心跳服务（不再每个连接起一条 sleep 线程），立即返回 Heartbeat 句柄：
+    收到 PONG 调 pong()，连接关闭时调 close()；ws 应是连接的写线程（send_queue.ConnectionWriter），PING 只入队
+    """
+    return default_service().register(ws.send, uid, on_dead)
 
 
 def send_event_data(ws, uid, evenType, *args):
-    event_param = {
-        "mid": str(uuid.uuid4()),
-        "contentType": "EVENT",
-        "uid": uid,
-        "content": {
-            "eventType": evenType
-        }
-    }
-    ws.send(json.dumps(event_param))
+    ws.send(event(uid, evenType))
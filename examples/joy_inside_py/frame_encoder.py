@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+上行 AUDIO 帧编码器（预分配缓冲，逐帧不再 json.dumps / uuid4 / 字节拼接）：
+- load_float32(): float32 块就地裁剪、量化到预分配的 int16 缓冲，不足一帧补零
+- encode(): base64 结果直接写入预先序列化好的 JSON 模板中的固定槽位，只改写 mid / index
+- 输出与 audio_tool._json_audio_frame 逐字节一致（json.dumps 默认分隔符，ensure_ascii=False）：
+  {"mid": "<uuid>", "contentType": "AUDIO", "content": {"audioBase64": "<b64>", "index": <int>}, "uid": "<uid>"}
+- 返回值是内部缓冲的 memoryview（UTF-8 JSON，作为文本帧发送），下一次 load/encode 前有效
+- mid 形如 uuid4：每个编码器随机前缀 + 48 位递增计数，进程内外都不重复
+- 压缩编码（见 codec.py）走 encode_payload()：负载长度可变，content 里多一个 "audioFormat" 字段
+
+base64 用 binascii（C 实现）编码后整段写入槽位；逐元素的 numpy 就地 base64 实测反而更慢。
+依赖: numpy
+"""
+
+import binascii
+import json
+import uuid
+
+import numpy as np
+
+from joy_inside_py.api_config import BYTES_PER_FRAME
+
+_MID_LEN = 36
+_INDEX_MAX_LEN = 21  # 含负号的 64 位整数
+
+
+class AudioFrameEncoder:
+    def __init__(self, uid: str, frame_bytes: int = BYTES_PER_FRAME,
+                 audio_format: str = None, max_payload: int = None):
+        self.uid = uid
+        self.frame_bytes = frame_bytes
+        self.frame_samples = frame_bytes // 2
+        self.audio_format = audio_format
+
+        # PCM16 工作缓冲
+        self._pcm = np.zeros(self.frame_samples, dtype=np.int16)
+        self._pcm_bytes = memoryview(self._pcm).cast("B")
+        self._scratch = np.zeros(self.frame_samples, dtype=np.float32)
+
+        # JSON 模板：head | mid | mid_tail | b64 | index_head | index + tail
+        head = b'{"mid": "'
+        mid_tail = b'", "contentType": "AUDIO", "content": {"audioBase64": "'
+        index_head = b'", "index": '
+        self._index_head = index_head
+        fmt = b''
+        if audio_format is not None:
+            fmt = b', "audioFormat": ' + json.dumps(audio_format).encode("utf-8")
+        self._tail = fmt + b'}, "uid": ' + json.dumps(uid, ensure_ascii=False).encode("utf-8") + b'}'
+        b64_len = 4 * ((frame_bytes + 2) // 3)
+        b64_cap = max(b64_len, 4 * (((max_payload or 0) + 2) // 3))
+
+        self._mid_off = len(head)
+        self._b64_off = self._mid_off + _MID_LEN + len(mid_tail)
+        self._b64_end = self._b64_off + b64_len
+        self._index_off = self._b64_end + len(index_head)
+        self._b64_cap_end = self._b64_off + b64_cap
+
+        self._buf = bytearray(self._b64_cap_end + len(index_head) + _INDEX_MAX_LEN + len(self._tail))
+        self._buf[:self._mid_off] = head
+        self._buf[self._mid_off + _MID_LEN:self._b64_off] = mid_tail
+        self._buf[self._b64_end:self._index_off] = index_head
+        self._view = memoryview(self._buf)
+
+        base = str(uuid.uuid4())
+        self._buf[self._mid_off:self._mid_off + 24] = base[:24].encode("ascii")
+        self._mid_counter = int(base[24:], 16)
+
+    @property
+    def pcm(self) -> memoryview:
+        """最近一次 load 的 PCM16 数据。"""
+        return self._pcm_bytes
+
+    def load_float32(self, block) -> memoryview:
+        """float32 块（[-1, 1]）→ 内部 PCM16 缓冲，与 _float32_to_pcm16_bytes 结果一致。"""
+        src = block.reshape(-1)
+        n = min(src.size, self.frame_samples)
+        scratch = self._scratch[:n]
+        np.clip(src[:n], -1.0, 1.0, out=scratch)
+        np.multiply(scratch, 32767.0, out=scratch)
+        np.copyto(self._pcm[:n], scratch, casting="unsafe")
+        if n < self.frame_samples:
+            self._pcm[n:] = 0
+        return self._pcm_bytes
+
+    def load_pcm16(self, pcm) -> memoryview:
+        """PCM16 字节拷入内部缓冲；超出截断、不足补零。"""
+        n = min(len(pcm), self.frame_bytes)
+        self._pcm_bytes[:n] = pcm[:n]
+        if n < self.frame_bytes:
+            self._pcm_bytes[n:] = b"\x00" * (self.frame_bytes - n)
+        return self._pcm_bytes
+
+    def encode(self, index: int, pcm=None) -> memoryview:
+        """编码一帧。pcm 为 None 时使用最近一次 load 的数据；传入整帧 PCM16 时直接编码、不拷贝。"""
+        if pcm is None or len(pcm) != self.frame_bytes:
+            if pcm is not None:
+                self.load_pcm16(pcm)
+            pcm = self._pcm_bytes
+        buf = self._buf
+
+        self._mid_counter = (self._mid_counter + 1) & 0xFFFFFFFFFFFF
+        buf[self._mid_off + 24:self._mid_off + _MID_LEN] = b"%012x" % self._mid_counter
+        buf[self._b64_off:self._b64_end] = binascii.b2a_base64(pcm, newline=False)
+        buf[self._b64_end:self._index_off] = self._index_head  # 可能被 encode_payload 覆盖过
+
+        digits = b"%d" % index
+        pos = self._index_off + len(digits)
+        buf[self._index_off:pos] = digits
+        end = pos + len(self._tail)
+        buf[pos:end] = self._tail
+        return self._view[:end]
+
+    def encode_payload(self, index: int, payload) -> memoryview:
+        """编码一帧压缩负载（长度可变，不超过构造时的 max_payload）。"""
+        buf = self._buf
+        self._mid_counter = (self._mid_counter + 1) & 0xFFFFFFFFFFFF
+        buf[self._mid_off + 24:self._mid_off + _MID_LEN] = b"%012x" % self._mid_counter
+
+        b64 = binascii.b2a_base64(payload, newline=False)
+        pos = self._b64_off + len(b64)
+        if pos > self._b64_cap_end:
+            raise ValueError("负载超出预分配长度: %d 字节" % len(payload))
+        buf[self._b64_off:pos] = b64
+        for part in (self._index_head, b"%d" % index, self._tail):
+            end = pos + len(part)
+            buf[pos:end] = part
+            pos = end
+        return self._view[:pos]
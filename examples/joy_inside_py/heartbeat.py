@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+集中心跳：一个进程一条时间轮线程，替代“每个连接一个 sleep 循环的 ping 线程”
+- HeartbeatService：哈希时间轮（槽宽 TICK_S），每个在线会话 register() 一次，到期在时间轮线程上发 PING，
+  再按间隔排入下一槽；几千个会话也只占一条线程，空闲时线程按槽阻塞，不逐个唤醒
+- PING 经会话传入的 send（连接的串行发送入口，与推流 / 打断同一把锁或同一队列）发出，不与音频帧交错
+- Heartbeat（register 返回的句柄）：收到 PONG 时调 pong(mid)，连续 max_missed 次 PING 没等到 PONG
+  判为连接失活，注销并回调 on_dead；send 抛异常（连接已关）时直接注销；会话关闭时调 close()
+- PONG 按 mid 与最近一次 PING 配对：迟到的旧 PONG（对应已记为漏掉的 PING）不算数，不清零漏 PONG 计数、不计往返时延；
+  服务端不回显 mid（None）时按最近一次 PING 计
+- send / on_dead 在时间轮线程上执行，不能阻塞（需要关连接等耗时操作时另起线程）
+- 统计：在线会话数、已发 PING / 收到 PONG / 漏 PONG / 迟到 PONG 次数、PONG 往返时延
+依赖: 无
+"""
+
+import threading
+import time
+import uuid
+
+from joy_inside_py.protocol import PING, control
+
+HEARTBEAT_INTERVAL_S = 10.0  # 与原 ping 线程相同
+TICK_S = 0.5                 # 时间轮槽宽：心跳时刻的精度
+MAX_MISSED_PONGS = 3         # 连续这么多次 PING 没有回 PONG 判为失活（默认 30s）
+
+
+class Heartbeat:
+    """一个会话的心跳登记；由 HeartbeatService.register() 创建。"""
+
+    def __init__(self, service, send, uid: str, interval_s: float, on_dead=None):
+        self.service = service
+        self.send = send
+        self.uid = uid
+        self.interval_s = interval_s
+        self.on_dead = on_dead
+        self.alive = True
+        self.pings = 0
+        self.pongs = 0
+        self.missed = 0          # 连续未回 PONG 的 PING 数
+        self.rtt_ms = None       # 最近一次 PONG 往返时延
+        self._ping_ts = None     # 最近一次等待 PONG 的 PING 发出时刻
+        self._ping_mid = None    # 最近一次 PING 的 mid
+        self._slot = None        # 所在槽位与剩余圈数（时间轮线程维护）
+        self._rounds = 0
+
+    def pong(self, mid: str = None):
+        """收到 PONG（任意线程）。mid 与最近一次 PING 不符时忽略；服务端不回显 mid 时按最近一次 PING 计。"""
+        self.service._pong(self, mid)
+
+    def close(self):
+        """会话结束：注销，不再发 PING。"""
+        self.service.unregister(self)
+
+
+class HeartbeatService:
+    def __init__(self, interval_s: float = HEARTBEAT_INTERVAL_S, tick_s: float = TICK_S,
+                 max_missed: int = MAX_MISSED_PONGS):
+        self.interval_s = interval_s
+        self.tick_s = tick_s
+        self.max_missed = max_missed
+        self._slots = [set() for _ in range(max(2, int(round(interval_s / tick_s)) + 1))]
+        self._cond = threading.Condition()
+        self._cursor = 0         # 下一个要处理的槽
+        self._t0 = None          # 槽 0 的到期时刻；第 k 个槽在 _t0 + k * tick_s 到期
+        self._ticks = 0
+        self._thread = None
+        self._running = False
+        self._live = 0
+
+        # 统计
+        self.pings = 0
+        self.pongs = 0
+        self.missed = 0          # 累计漏掉的 PONG
+        self.stale = 0           # mid 对不上最近一次 PING 的迟到 PONG
+        self.dead = 0            # 判为失活的会话数
+        self.send_errors = 0
+        self._rtt_sum = 0.0      # 会话多时不逐个保存往返时延，只累计
+        self._rtt_n = 0
+        self._rtt_max = 0.0
+
+    # ---------- 登记 ----------
+    def register(self, send, uid: str, on_dead=None, interval_s: float = None) -> Heartbeat:
+        """send(message)：连接的串行发送入口；首个 PING 在下一个槽发出，之后每 interval_s 一次。"""
+        hb = Heartbeat(self, send, uid, interval_s or self.interval_s, on_dead)
+        with self._cond:
+            self._ensure_thread()
+            self._schedule(hb, 0.0)
+            self._live += 1
+        return hb
+
+    def unregister(self, hb: Heartbeat):
+        with self._cond:
+            if not hb.alive:
+                return
+            hb.alive = False
+            if hb._slot is not None:
+                self._slots[hb._slot].discard(hb)
+                hb._slot = None
+            self._live -= 1
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        self._thread = None
+
+    @property
+    def live(self) -> int:
+        return self._live
+
+    # ---------- 时间轮 ----------
+    def _ensure_thread(self):
+        if self._running:
+            return
+        self._running = True
+        self._t0 = time.monotonic()
+        self._ticks = 0
+        self._cursor = 0
+        self._thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+        self._thread.start()
+
+    def _schedule(self, hb: Heartbeat, delay_s: float):
+        """持 _cond 调用：delay_s 后（向上取整到槽）到期；超过一圈的按剩余圈数记。"""
+        ticks = max(1, -(-int(delay_s * 1000) // int(self.tick_s * 1000)))
+        n = len(self._slots)
+        # 当前槽正在 / 刚被处理，从下一个槽起算
+        slot = (self._cursor + ticks - 1) % n
+        hb._slot = slot
+        hb._rounds = (ticks - 1) // n
+        self._slots[slot].add(hb)
+
+    def _run(self):
+        n = len(self._slots)
+        while True:
+            with self._cond:
+                while self._running:
+                    delay = self._t0 + (self._ticks + 1) * self.tick_s - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if not self._running:
+                    return
+                self._ticks += 1
+                slot = self._slots[self._cursor]
+                due = []
+                for hb in list(slot):
+                    if hb._rounds:
+                        hb._rounds -= 1
+                        continue
+                    slot.discard(hb)
+                    hb._slot = None
+                    due.append(hb)
+                self._cursor = (self._cursor + 1) % n
+            for hb in due:
+                self._fire(hb)
+
+    def _fire(self, hb: Heartbeat):
+        now = time.monotonic()
+        dead = False
+        with self._cond:
+            if not hb.alive:
+                return
+            if hb._ping_ts is not None:
+                hb.missed += 1
+                self.missed += 1
+                dead = hb.missed >= self.max_missed
+            if dead:
+                hb.alive = False
+                self._live -= 1
+                self.dead += 1
+            else:
+                # 先记发出时刻与 mid 再发送：PONG 可能在 send 返回前就被读线程收到
+                hb._ping_ts = now
+                hb._ping_mid = str(uuid.uuid4())
+                hb.pings += 1
+                self.pings += 1
+                self._schedule(hb, hb.interval_s)
+        if dead:
+            print("[heartbeat] %s: 连续 %d 次 PING 未回 PONG，判为失活" % (hb.uid, hb.missed))
+            self._callback(hb)
+            return
+        try:
+            hb.send(control(hb.uid, PING, hb._ping_mid))
+        except Exception as e:
+            # 连接已关（或发送入口已停止）：不再重试，直接注销
+            with self._cond:
+                self.send_errors += 1
+                hb.pings -= 1
+                self.pings -= 1
+            self.unregister(hb)
+            print("[heartbeat] %s: 发送失败，已注销：%s" % (hb.uid, e))
+
+    def _pong(self, hb: Heartbeat, mid: str = None):
+        now = time.monotonic()
+        with self._cond:
+            if mid is not None and mid != hb._ping_mid:
+                self.stale += 1
+                return
+            hb.pongs += 1
+            self.pongs += 1
+            if hb._ping_ts is not None:
+                ms = (now - hb._ping_ts) * 1000
+                hb.rtt_ms = ms
+                self._rtt_sum += ms
+                self._rtt_n += 1
+                self._rtt_max = max(self._rtt_max, ms)
+            hb._ping_ts = None
+            hb.missed = 0
+
+    @staticmethod
+    def _callback(hb: Heartbeat):
+        if hb.on_dead is None:
+            return
+        try:
+            hb.on_dead(hb)
+        except Exception as e:
+            print("[heartbeat][on_dead][ERR]", e)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "live": self._live,
+                "pings": self.pings,
+                "pongs": self.pongs,
+                "missed": self.missed,
+                "stale": self.stale,
+                "dead": self.dead,
+                "send_errors": self.send_errors,
+                "rtt_ms": self._rtt_sum / self._rtt_n if self._rtt_n else float("nan"),
+                "rtt_max_ms": self._rtt_max if self._rtt_n else float("nan"),
+            }
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_service() -> HeartbeatService:
+    """进程内共享的心跳服务（首次 register 时才启动线程）。"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = HeartbeatService()
+        return _default
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+共享 HTTP 客户端（连接池 + keep-alive）：
+- 鉴权、设备注册、文本对话统一走同一个 requests.Session，复用到 joyinside.jd.com 的 TCP+TLS 连接
+- configure() 可调整连接池大小与超时，需在首次请求前调用才会作用于连接池
+依赖: requests
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 连接池 & 超时默认值
+POOL_CONNECTIONS = 4      # 缓存的主机数（同一域名只占 1 个）
+POOL_MAXSIZE = 16         # 每个主机保留的最大空闲连接数，按并发请求数设置
+CONNECT_TIMEOUT = 3.0     # 秒
+READ_TIMEOUT = 30.0       # 秒；流式对话为两次读之间的最长间隔
+MAX_RETRIES = 0           # 仅用于连接阶段失败的自动重试
+
+_session = None
+_session_lock = threading.Lock()
+_config = {
+    "pool_connections": POOL_CONNECTIONS,
+    "pool_maxsize": POOL_MAXSIZE,
+    "timeout": (CONNECT_TIMEOUT, READ_TIMEOUT),
+    "max_retries": MAX_RETRIES,
+}
+
+
+def configure(pool_connections=None, pool_maxsize=None, connect_timeout=None, read_timeout=None,
+              max_retries=None):
+    """调整连接池参数；已创建的 Session 会被关闭并在下次请求时按新参数重建。"""
+    global _session
+    with _session_lock:
+        if pool_connections is not None:
+            _config["pool_connections"] = pool_connections
+        if pool_maxsize is not None:
+            _config["pool_maxsize"] = pool_maxsize
+        if max_retries is not None:
+            _config["max_retries"] = max_retries
+        if connect_timeout is not None or read_timeout is not None:
+            connect, read = _config["timeout"]
+            _config["timeout"] = (connect if connect_timeout is None else connect_timeout,
+                                  read if read_timeout is None else read_timeout)
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=_config["pool_connections"],
+                                  pool_maxsize=_config["pool_maxsize"],
+                                  max_retries=_config["max_retries"])
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def post(url, **kwargs) -> requests.Response:
+    """与 requests.post 相同用法；未指定 timeout 时使用默认超时。
+    stream=True 时请用 with 包裹或读完响应，连接才会归还连接池。"""
+    kwargs.setdefault("timeout", _config["timeout"])
+    return get_session().post(url, **kwargs)
+
+
+def close():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
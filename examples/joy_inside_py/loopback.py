@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+虚拟声卡（离线测“嘴到耳”时延用）：接口与 sounddevice 的 InputStream / OutputStream 一致，
+可作为 send_audio / Mp3Player 的 audio_backend 传入，替代真实麦克风与扬声器
+- LoopbackSource：虚拟麦克风的信号源。play() 排入一段已知 PCM（16kHz float32），其余时间输出底噪；
+  按采样序号换算出每个采样的采集时刻，play() 返回该段“最后一个有声采样”的时刻（说完的真值）
+- LoopbackSink：虚拟扬声器。记录输出回调写出的每一块及其到达 DAC 的时刻，
+  onset() 按阈值找首个有声采样，locate() 用互相关在录音里定位一段已知参考音频
+- VirtualDevices：两个虚拟流的工厂；流由独立线程按绝对时刻节拍驱动（与声卡回调一样按块周期触发）
+时刻统一为 time.monotonic()
+依赖: numpy
+"""
+
+import threading
+import time
+import types
+
+import numpy as np
+
+NOISE_DBFS = -60.0         # 虚拟麦克风底噪（全零输入会让端点检测的噪底估计失真）
+ONSET_DBFS = -40.0         # 有声判定阈值（按 1ms 窗 RMS）
+OUTPUT_LATENCY_MS = 20.0   # 虚拟扬声器：写入 → 到达 DAC 的时延（对应真实设备的输出缓冲）
+ONSET_WINDOW_MS = 1.0
+
+
+def _dbfs(db: float) -> float:
+    return 10 ** (db / 20.0)
+
+
+def last_voiced_sample(pcm: np.ndarray, sample_rate: int, threshold_dbfs: float = ONSET_DBFS) -> int:
+    """最后一个有声窗的结束位置（采样序号）；整段无声返回 0。"""
+    win = max(1, int(sample_rate * ONSET_WINDOW_MS / 1000))
+    n = pcm.size // win * win
+    rms = np.sqrt((pcm[:n].astype(np.float64).reshape(-1, win) ** 2).mean(axis=1))
+    voiced = np.nonzero(rms > _dbfs(threshold_dbfs))[0]
+    return int((voiced[-1] + 1) * win) if voiced.size else 0
+
+
+def first_voiced_sample(pcm: np.ndarray, sample_rate: int, threshold_dbfs: float = ONSET_DBFS) -> int:
+    """首个有声窗的起始位置（采样序号）；没有返回 -1。"""
+    win = max(1, int(sample_rate * ONSET_WINDOW_MS / 1000))
+    n = pcm.size // win * win
+    rms = np.sqrt((pcm[:n].astype(np.float64).reshape(-1, win) ** 2).mean(axis=1))
+    voiced = np.nonzero(rms > _dbfs(threshold_dbfs))[0]
+    return int(voiced[0] * win) if voiced.size else -1
+
+
+class LoopbackSource:
+    def __init__(self, sample_rate: int = 16000, noise_dbfs: float = NOISE_DBFS, seed: int = 0):
+        self.sample_rate = sample_rate
+        self._noise = _dbfs(noise_dbfs)
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._pending = []        # [(pcm, 有声结束偏移, Event, 结果 dict)]
+        self._cur = None          # 正在输出的 (pcm, 已输出采样数)
+        self._t0 = None           # 序号 0 的采集时刻
+        self._pos = 0             # 下一个输出采样的序号
+        self.started = threading.Event()
+
+    def play(self, pcm: np.ndarray, timeout: float = 2.0) -> float:
+        """排入一段 float32 PCM，等它开始输出后返回其最后一个有声采样的采集时刻（monotonic）。"""
+        end = last_voiced_sample(pcm, self.sample_rate)
+        ready = threading.Event()
+        result = {}
+        with self._lock:
+            self._pending.append((pcm.astype(np.float32), end, ready, result))
+        if not ready.wait(timeout):
+            raise TimeoutError("虚拟麦克风未开始输出（输入流未启动？）")
+        return result["end_ts"]
+
+    def read(self, frames: int, t_first: float) -> np.ndarray:
+        """输入流线程：取下一块；t_first 为本块首采样的采集时刻。"""
+        out = (self._rng.standard_normal(frames) * self._noise).astype(np.float32)
+        with self._lock:
+            if self._t0 is None:
+                self._t0 = t_first
+                self.started.set()
+            filled = 0
+            while filled < frames:
+                if self._cur is None:
+                    if not self._pending:
+                        break
+                    pcm, end, ready, result = self._pending.pop(0)
+                    result["end_ts"] = self._t0 + (self._pos + filled + end) / self.sample_rate
+                    ready.set()
+                    self._cur = [pcm, 0]
+                pcm, off = self._cur
+                take = min(frames - filled, pcm.size - off)
+                out[filled:filled + take] += pcm[off:off + take]
+                filled += take
+                self._cur[1] += take
+                if self._cur[1] >= pcm.size:
+                    self._cur = None
+            self._pos += frames
+        return out
+
+
+class LoopbackSink:
+    def __init__(self, sample_rate: int = 48000):
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._blocks = []   # [(首采样到达 DAC 的时刻, int16 块)]
+        self.started = threading.Event()
+
+    def write(self, pcm: np.ndarray, dac_ts: float):
+        with self._lock:
+            self._blocks.append((dac_ts, pcm.copy()))
+        self.started.set()
+
+    def segment(self, after: float, duration_s: float):
+        """[after, after + duration_s) 内的连续录音：(首采样时刻, float32 数组)；还没录到时返回 (None, 空数组)。"""
+        with self._lock:
+            picked = []
+            for ts, pcm in self._blocks:
+                block_s = pcm.size / self.sample_rate
+                if ts + block_s <= after:
+                    continue
+                if ts >= after + duration_s:
+                    break
+                picked.append((ts, pcm))
+        if not picked:
+            return None, np.zeros(0, dtype=np.float32)
+        return picked[0][0], np.concatenate([p for _, p in picked]).astype(np.float32) * (1.0 / 32768.0)
+
+    def onset(self, after: float, duration_s: float = 10.0, threshold_dbfs: float = ONSET_DBFS):
+        """after 之后首个有声采样到达 DAC 的时刻；没有返回 None。"""
+        t0, x = self.segment(after, duration_s)
+        if t0 is None:
+            return None
+        skip = max(0, int(round((after - t0) * self.sample_rate)))
+        i = first_voiced_sample(x[skip:], self.sample_rate, threshold_dbfs)
+        return None if i < 0 else t0 + (skip + i) / self.sample_rate
+
+    def locate(self, reference: np.ndarray, after: float, duration_s: float = 10.0):
+        """
+        互相关：参考音频（float32，同采样率）在 after 之后录音中的起始时刻与归一化相关系数 (ts, score)；
+        录音不足一段参考时返回 (None, 0.0)。
+        """
+        t0, x = self.segment(after, duration_s)
+        ref = reference.astype(np.float64)
+        if t0 is None or x.size < ref.size:
+            return None, 0.0
+        skip = max(0, int(round((after - t0) * self.sample_rate)))
+        x = x[skip:].astype(np.float64)
+        if x.size < ref.size:
+            return None, 0.0
+        n = 1 << int(np.ceil(np.log2(x.size + ref.size)))
+        corr = np.fft.irfft(np.fft.rfft(x, n) * np.conj(np.fft.rfft(ref, n)), n)[:x.size - ref.size + 1]
+        # 按滑动窗能量归一化，避免被响度大但不相关的片段带偏
+        c2 = np.concatenate([[0.0], np.cumsum(x * x)])
+        energy = c2[ref.size:] - c2[:-ref.size]
+        score = corr / (np.sqrt(np.maximum(energy, 1e-12)) * np.linalg.norm(ref) + 1e-12)
+        k = int(np.argmax(score))
+        return t0 + (skip + k) / self.sample_rate, float(score[k])
+
+    def idle_for(self, seconds: float) -> bool:
+        """最近 seconds 秒写出的都是静音。"""
+        with self._lock:
+            if not self._blocks:
+                return True
+            last_ts = self._blocks[-1][0]
+            for ts, pcm in reversed(self._blocks):
+                if ts < last_ts - seconds:
+                    return True
+                if pcm.size and int(np.abs(pcm.astype(np.int32)).max()) > 32768 * _dbfs(ONSET_DBFS):
+                    return False
+        return False
+
+
+class _VirtualStream:
+    """按块周期触发回调的线程；回调签名同 sounddevice：callback(data, frames, time_info, status)。"""
+
+    def __init__(self, samplerate, blocksize, callback, name):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self._callback = callback
+        self._name = name
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        period = self.blocksize / self.samplerate
+        t0 = time.monotonic()
+        k = 0
+        while self._running:
+            k += 1
+            delay = t0 + k * period - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._tick(t0 + (k - 1) * period, t0 + k * period)
+
+
+class VirtualInputStream(_VirtualStream):
+    def __init__(self, source: LoopbackSource, samplerate, channels=1, blocksize=None, dtype="float32",
+                 callback=None, **_):
+        super().__init__(samplerate, blocksize, callback, "virtual-input")
+        self.source = source
+        self.channels = channels
+
+    def _tick(self, t_first, now):
+        # 虚拟时钟：块首采样在 t_first 被“采到”，块尾在 now；回调时刻即块尾
+        block = self.source.read(self.blocksize, t_first)
+        indata = np.repeat(block[:, None], self.channels, axis=1)
+        time_info = types.SimpleNamespace(inputBufferAdcTime=t_first, currentTime=now)
+        self._callback(indata, self.blocksize, time_info, None)
+
+
+class VirtualOutputStream(_VirtualStream):
+    def __init__(self, sink: LoopbackSink, latency_ms: float, samplerate, channels=1, dtype="int16",
+                 blocksize=None, callback=None, **_):
+        super().__init__(samplerate, blocksize, callback, "virtual-output")
+        self.sink = sink
+        self.channels = channels
+        self.dtype = dtype
+        self.latency_s = latency_ms / 1000.0
+
+    def _tick(self, _t_prev, now):
+        outdata = np.zeros((self.blocksize, self.channels), dtype=self.dtype)
+        dac = now + self.latency_s
+        time_info = types.SimpleNamespace(outputBufferDacTime=dac, currentTime=now)
+        self._callback(outdata, self.blocksize, time_info, None)
+        self.sink.write(outdata[:, 0], dac)
+
+
+class VirtualDevices:
+    """sounddevice 的替身：只提供 InputStream / OutputStream 两个工厂。"""
+
+    def __init__(self, source: LoopbackSource, sink: LoopbackSink, output_latency_ms: float = OUTPUT_LATENCY_MS):
+        self.source = source
+        self.sink = sink
+        self.output_latency_ms = output_latency_ms
+
+    def InputStream(self, **kwargs):
+        return VirtualInputStream(self.source, **kwargs)
+
+    def OutputStream(self, **kwargs):
+        return VirtualOutputStream(self.sink, self.output_latency_ms, **kwargs)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+本地 JoyInside 语音对话替身（/soulmate/voiceChat/v1），用于离线压测与回归：
+- 收到 CLIENT_AUDIO_FINISH（或文件模式下 index < 0 的末帧）后，按配置的延时依次下发
+  ASR → LLM 文本 → 每句 EVENT TTS_SENTENCE_START + 二进制 MP3 分片 + TTS_SENTENCE_COMPLETE → EVENT COMPLETE
+- PING 回 PONG；CLIENT_INTERRUPT 立即停止当前轮下发并回 EVENT INTERRUPT
+- handshake_ms：每次 WS 升级前额外等待（模拟公网 DNS / TLS / 鉴权的建连耗时，用于比较预热连接池）
+- drop()：直接掐断所有在线连接（不发 close 帧，模拟网络抖动），用于验证断线重连
+- barge_in_ms 不为 None 时模拟服务端打断（全双工）：下发回复期间收到 CLIENT_AUDIO_START，
+  barge_in_ms 后停止当前轮并下发 EVENT INTERRUPT
+- MP3 默认为 16kHz 单声道 32kbps 的静音帧，任何 MP3 解码器都能正常解码；
+  tts_mp3 可指定每句下发的 MP3（如 latency_bench.py 用有声音频测嘴到耳时延），宜用同样的 16kHz 32kbps 码流，分片节奏才与时长一致
+依赖: websockets
+"""
+
+import asyncio
+import json
+import uuid
+
+try:
+    import websockets
+except Exception as e:
+    websockets = None
+    print("[mock_server] websockets 导入失败：", e)
+
+VOICE_CHAT_PATH = "/soulmate/voiceChat/v1"
+
+# MPEG-2 Layer III, 32kbps, 16kHz, mono, 无 CRC；每帧 144 字节 / 576 采样（36ms）
+MP3_FRAME_HEADER = b"\xff\xf3\x48\xc0"
+MP3_FRAME_BYTES = 144
+MP3_FRAME_MS = 36
+
+
+def silent_mp3(duration_ms: int) -> bytes:
+    """生成时长约为 duration_ms 的静音 MP3（side info 全零 → 解码为静音）。"""
+    n = max(1, int(round(duration_ms / MP3_FRAME_MS)))
+    frame = MP3_FRAME_HEADER + b"\x00" * (MP3_FRAME_BYTES - len(MP3_FRAME_HEADER))
+    return frame * n
+
+
+class MockVoiceServer:
+    """
+    asr_delay_ms:       FINISH → ASR 结果
+    first_tts_delay_ms: ASR → 第一句 TTS_SENTENCE_START
+    sentences:          每轮回复的句数
+    sentence_ms:        每句音频时长
+    chunk_frames:       每个二进制分片包含的 MP3 帧数
+    realtime_tts:       True 时按音频时长节奏下发分片，False 时尽快下发
+    barge_in_ms:        服务端打断的判定时延（开口 → INTERRUPT）；None 表示只响应 CLIENT_INTERRUPT
+    tts_mp3:            每句下发的 MP3 字节；None 时按 sentence_ms 生成静音
+    handshake_ms:       每次握手额外等待的时长
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765,
+                 asr_delay_ms: int = 150,
+                 first_tts_delay_ms: int = 300,
+                 sentences: int = 2,
+                 sentence_ms: int = 1200,
+                 chunk_frames: int = 8,
+                 realtime_tts: bool = True,
+                 barge_in_ms: int = None,
+                 tts_mp3: bytes = None,
+                 handshake_ms: int = 0):
+        self.host = host
+        self.port = port
+        self.asr_delay_ms = asr_delay_ms
+        self.first_tts_delay_ms = first_tts_delay_ms
+        self.sentences = sentences
+        self.sentence_ms = sentence_ms
+        self.chunk_frames = chunk_frames
+        self.realtime_tts = realtime_tts
+        self.barge_in_ms = barge_in_ms
+        self._sentence_mp3 = tts_mp3 if tts_mp3 is not None else silent_mp3(sentence_ms)
+        self.handshake_ms = handshake_ms
+        self._server = None
+        self._conns = set()
+        self.connections = 0  # 累计接入的连接数
+
+    @property
+    def url(self) -> str:
+        return "ws://%s:%d%s" % (self.host, self.port, VOICE_CHAT_PATH)
+
+    # ---------- 下行消息 ----------
+    @staticmethod
+    def _event(event_type: str, **extra) -> str:
+        content = {"eventType": event_type}
+        content.update(extra)
+        return json.dumps({"mid": str(uuid.uuid4()), "contentType": "EVENT", "content": content},
+                          ensure_ascii=False)
+
+    async def _reply(self, ws):
+        """一轮完整回复；被取消即视为打断。"""
+        await asyncio.sleep(self.asr_delay_ms / 1000.0)
+        await ws.send(json.dumps({"mid": str(uuid.uuid4()), "contentType": "ASR",
+                                  "content": {"text": "本地测试语音"}}, ensure_ascii=False))
+        await asyncio.sleep(self.first_tts_delay_ms / 1000.0)
+        await ws.send(json.dumps({"mid": str(uuid.uuid4()), "contentType": "LLM",
+                                  "content": {"content": "好的"}}, ensure_ascii=False))
+
+        chunk_bytes = MP3_FRAME_BYTES * self.chunk_frames
+        chunk_s = MP3_FRAME_MS * self.chunk_frames / 1000.0
+        for i in range(self.sentences):
+            await ws.send(self._event("TTS_SENTENCE_START", text="第%d句" % (i + 1)))
+            for off in range(0, len(self._sentence_mp3), chunk_bytes):
+                await ws.send(self._sentence_mp3[off:off + chunk_bytes])
+                if self.realtime_tts:
+                    await asyncio.sleep(chunk_s)
+            await ws.send(self._event("TTS_SENTENCE_COMPLETE"))
+        await ws.send(self._event("COMPLETE"))
+
+    async def _barge_in(self, ws, reply):
+        await asyncio.sleep(self.barge_in_ms / 1000.0)
+        if not reply.done():
+            reply.cancel()
+            await ws.send(self._event("INTERRUPT"))
+
+    async def _handler(self, ws, path=None):
+        # websockets>=14 从 ws.request.path 取路径，旧版本作为参数传入
+        path = path or getattr(getattr(ws, "request", None), "path", "")
+        if not path.split("?", 1)[0].endswith(VOICE_CHAT_PATH):
+            await ws.close(1008, "unknown path")
+            return
+
+        reply = None
+        tasks = set()  # 本连接上的打断定时 task：持有引用防止被回收，连接关闭时一并取消
+        self._conns.add(ws)
+        self.connections += 1
+        try:
+            async for message in ws:
+                if isinstance(message, (bytes, bytearray)):
+                    continue
+                try:
+                    data = json.loads(message)
+                except json.JSONDecodeError:
+                    continue
+                ctype = data.get("contentType")
+
+                if ctype == "PING":
+                    await ws.send(json.dumps({"mid": data.get("mid"), "contentType": "PONG"}))
+                elif ctype == "CLIENT_INTERRUPT":
+                    if reply is not None and not reply.done():
+                        reply.cancel()
+                        await ws.send(self._event("INTERRUPT"))
+                elif ctype == "CLIENT_AUDIO_START":
+                    if self.barge_in_ms is not None and reply is not None and not reply.done():
+                        task = asyncio.create_task(self._barge_in(ws, reply))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                elif ctype == "CLIENT_AUDIO_FINISH" or (
+                        ctype == "AUDIO" and (data.get("content") or {}).get("index", 0) < 0):
+                    if reply is not None and not reply.done():
+                        reply.cancel()
+                    reply = asyncio.create_task(self._reply(ws))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._conns.discard(ws)
+            if reply is not None:
+                reply.cancel()
+            for task in tasks:
+                task.cancel()
+
+    # ---------- 启停 ----------
+    async def start(self):
+        self._server = await websockets.serve(self._handler, self.host, self.port, max_size=None,
+                                              process_request=self._process_request)
+        return self
+
+    async def _process_request(self, *_):
+        # websockets>=14 传 (connection, request)，旧版本传 (path, headers)；返回 None 继续握手
+        if self.handshake_ms:
+            await asyncio.sleep(self.handshake_ms / 1000.0)
+        return None
+
+    async def drop(self) -> int:
+        """掐断所有在线连接的 TCP（不走关闭握手），返回掐断的连接数。"""
+        conns = list(self._conns)
+        for ws in conns:
+            ws.transport.abort()
+        return len(conns)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self, ready=None):
+        """ready：可选的 threading / multiprocessing Event，开始监听后 set()，供另一进程等就绪。"""
+        await self.start()
+        print("[mock_server] listening:", self.url)
+        if ready is not None:
+            ready.set()
+        try:
+            await asyncio.Future()
+        finally:
+            await self.stop()
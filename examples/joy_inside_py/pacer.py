@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+采集 → 上行的节奏控制（替代 time.time() + last_sent 的二次 sleep 对齐）：
+- 采集块到达即发送：节奏由声卡采集本身决定，推流循环只阻塞在队列上，不再额外 sleep
+- 每块带采集时刻（time.monotonic 时基）：取声卡回调的 time_info.inputBufferAdcTime 换算到 monotonic，
+  再经二阶锁相环（DLL）平滑——回调抖动被滤掉，块周期随声卡时钟与系统时钟的漂移自动校正（无稳态偏差）；
+  溢出/丢块导致偏差过大时直接重新锚定
+- sent() 记录每帧发送滞后（块内最后一个采样被采到 → 送进 ws.send 的时长），
+  超过 lag_warn_ms 时限频打印，排队延迟不会悄悄累积
+依赖: 无（sounddevice 回调参数约定）
+"""
+
+import math
+import queue
+import time
+from collections import namedtuple
+
+SR = 16000
+QUEUE_SIZE = 50
+DLL_BANDWIDTH_HZ = 0.5    # 环路带宽：越小越平滑，越大越快跟上时钟漂移
+RESYNC_MS = 100.0         # 观测与推算偏差超过该值（丢块/溢出）直接重新锚定
+LAG_WARN_INTERVAL_S = 5.0
+
+# block: 采集数据；capture_ts: 块首采样的采集时刻（monotonic 秒）；end_ts: 块尾采样的采集时刻；
+# backlog: 取出时队列里还有多少块没处理
+PacedBlock = namedtuple("PacedBlock", ["block", "capture_ts", "end_ts", "backlog"])
+
+
+class CapturePacer:
+    def __init__(self, sample_rate: int = SR, lag_warn_ms: float = None, maxsize: int = QUEUE_SIZE,
+                 bandwidth_hz: float = DLL_BANDWIDTH_HZ):
+        self.sample_rate = sample_rate
+        self.bandwidth_hz = bandwidth_hz
+        self.lag_warn_ms = lag_warn_ms
+        self._q = queue.Queue(maxsize=maxsize)
+
+        # DLL 状态：_t0 本块采集时刻，_t1 预测的下一块时刻，_period 估计的块周期（秒）
+        self._t1 = None
+        self._period = 0.0
+        self._b = self._c = 0.0
+
+        # 统计
+        self.dropped = 0
+        self.overflows = 0
+        self.resyncs = 0
+        self.frames = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self._lag_sum_ms = 0.0
+        self._last_warn = 0.0
+
+    # ---------- 采集线程（声卡回调） ----------
+    def _capture_time(self, frames: int, time_info) -> float:
+        now = time.monotonic()
+        observed = None
+        if time_info is not None:
+            adc = getattr(time_info, "inputBufferAdcTime", 0.0)
+            cur = getattr(time_info, "currentTime", 0.0)
+            # 部分后端不提供 ADC 时刻（为 0），退化为回调时刻减去块时长
+            if adc and cur:
+                observed = now - (cur - adc)
+        if observed is None:
+            observed = now - frames / self.sample_rate
+
+        nominal = frames / self.sample_rate
+        if self._t1 is not None:
+            err = observed - self._t1
+            if abs(err) * 1000 <= RESYNC_MS:
+                # 块尾不可能晚于回调时刻
+                ts = min(self._t1, now - nominal)
+                self._t1 += self._b * err + self._period
+                self._period += self._c * err
+                return ts
+            self.resyncs += 1
+
+        # 首块或重新锚定：按名义周期初始化环路系数
+        w = 2 * math.pi * self.bandwidth_hz * nominal
+        self._b = math.sqrt(2) * w
+        self._c = w * w
+        self._period = nominal
+        self._t1 = observed + nominal
+        return observed
+
+    def callback(self, indata, frames, time_info, status):
+        """直接作为 sounddevice.InputStream 的 callback。"""
+        if status and getattr(status, "input_overflow", False):
+            self.overflows += 1
+        ts = self._capture_time(frames, time_info)
+        try:
+            self._q.put_nowait((indata.copy(), ts, ts + frames / self.sample_rate))
+        except queue.Full:
+            self.dropped += 1
+
+    # ---------- 推流线程 ----------
+    def get(self, timeout: float = None) -> PacedBlock:
+        """阻塞到下一块可用；超时抛 queue.Empty。"""
+        block, ts, end_ts = self._q.get(timeout=timeout)
+        return PacedBlock(block, ts, end_ts, self._q.qsize())
+
+    def sent(self, paced: PacedBlock) -> float:
+        """该块已交给 ws.send；返回并记录发送滞后（ms）。"""
+        now = time.monotonic()
+        lag_ms = (now - paced.end_ts) * 1000
+        self.frames += 1
+        self.last_lag_ms = lag_ms
+        self._lag_sum_ms += lag_ms
+        if lag_ms > self.max_lag_ms:
+            self.max_lag_ms = lag_ms
+        if self.lag_warn_ms is not None and lag_ms > self.lag_warn_ms and now - self._last_warn >= LAG_WARN_INTERVAL_S:
+            self._last_warn = now
+            print(f"[pacer][WARN] 发送滞后 {lag_ms:.0f}ms（积压 {paced.backlog} 块，丢弃 {self.dropped}，"
+                  f"溢出 {self.overflows}）")
+        return lag_ms
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "last_lag_ms": self.last_lag_ms,
+            "mean_lag_ms": self._lag_sum_ms / self.frames if self.frames else 0.0,
+            "max_lag_ms": self.max_lag_ms,
+            "backlog": self._q.qsize(),
+            "dropped": self.dropped,
+            "overflows": self.overflows,
+            "resyncs": self.resyncs,
+        }
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+进程内 MP3 流式播放（替代 ffplay 子进程）：
+- Mp3StreamDecoder：PyAV 增量解析 + 解码，任意切分的 MP3 字节流进，PCM16 单声道出（统一重采样到输出采样率）
+- PcmOutput：常驻 sounddevice 输出流，回调从 PCM 队列取数，无数据时输出静音；
+  flush() 只清空队列，下一个回调块（OUTPUT_BLOCK_MS）内即切到静音，不关流、不重建设备
+- Mp3Player：解码 + 输出，write() / clear() / stop()；clear() 不阻塞，解码器在下一次 write() 时重置
+- 统计起播时延（空闲时 write → 首个有声采样到达声卡）与停播时延（clear → 静音到达声卡），单位 ms；
+  clear(since=...) 可把起点提前到打断触发时刻，即“打断 → 静音”时延
+- Mp3FrameSplitter：按 MPEG 音频帧头把下行分片整理成整帧，收齐一帧即可送播，不必等整句
+依赖: av（PyAV）, sounddevice, numpy
+"""
+
+import collections
+import threading
+import time
+
+import numpy as np
+
+from joy_inside_py.timeline import Histogram
+
+try:
+    import av
+except Exception as e:
+    av = None
+    print("[player] av(PyAV) 导入失败：", e)
+
+try:
+    import sounddevice as sd
+except Exception as e:
+    sd = None
+    print("[player] sounddevice 导入失败：", e)
+
+OUTPUT_SR = 48000      # 输出设备采样率（各平台都支持），TTS 音频统一重采样到该采样率
+OUTPUT_BLOCK_MS = 20   # 输出回调块时长，即 flush 后最长多久切到静音
+
+
+# MPEG 音频帧头（只用于按整帧切分，不解码）：比特率表 kbps，索引 1~14
+_BITRATES = {
+    (True, 1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# 版本位：3=MPEG1, 2=MPEG2, 0=MPEG2.5
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def mp3_frame_length(h) -> int:
+    """4 字节帧头 → 整帧字节数；不是合法帧头返回 0，自由格式（无法从帧头得出长度）返回 -1。"""
+    if h[0] != 0xFF or (h[1] & 0xE0) != 0xE0:
+        return 0
+    version = (h[1] >> 3) & 3
+    layer = 4 - ((h[1] >> 1) & 3)
+    br_idx = h[2] >> 4
+    sr_idx = (h[2] >> 2) & 3
+    if version == 1 or layer == 4 or br_idx == 15 or sr_idx == 3:
+        return 0
+    if br_idx == 0:
+        return -1
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer if mpeg1 else min(layer, 2))][br_idx - 1] * 1000
+    sample_rate = _SAMPLE_RATES[version][sr_idx]
+    pad = (h[2] >> 1) & 1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + pad) * 4
+    if layer == 3 and not mpeg1:
+        return 72 * bitrate // sample_rate + pad
+    return 144 * bitrate // sample_rate + pad
+
+
+class Mp3FrameSplitter:
+    """
+    任意切分的 MP3 字节流 → 整帧：push() 返回本次凑齐的完整帧（可能为空），残帧留到下次；
+    ID3v2 标签与帧间杂字节被跳过；遇到自由格式码流则退化为原样透传。
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._skip = 0
+        self._passthrough = False
+
+    def reset(self):
+        self._buf.clear()
+        self._skip = 0
+        self._passthrough = False
+
+    def push(self, data) -> bytes:
+        if self._passthrough:
+            return bytes(data)
+        buf = self._buf
+        buf.extend(data)
+        n = len(buf)
+        pos = 0
+        out = bytearray()
+        while n - pos >= 4:
+            if self._skip:
+                k = min(self._skip, n - pos)
+                pos += k
+                self._skip -= k
+                continue
+            if buf[pos:pos + 3] == b"ID3":
+                if n - pos < 10:
+                    break
+                size = (buf[pos + 6] << 21) | (buf[pos + 7] << 14) | (buf[pos + 8] << 7) | buf[pos + 9]
+                self._skip = 10 + size + (10 if buf[pos + 5] & 0x10 else 0)
+                continue
+            length = mp3_frame_length(buf[pos:pos + 4])
+            if length < 0:
+                self._passthrough = True
+                out += buf[pos:]
+                pos = n
+                break
+            if length == 0:
+                pos += 1  # 不是帧头：逐字节重新找同步
+                continue
+            if n - pos < length:
+                break
+            out += buf[pos:pos + length]
+            pos += length
+        del buf[:pos]
+        return bytes(out)
+
+    def flush(self) -> bytes:
+        """取出剩余的残帧字节（句末调用），并清空。"""
+        tail = bytes(self._buf)
+        self._buf.clear()
+        self._skip = 0
+        return tail
+
+
+def _dac_delay(time_info) -> float:
+    """本次回调写入的数据还要多久才会被播放（秒）；后端不提供时返回 0。"""
+    if time_info is None:
+        return 0.0
+    dac = getattr(time_info, "outputBufferDacTime", 0.0)
+    cur = getattr(time_info, "currentTime", 0.0)
+    return max(0.0, dac - cur) if dac and cur else 0.0
+
+
+class Mp3StreamDecoder:
+    def __init__(self, sample_rate: int = OUTPUT_SR):
+        self.sample_rate = sample_rate
+        self.reset()
+
+    def reset(self):
+        """丢弃未解完的残帧和解码器状态（打断后新一轮从干净状态开始）。"""
+        self._ctx = av.CodecContext.create("mp3", "r")
+        self._resampler = av.AudioResampler(format="s16", layout="mono", rate=self.sample_rate)
+
+    def feed(self, data) -> list:
+        """喂入任意长度的 MP3 字节，返回已能解出的 PCM16 块（np.int16 一维数组）列表。"""
+        out = []
+        for packet in self._ctx.parse(bytes(data)):
+            for frame in self._ctx.decode(packet):
+                for rf in self._resampler.resample(frame):
+                    out.append(rf.to_ndarray().reshape(-1))
+        return out
+
+
+class PcmOutput:
+    def __init__(self, sample_rate: int = OUTPUT_SR, block_ms: int = OUTPUT_BLOCK_MS, backend=None):
+        """backend: 提供 OutputStream 的 sounddevice 兼容对象（如 loopback.VirtualDevices），None 用 sounddevice。"""
+        self.sample_rate = sample_rate
+        self.backend = backend if backend is not None else sd
+        self.blocksize = int(sample_rate * block_ms / 1000)
+        self._stream = None
+        self._lock = threading.Lock()
+        self._chunks = collections.deque()
+        self._offset = 0      # 队首块已播放的采样数
+        self._pending = 0     # 队列中未播放的采样数
+        self.generation = 0   # 每次 flush 加一，flush 前解出的旧数据不再入队
+        self._drained = threading.Event()
+        self._drained.set()
+
+        self._start_mark = None
+        self._flush_mark = None
+        self.tap = None  # callable(pcm, t)：每个输出块（含静音）连同到达 DAC 的时刻，供回声消除作参考
+        self.on_start = None  # callable(t)：空闲后首个有声采样到达 DAC 的时刻（逐轮时间线打点）
+        self.start_latency = Histogram("play_start")  # 只留最近 MAX_SAMPLES 个样本，计数 / 均值 / 最大值为全程累计
+        self.stop_latency = Histogram("play_stop")
+
+    @property
+    def pending_ms(self) -> float:
+        return self._pending * 1000.0 / self.sample_rate
+
+    def start(self):
+        if self._stream is not None or self.backend is None:
+            return
+        self._stream = self.backend.OutputStream(samplerate=self.sample_rate, channels=1, dtype="int16",
+                                       blocksize=self.blocksize, latency="low", callback=self._callback)
+        self._stream.start()
+
+    def write(self, pcm: np.ndarray, generation: int = None):
+        """追加 PCM16；generation 与当前不一致（期间发生过 flush）时丢弃。"""
+        if pcm.size == 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if self._pending == 0 and self._start_mark is None:
+                self._start_mark = time.monotonic()
+            self._chunks.append(pcm)
+            self._pending += pcm.size
+            self._drained.clear()
+
+    def flush(self, since: float = None):
+        """立即丢弃未播放的数据；不阻塞，下一个回调块起输出静音。since 为停播时延的起点（monotonic）。"""
+        with self._lock:
+            self.generation += 1
+            had_audio = self._pending > 0
+            self._chunks.clear()
+            self._offset = 0
+            self._pending = 0
+            self._start_mark = None
+            if had_audio:
+                self._flush_mark = since if since is not None else time.monotonic()
+            self._drained.set()
+
+    def wait_drained(self, timeout: float = None) -> bool:
+        return self._drained.wait(timeout)
+
+    def stop(self):
+        self.flush()
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            try:
+                stream.stop()
+                stream.close()
+            except Exception as e:
+                print("[player][ERR]", e)
+
+    def _callback(self, outdata, frames, time_info, status):
+        out = outdata[:, 0]
+        filled = 0
+        with self._lock:
+            chunks = self._chunks
+            while filled < frames and chunks:
+                head = chunks[0]
+                take = min(frames - filled, head.size - self._offset)
+                out[filled:filled + take] = head[self._offset:self._offset + take]
+                filled += take
+                self._offset += take
+                if self._offset >= head.size:
+                    chunks.popleft()
+                    self._offset = 0
+            self._pending -= filled
+            start_mark, flush_mark = self._start_mark, self._flush_mark
+            if filled:
+                self._start_mark = None
+            else:
+                self._flush_mark = None
+            if self._pending == 0:
+                self._drained.set()
+        out[filled:] = 0
+
+        heard_at = time.monotonic() + _dac_delay(time_info)
+        if self.tap is not None:
+            try:
+                self.tap(out, heard_at)
+            except Exception as e:
+                print("[player][tap][ERR]", e)
+        if filled and start_mark is not None:
+            self.start_latency.add((heard_at - start_mark) * 1000)
+            if self.on_start is not None:
+                try:
+                    self.on_start(heard_at)
+                except Exception as e:
+                    print("[player][on_start][ERR]", e)
+        elif not filled and flush_mark is not None:
+            self.stop_latency.add((heard_at - flush_mark) * 1000)
+
+
+class Mp3Player:
+    """线程安全：write() 在播放线程，clear() 可在任意线程（接收线程 / 推流线程）调用。"""
+
+    def __init__(self, sample_rate: int = OUTPUT_SR, block_ms: int = OUTPUT_BLOCK_MS, backend=None):
+        self.output = PcmOutput(sample_rate, block_ms, backend)
+        self._decoder = Mp3StreamDecoder(sample_rate) if av is not None else None
+        self._decode_lock = threading.Lock()
+        self._reset_pending = False
+        self._dropped_warned = False
+
+    @property
+    def available(self) -> bool:
+        return self._decoder is not None and self.output.backend is not None
+
+    def start(self):
+        self.output.start()
+
+    def write(self, mp3):
+        if not self.available:
+            # 缺依赖时 TTS 无法播放：首次丢弃时报一次错，避免“没声音”却无任何提示
+            if not self._dropped_warned:
+                self._dropped_warned = True
+                missing = "av(PyAV)" if self._decoder is None else "sounddevice(PortAudio)"
+                print("[player][ERR] 缺少 %s，TTS 音频无法播放，已丢弃；请安装后重试" % missing)
+            return
+        generation = self.output.generation
+        with self._decode_lock:
+            if self._reset_pending:
+                self._reset_pending = False
+                self._decoder.reset()
+            try:
+                pcm_list = self._decoder.feed(mp3)
+            except Exception as e:
+                print("[player][decode][ERR]", e)
+                self._decoder.reset()
+                return
+        for pcm in pcm_list:
+            self.output.write(pcm, generation)
+
+    def clear(self, since: float = None):
+        """停止当前播放并丢弃缓冲；不等待解码线程。since 见 PcmOutput.flush。"""
+        self.output.flush(since)
+        self._reset_pending = True
+
+    def wait_drained(self, timeout: float = None) -> bool:
+        return self.output.wait_drained(timeout)
+
+    def stop(self):
+        self.output.stop()
+
+    def stats(self) -> dict:
+        start, stop = self.output.start_latency, self.output.stop_latency
+        nan = float("nan")
+        return {
+            "starts": start.n,
+            "start_ms": start.total_ms / start.n if start.n else nan,
+            "stops": stop.n,
+            "stop_ms": stop.total_ms / stop.n if stop.n else nan,
+            "stop_max_ms": stop.max_ms if stop.n else nan,
+        }
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+开口前的 PCM 预录环形缓冲（pre-roll）：
+- 未开口时每帧写入固定大小、预先分配的 int16 环形缓冲（float32 块直接就地量化写入，不产生新数组）
+- CLIENT_AUDIO_START 之后先按时间顺序冲刷缓冲内容，再推当前帧，首个音节不再被截掉
+- drain() 产出的是环形缓冲上的 memoryview 切片，不拷贝数据；下一次 push 前需用完
+依赖: numpy
+"""
+
+import math
+
+import numpy as np
+
+PREROLL_MS = 360  # 默认回看时长
+
+
+class PreRollBuffer:
+    def __init__(self, lookback_ms: float, frame_ms: float, frame_samples: int):
+        self.frame_samples = frame_samples
+        self.capacity = int(math.ceil(lookback_ms / frame_ms)) if lookback_ms > 0 else 0
+        self._ring = np.zeros((max(1, self.capacity), frame_samples), dtype=np.int16)
+        self._scratch = np.zeros(frame_samples, dtype=np.float32)
+        self._bytes = memoryview(self._ring).cast("B")
+        self._frame_bytes = frame_samples * self._ring.itemsize
+        self._next = 0   # 下一个写入槽
+        self._count = 0  # 有效帧数
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def push(self, block):
+        """block 为 float32 ndarray（[-1, 1]）或 PCM16 bytes；超出/不足一帧时截断/补零。"""
+        if self.capacity == 0:
+            return
+        slot = self._ring[self._next]
+        if isinstance(block, (bytes, bytearray, memoryview)):
+            src = np.frombuffer(block, dtype=np.int16)
+            n = min(src.size, self.frame_samples)
+            slot[:n] = src[:n]
+        else:
+            src = block.reshape(-1)
+            n = min(src.size, self.frame_samples)
+            scratch = self._scratch[:n]
+            np.clip(src[:n], -1.0, 1.0, out=scratch)
+            np.multiply(scratch, 32767.0, out=scratch)
+            np.copyto(slot[:n], scratch, casting="unsafe")
+        if n < self.frame_samples:
+            slot[n:] = 0
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def drain(self):
+        """按时间先后产出缓冲中的各帧（PCM16 memoryview），然后清空。"""
+        start = (self._next - self._count) % self.capacity if self.capacity else 0
+        count = self._count
+        self.clear()
+        fb = self._frame_bytes
+        for i in range(count):
+            slot = (start + i) % self.capacity
+            yield self._bytes[slot * fb:(slot + 1) * fb]
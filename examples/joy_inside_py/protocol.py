@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+语音 WS 协议消息层：
+- 下行：decode() 把 JSON 文本帧解析成 Message（contentType / body 已取好，常用字段用属性访问）；
+  装了 orjson 时自动使用（解码更快，见 protocol_bench.py），否则回退标准库 json：
+  直接调用 C 扫描器，省掉 json.loads 的参数检查与首尾空白正则（首尾有空白等非常规输入仍交给 json.loads，结果与报错一致）；
+  省下的解码时间大多被 Message 封装抵消，未装 orjson 时 Dispatcher 整体只比改造前的 if/elif 快约 1.0~1.07 倍，
+  标准库后端的收益主要在查表分发的结构上，解码提速要靠 orjson
+- Dispatcher：按 contentType / eventType 查表分发，应用用 on() / on_event() 注册 handler，
+  取代 on_message 里层层 if/elif；记录每条消息的解码、查表耗时
+- 上行控制消息：按预生成模板拼字符串，与 json.dumps(dict) 逐字节一致，不再每条 json.dumps
+依赖: 无（标准库 json）；可选 orjson（pip install orjson，下行解码更快，未安装时自动回退）
+"""
+
+import json
+import time
+import uuid
+from collections import namedtuple
+from functools import lru_cache
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+_scan_once = json.JSONDecoder().scan_once
+
+
+def _json_loads(raw):
+    """标准库后端：常见的紧凑 JSON 文本直接过扫描器；其余（首尾空白 / bytes / 非法）交给 json.loads。"""
+    try:
+        data, end = _scan_once(raw, 0)
+        if end == len(raw):
+            return data
+    except (StopIteration, TypeError):
+        pass
+    return json.loads(raw)
+
+
+_BACKENDS = {"json": _json_loads}
+if orjson is not None:
+    _BACKENDS["orjson"] = orjson.loads
+JSON_BACKEND = "orjson" if orjson is not None else "json"  # 默认后端
+_loads = _BACKENDS[JSON_BACKEND]
+
+# contentType / eventType
+EVENT = "EVENT"
+ASR_PARTIAL = "ASR_PARTIAL"  # 中间结果；其余 ASR 类型视为定稿
+ASR_TYPES = ("ASR", "RESULT_ASR", ASR_PARTIAL)
+LLM_TYPES = ("LLM", "AGENT", "RESULT_TEXT", "TEXT")
+TTS_TYPES = ("TTS", "RESULT_AUDIO", "AUDIO")
+TTS_SENTENCE_START = "TTS_SENTENCE_START"
+INTERRUPT = "INTERRUPT"
+COMPLETE = "COMPLETE"
+SENTENCE_END_EVENTS = ("TTS_COMPLETE", "TTS_SENTENCE_COMPLETE", COMPLETE)
+
+PING = "PING"
+PONG = "PONG"
+CLIENT_AUDIO_START = "CLIENT_AUDIO_START"
+CLIENT_INTERRUPT = "CLIENT_INTERRUPT"
+CLIENT_AUDIO_FINISH = "CLIENT_AUDIO_FINISH"
+CLIENT_AUDIO_FINISH_MESSAGE = '{"contentType": "CLIENT_AUDIO_FINISH"}'
+
+
+# ---------- 下行 ----------
+class Message(namedtuple("Message", ["content_type", "body", "data"])):
+    """
+    一条下行 JSON 消息。body 为 content（缺省取 data 字段）且总是 dict；data 为完整的解析结果。
+    """
+    __slots__ = ()
+
+    @property
+    def event_type(self):
+        return self.body.get("eventType")
+
+    @property
+    def text(self) -> str:
+        """ASR / LLM 文本或 TTS 句首事件带的句子文本；没有时为空串。"""
+        body = self.body
+        if self.content_type == EVENT:
+            text = body.get("text") or (body.get("eventData") or {}).get("text")
+        elif self.content_type in LLM_TYPES:
+            text = body.get("content") or body.get("text")
+        else:
+            text = body.get("text") or body.get("result")
+        return text or ""
+
+    @property
+    def audio_b64(self):
+        body = self.body
+        return body.get("audio") or body.get("audioBase64") or body.get("chunk")
+
+    def dumps(self) -> str:
+        """日志用：完整消息转回 JSON 文本（保留中文）。"""
+        return json.dumps(self.data, ensure_ascii=False)
+
+
+_new_message = tuple.__new__  # 跳过 namedtuple 生成的 __new__（每条消息少一层 Python 调用）
+_now = time.perf_counter_ns
+
+
+def decode(raw, loads=_loads):
+    """JSON 文本帧 → Message；不是 JSON 对象时返回 None。"""
+    try:
+        data = loads(raw)
+    except ValueError:  # orjson.JSONDecodeError / json.JSONDecodeError 都是 ValueError
+        return None
+    if not isinstance(data, dict):
+        return None
+    body = data.get("content") or data.get("data") or {}
+    if not isinstance(body, dict):
+        body = {"content": body}
+    return _new_message(Message, (data.get("contentType"), body, data))
+
+
+def _as_tuple(keys):
+    return (keys,) if isinstance(keys, str) else tuple(keys)
+
+
+class Dispatcher:
+    """
+    下行消息分发表。handler(msg) 的返回值原样交还给调用方（asyncio 会话里可以是协程，由调用方 await）。
+    EVENT 先按 eventType 查表，查不到再按 contentType "EVENT" 查；都查不到走 on_default。
+    不是 JSON 对象的文本帧交给 on_invalid 注册的 handler(raw)。
+    backend 指定 JSON 解析后端（"json" / "orjson"），默认有 orjson 用 orjson。
+    """
+
+    def __init__(self, backend: str = None):
+        self.backend = backend or JSON_BACKEND
+        if self.backend not in _BACKENDS:
+            raise ValueError("JSON 后端不可用: %s（可用 %s）" % (self.backend, ", ".join(_BACKENDS)))
+        self._loads = _BACKENDS[self.backend]
+        self._types = {}
+        self._events = {}
+        self._default = None
+        self._invalid = None
+        self.messages = 0
+        self.decode_ns = 0
+        self.route_ns = 0
+
+    def on(self, content_types, handler=None):
+        """注册 contentType（可为元组）；不传 handler 时作为装饰器使用。"""
+        if handler is None:
+            return lambda h: self.on(content_types, h)
+        for ct in _as_tuple(content_types):
+            self._types[ct] = handler
+        return handler
+
+    def on_event(self, event_types, handler=None):
+        if handler is None:
+            return lambda h: self.on_event(event_types, h)
+        for ev in _as_tuple(event_types):
+            self._events[ev] = handler
+        return handler
+
+    def on_default(self, handler):
+        self._default = handler
+        return handler
+
+    def on_invalid(self, handler):
+        self._invalid = handler
+        return handler
+
+    def route(self, msg: Message):
+        if msg.content_type == EVENT:
+            handler = self._events.get(msg.body.get("eventType"))
+            if handler is not None:
+                return handler
+        return self._types.get(msg.content_type, self._default)
+
+    def dispatch(self, raw):
+        t0 = _now()
+        msg = decode(raw, self._loads)
+        t1 = _now()
+        if msg is None:
+            self.messages += 1
+            self.decode_ns += t1 - t0
+            return self._invalid(raw) if self._invalid is not None else None
+        handler = self.route(msg)
+        self.route_ns += _now() - t1
+        self.decode_ns += t1 - t0
+        self.messages += 1
+        return handler(msg) if handler is not None else None
+
+    def stats(self) -> dict:
+        n = self.messages or 1
+        return {
+            "backend": self.backend,
+            "messages": self.messages,
+            "decode_us": self.decode_ns / n / 1000,
+            "route_us": self.route_ns / n / 1000,
+        }
+
+
+# ---------- 上行控制消息 ----------
+@lru_cache(maxsize=64)
+def _control_template(content_type: str, uid: str) -> str:
+    # 与 json.dumps({"mid": ..., "contentType": ..., "uid": ...}) 的输出一致
+    return '{"mid": "%s", "contentType": ' + json.dumps(content_type).replace("%", "%%") + \
+        ', "uid": ' + json.dumps(uid).replace("%", "%%") + '}'
+
+
+def control(uid: str, content_type: str, mid: str = None) -> str:
+    """PING / CLIENT_AUDIO_START / CLIENT_INTERRUPT 等只带 mid + uid 的控制消息；mid 缺省时随机生成。"""
+    return _control_template(content_type, uid) % (mid or uuid.uuid4())
+
+
+def client_audio_finish() -> str:
+    return CLIENT_AUDIO_FINISH_MESSAGE
+
+
+@lru_cache(maxsize=64)
+def _event_template(event_type: str, uid: str) -> str:
+    return '{"mid": "%s", "contentType": "EVENT", "uid": ' + json.dumps(uid).replace("%", "%%") + \
+        ', "content": {"eventType": ' + json.dumps(event_type).replace("%", "%%") + '}}'
+
+
+def event(uid: str, event_type: str) -> str:
+    """上行 EVENT 消息（content 只带 eventType）。"""
+    return _event_template(event_type, uid) % uuid.uuid4()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+断线重连：网络抖动只损失几百毫秒，而不是整轮对话
+- Backoff：指数退避 + 全抖动（delay = uniform(0, min(max_s, base_s × 2^n))），首次重试在 base_s 以内；
+  连续失败 attempts 次放弃，连接成功后 reset()
+- UplinkRelay：推流线程持有的上行入口，跨连接不变。连接在线时转发给当前连接的写线程（ConnectionWriter），
+  断线期间只缓存、不抛异常（推流线程不会对着死 socket 发送）；
+  另外缓存“进行中的一句”：CLIENT_AUDIO_START 起的控制消息与音频帧（有界，超出丢最旧的音频帧），
+  新连接 attach() 时按原顺序先回放，再放行新的帧；服务端确认（ack()：回复开始 / 整轮结束 / 打断）后清空
+  回放在锁外进行（推流线程不被整句回放卡住）：回放期间推流线程的新帧先暂存，回放完按顺序接着发
+  一句已发 FINISH 但服务端还没回复时断线，重连后整句（含 FINISH）重发，这一轮仍能得到回复
+- 统计：重连次数、失败尝试、断线时长（断开 → 新连接 attach）、回放帧数、缓存溢出丢弃数
+依赖: 无
+"""
+
+import collections
+import random
+import threading
+import time
+
+from joy_inside_py.protocol import CLIENT_AUDIO_START, CLIENT_AUDIO_FINISH
+
+RECONNECT_BASE_S = 0.2    # 首次重试的退避上限：一次网络抖动只损失几百毫秒
+RECONNECT_MAX_S = 10.0    # 单次退避上限
+RECONNECT_ATTEMPTS = 8    # 连续失败这么多次放弃（默认约 30s）
+REPLAY_MS = 15000         # 进行中一句的回放缓冲上限（音频时长）
+
+
+class Backoff:
+    def __init__(self, base_s: float = RECONNECT_BASE_S, max_s: float = RECONNECT_MAX_S,
+                 attempts: int = RECONNECT_ATTEMPTS, rng: random.Random = None):
+        self.base_s = base_s
+        self.max_s = max_s
+        self.attempts = attempts
+        self._rng = rng or random.Random()
+        self.failures = 0   # 连续失败次数
+        self.retries = 0    # 累计重试次数
+
+    def next(self):
+        """下一次重试前等待的秒数；已连续失败 attempts 次时返回 None。"""
+        if self.attempts is not None and self.failures >= self.attempts:
+            return None
+        cap = min(self.max_s, self.base_s * (2 ** self.failures))
+        self.failures += 1
+        self.retries += 1
+        return self._rng.uniform(0, cap)
+
+    def reset(self):
+        self.failures = 0
+
+
+class UplinkRelay:
+    """send() 的签名同 ConnectionWriter：on_sent 在该帧真正交给底层 ws.send 后调用（断线期间缓存的帧不调用）。"""
+
+    queued = True  # codec.UplinkSender 据此把 on_sent 交给下游，而不是 send 返回即调用
+
+    def __init__(self, max_frames: int):
+        self.max_frames = max_frames
+        self._lock = threading.Lock()
+        self._writer = None
+        self._attaching = None                # 正在回放的新连接；回放期间 send() 的帧进 _held
+        self._held = []                       # (data, args, on_sent)
+        self._control = []                    # 本句的控制消息 (seq, data)：START / FINISH
+        self._audio = collections.deque()     # 本句的音频帧 (seq, data)
+        self._seq = 0
+        self._finished = False
+        self._down_ts = None
+
+        # 统计
+        self.reconnects = 0
+        self.replayed = 0
+        self.overflow = 0
+        self.lost = 0                         # 断线期间发出、又不属于任何一句的消息（丢弃）
+        self.outages_ms = []
+
+    # ---------- 连接 ----------
+    def attach(self, writer):
+        """新连接就绪：先按原顺序回放进行中的一句，再放行推流线程的新帧。"""
+        with self._lock:
+            items = [data for _, data in sorted(self._control + list(self._audio), key=lambda item: item[0])]
+            frames = len(self._audio)
+            self._attaching = writer
+            self._held = []
+        try:
+            for data in items:
+                writer.send(data, block=True)
+            # 回放期间推流线程暂存的帧：取空为止，取空时在锁内切到新连接，之后的帧直接转发
+            while True:
+                with self._lock:
+                    if self._attaching is not writer:
+                        return  # 回放期间又断开了（detach）
+                    held, self._held = self._held, []
+                    if not held:
+                        self._attaching = None
+                        self._writer = writer
+                        self.replayed += frames
+                        if self._down_ts is not None:
+                            self.reconnects += 1
+                            self.outages_ms.append((time.monotonic() - self._down_ts) * 1000)
+                            self._down_ts = None
+                        break
+                for data, args, on_sent in held:
+                    writer.send(data, *args, on_sent=on_sent)
+        except Exception as e:
+            # 新连接刚建好又断了：保持断线状态，缓存留给下一次重连
+            print("[reconnect] 回放失败：", e)
+            with self._lock:
+                if self._attaching is writer:
+                    self._attaching = None
+                    self._held = []
+            return
+        if items:
+            print("[reconnect] 回放进行中的一句：%d 条消息（%d 帧音频）" % (len(items), frames))
+
+    def detach(self):
+        """连接断开：之后的帧只进缓存。"""
+        with self._lock:
+            self._writer = None
+            self._attaching = None
+            self._held = []
+            if self._down_ts is None:
+                self._down_ts = time.monotonic()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    # ---------- 推流线程 ----------
+    def send(self, data, *args, on_sent=None) -> bool:
+        if not isinstance(data, str):
+            data = bytes(data)  # 编码器缓冲下一帧会被覆盖
+        with self._lock:
+            self._remember(data)
+            if self._attaching is not None:
+                self._held.append((data, args, on_sent))
+                return True
+            writer = self._writer
+            if writer is None:
+                return False
+            try:
+                return writer.send(data, *args, on_sent=on_sent)
+            except Exception as e:
+                # 连接已关（写线程已停止）：等 on_close 走重连，这一帧已在缓存里
+                print("[reconnect] 发送失败，等待重连：", e)
+                self._writer = None
+                if self._down_ts is None:
+                    self._down_ts = time.monotonic()
+                return False
+
+    def _remember(self, data):
+        """持 _lock 调用：记入进行中的一句。"""
+        self._seq += 1
+        if isinstance(data, str):
+            if CLIENT_AUDIO_START in data:
+                self._control = [(self._seq, data)]
+                self._audio.clear()
+                self._finished = False
+            elif CLIENT_AUDIO_FINISH in data and self._control:
+                self._control.append((self._seq, data))
+                self._finished = True
+            elif self._writer is None:
+                self.lost += 1
+            return
+        if not self._control or self._finished:
+            return
+        if len(self._audio) >= self.max_frames:
+            self._audio.popleft()
+            self.overflow += 1
+        self._audio.append((self._seq, data))
+
+    def ack(self):
+        """服务端已接手这一句（回复开始 / 整轮结束 / 打断）：不再需要回放。说到一半时不清。"""
+        with self._lock:
+            if self._finished:
+                self._control = []
+                self._audio.clear()
+                self._finished = False
+
+    # ---------- 统计 ----------
+    def stats(self) -> dict:
+        with self._lock:
+            out = self.outages_ms
+            return {
+                "reconnects": self.reconnects,
+                "outage_ms": sum(out) / len(out) if out else float("nan"),
+                "outage_max_ms": max(out, default=float("nan")),
+                "replayed": self.replayed,
+                "overflow": self.overflow,
+                "lost": self.lost,
+                "buffered": len(self._audio),
+            }
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+每个连接一个写线程（单写者）+ 优先级发送队列，取代推流 / 打断 / 心跳各自直接调 ws.send：
+- send() 只入队、不阻塞（BLOCK 策略下音频满了才阻塞）；写线程是唯一调用底层 ws.send 的线程
+- 两级优先：控制消息（str：PING / CLIENT_INTERRUPT / CLIENT_AUDIO_START / FINISH ...）先于排队中的音频帧发出
+- CLIENT_AUDIO_FINISH 是一句的结尾：入队前同一句还没发出的音频，未过期的先发（句内顺序不变），过期的丢弃；
+  之后入队的音频（下一句）不会跑到它前面
+- 背压：音频队列有界，满了按策略处理（pipeline 的 block / drop_oldest / drop_newest，默认丢最旧的）；
+  drop_oldest 只丢最近一个 FINISH 之后入队的音频（已说完的一句不被下一句挤掉），没有可丢的时丢新来的这帧；
+  另外排队超过 stale_ms 的音频在出队时直接丢弃（网络卡住后补发旧音频只会拖慢端点判定，None 表示不丢）
+- 统计：各级队列当前 / 最大深度、入队 / 发出 / 溢出丢弃 / 过期丢弃数，入队 → 发出（ws.send 返回）的平均 / 最大时延
+- 底层 ws.send 抛异常（连接已关）后写线程退出，之后的 send() 在调用线程抛出同一异常
+音频帧通常是编码器内部缓冲的 memoryview（下一帧会覆盖），入队时拷贝一份
+依赖: 无
+"""
+
+import collections
+import itertools
+import threading
+import time
+
+from joy_inside_py.pipeline import AUDIO, CONTROL, BLOCK, DROP_OLDEST, DROP_NEWEST, POLICIES
+from joy_inside_py.protocol import CLIENT_AUDIO_FINISH
+
+AUDIO_QUEUE_FRAMES = 25   # 音频队列上限（帧）：120ms 帧约 3s
+STALE_AUDIO_MS = 1000     # 排队超过这么久的音频视为过期
+KINDS = (CONTROL, AUDIO)
+
+_Entry = collections.namedtuple("_Entry", ["seq", "ts", "kind", "data", "args", "on_sent", "finish"])
+
+
+class ConnectionWriter:
+    """包装一个 ws：send 入队由写线程发出，其余属性（url / close / sock ...）透传给原始 ws。"""
+
+    queued = True  # codec.UplinkSender 据此把 on_sent 交给写线程，而不是 send 返回即调用
+
+    def __init__(self, ws, max_audio: int = AUDIO_QUEUE_FRAMES, policy: str = DROP_OLDEST,
+                 stale_ms: float = STALE_AUDIO_MS, name: str = "tx"):
+        if policy not in POLICIES:
+            raise ValueError("未知溢出策略: %s" % policy)
+        self._ws = ws
+        self.name = name
+        self.max_audio = max_audio
+        self.policy = policy
+        self.stale_ms = stale_ms
+        self._control = collections.deque()
+        self._audio = collections.deque()
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._barrier = -1   # 最近一个入队的 FINISH 的 seq：drop_oldest 不越过它丢帧
+        self._error = None
+        self._running = True
+
+        # 统计
+        self._max_depth = {k: 0 for k in KINDS}
+        self._put = {k: 0 for k in KINDS}
+        self._sent = {k: 0 for k in KINDS}
+        self._dropped = {k: 0 for k in KINDS}   # 溢出丢弃
+        self._stale = 0                          # 过期丢弃（只有音频）
+        self._lat_sum = {k: 0.0 for k in KINDS}
+        self._lat_max = {k: 0.0 for k in KINDS}
+
+        self._thread = threading.Thread(target=self._run, name="writer-" + name, daemon=True)
+        self._thread.start()
+
+    # ---------- 生产者（任意线程）----------
+    def send(self, data, *args, on_sent=None, block: bool = False) -> bool:
+        """
+        入队；args 原样传给底层 ws.send（如 opcode）。str 视为控制消息，其余（bytes / memoryview）视为音频帧。
+        on_sent() 在写线程上、该条交给 ws.send 之后调用。音频被溢出策略丢弃时返回 False。
+        block=True 时不论溢出策略都等到有空位（重连后回放整句时用，不能丢帧）。
+        """
+        if isinstance(data, str):
+            kind, finish = CONTROL, CLIENT_AUDIO_FINISH in data
+        else:
+            kind, finish = AUDIO, False
+            data = bytes(data)
+        with self._cond:
+            if self._error is not None:
+                raise self._error
+            if kind == AUDIO and len(self._audio) >= self.max_audio:
+                if block or self.policy == BLOCK:
+                    self._cond.wait_for(lambda: len(self._audio) < self.max_audio or self._error is not None)
+                    if self._error is not None:
+                        raise self._error
+                elif self.policy == DROP_NEWEST:
+                    self._dropped[AUDIO] += 1
+                    return False
+                else:
+                    i = next((i for i, e in enumerate(self._audio) if e.seq > self._barrier), None)
+                    self._dropped[AUDIO] += 1
+                    if i is None:
+                        return False
+                    del self._audio[i]
+            q = self._control if kind == CONTROL else self._audio
+            entry = _Entry(next(self._seq), time.monotonic(), kind, data, args, on_sent, finish)
+            if finish:
+                self._barrier = entry.seq
+            q.append(entry)
+            self._put[kind] += 1
+            if len(q) > self._max_depth[kind]:
+                self._max_depth[kind] = len(q)
+            self._cond.notify_all()
+        return True
+
+    def stop(self):
+        """停止写线程，丢弃未发出的消息（连接关闭时调用；不关闭底层 ws）。"""
+        with self._cond:
+            self._running = False
+            if self._error is None:
+                self._error = RuntimeError("连接写线程已停止")
+            self._cond.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+    def depth(self, kind: str = None) -> int:
+        if kind is None:
+            return len(self._control) + len(self._audio)
+        return len(self._control) if kind == CONTROL else len(self._audio)
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+    # ---------- 写线程 ----------
+    def _next(self):
+        """持 _cond 调用：取下一条要发的；控制消息优先，FINISH 前先发同一句里未过期的音频。"""
+        while True:
+            if self._control:
+                head = self._control[0]
+                if head.finish and self._audio and self._audio[0].seq < head.seq:
+                    entry = self._audio.popleft()
+                else:
+                    entry = self._control.popleft()
+            elif self._audio:
+                entry = self._audio.popleft()
+            else:
+                return None
+            if entry.kind == AUDIO:
+                self._cond.notify_all()  # BLOCK 策略下唤醒等位的生产者
+                if self.stale_ms is not None and (time.monotonic() - entry.ts) * 1000 > self.stale_ms:
+                    self._stale += 1
+                    continue
+            return entry
+
+    def _run(self):
+        while True:
+            with self._cond:
+                entry = None
+                while self._running:
+                    entry = self._next()
+                    if entry is not None:
+                        break
+                    self._cond.wait()
+                if entry is None:
+                    return
+            try:
+                self._ws.send(entry.data, *entry.args)
+            except Exception as e:
+                print("[send_queue][%s][ERR]" % self.name, e)
+                with self._cond:
+                    self._error = e
+                    self._running = False
+                    self._cond.notify_all()
+                return
+            ms = (time.monotonic() - entry.ts) * 1000
+            with self._cond:
+                self._sent[entry.kind] += 1
+                self._lat_sum[entry.kind] += ms
+                if ms > self._lat_max[entry.kind]:
+                    self._lat_max[entry.kind] = ms
+            if entry.on_sent is not None:
+                try:
+                    entry.on_sent()
+                except Exception as e:
+                    print("[send_queue][%s][on_sent][ERR]" % self.name, e)
+
+    # ---------- 统计 ----------
+    def stats(self) -> dict:
+        with self._cond:
+            out = {}
+            for kind in KINDS:
+                n = self._sent[kind]
+                out[kind] = {
+                    "depth": self.depth(kind),
+                    "max_depth": self._max_depth[kind],
+                    "put": self._put[kind],
+                    "sent": n,
+                    "dropped": self._dropped[kind],
+                    "send_ms": self._lat_sum[kind] / n if n else float("nan"),
+                    "send_max_ms": self._lat_max[kind] if n else float("nan"),
+                }
+            out[AUDIO]["stale"] = self._stale
+            return out
+
+
+def format_writer_stats(writer: ConnectionWriter) -> str:
+    """一行摘要：tx: control 0/3 sent 12 send 0.2ms (max 1.1ms), audio 0/5 sent 240 ... dropped 0, stale 0"""
+    s = writer.stats()
+    parts = []
+    for kind in KINDS:
+        k = s[kind]
+        part = "%s %d/%d sent %d send %.1fms (max %.1fms)" % (kind, k["depth"], k["max_depth"], k["sent"],
+                                                                k["send_ms"], k["send_max_ms"])
+        if kind == AUDIO:
+            part += ", dropped %d, stale %d" % (k["dropped"], k["stale"])
+        parts.append(part)
+    return "%s: %s" % (writer.name, ", ".join(parts))
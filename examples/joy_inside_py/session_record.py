@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+语音会话录制与回放：
+- SessionRecorder：记录每个上/下行 WS 帧（time.monotonic 相对时间 + 方向 + 文本/二进制 + 原始负载）
+- RecordingWebSocket：包装 websocket-client 的 ws，所有线程经它 send 的帧都会被录制
+- ReplayServer：把录制的下行帧按原始节奏（或 speed 倍速）回放给客户端，
+  每轮以客户端发出的 CLIENT_AUDIO_FINISH 为锚点，延迟对比不受客户端说话时长影响；
+  PING 由回放服务自己回 PONG（回显 mid，与 mock_server 相同），录制里的下行 PONG 不回放：
+  其 mid 对应录制时的 PING，客户端只会当作迟到 PONG 忽略，心跳连续漏 PONG 后判为失活
+
+文件格式（路径以 .gz 结尾时整体 gzip 压缩）：
+    MAGIC
+    重复：<d t><B dir><B kind><I len> + payload
+依赖: websockets（仅 ReplayServer 需要）
+"""
+
+import asyncio
+import gzip
+import json
+import struct
+import threading
+import time
+
+try:
+    import websockets
+except Exception as e:
+    websockets = None
+    print("[session_record] websockets 导入失败：", e)
+
+MAGIC = b"JIVREC1\n"
+_RECORD = struct.Struct("<dBBI")
+
+DIR_IN = 0    # 服务端 → 客户端
+DIR_OUT = 1   # 客户端 → 服务端
+KIND_TEXT = 0
+KIND_BINARY = 1
+
+OPCODE_TEXT = 0x1  # 与 websocket.ABNF.OPCODE_TEXT 相同
+
+
+def _open(path: str, mode: str):
+    return gzip.open(path, mode) if path.endswith(".gz") else open(path, mode)
+
+
+def _control(payload, content_type: str):
+    """payload 是 content_type 类文本帧时返回解析后的 dict，否则 None；先按子串粗筛，避免逐帧 json.loads。"""
+    if isinstance(payload, (bytes, bytearray)) or '"%s"' % content_type not in payload:
+        return None
+    try:
+        data = json.loads(payload)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or data.get("contentType") != content_type:
+        return None
+    return data
+
+
+def _is_turn_end(payload) -> bool:
+    """客户端一轮说话结束：CLIENT_AUDIO_FINISH，或文件模式下 index < 0 的末帧。"""
+    if isinstance(payload, (bytes, bytearray)):
+        return False
+    if "CLIENT_AUDIO_FINISH" in payload:
+        return True
+    if '"index": -' not in payload:
+        return False
+    try:
+        data = json.loads(payload)
+    except json.JSONDecodeError:
+        return False
+    return data.get("contentType") == "AUDIO" and (data.get("content") or {}).get("index", 0) < 0
+
+
+class SessionRecorder:
+    """线程安全；接收线程、推流线程、心跳线程可同时调用。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = _open(path, "wb")
+        self._f.write(MAGIC)
+        self._t0 = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _write(self, direction: int, message, text=None):
+        # text 为 None 时按类型判断；以 UTF-8 字节发送的文本帧需显式传 text=True
+        if text is None:
+            text = isinstance(message, str)
+        if isinstance(message, str):
+            payload = message.encode("utf-8")
+        else:
+            payload = bytes(message)
+        kind = KIND_TEXT if text else KIND_BINARY
+        t = time.monotonic() - self._t0
+        with self._lock:
+            if self._f is None:
+                return
+            self._f.write(_RECORD.pack(t, direction, kind, len(payload)))
+            self._f.write(payload)
+
+    def record_in(self, message):
+        self._write(DIR_IN, message)
+
+    def record_out(self, message, text=None):
+        self._write(DIR_OUT, message, text)
+
+    def wrap(self, ws):
+        return RecordingWebSocket(ws, self)
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+class RecordingWebSocket:
+    """只拦截 send，其余属性透传给原始 ws。"""
+
+    def __init__(self, ws, recorder: SessionRecorder):
+        self._ws = ws
+        self._recorder = recorder
+
+    def send(self, data, opcode=OPCODE_TEXT):
+        # websocket-client 默认按文本帧发送，bytes/memoryview 也一样
+        self._recorder.record_out(data, text=opcode == OPCODE_TEXT)
+        return self._ws.send(data, opcode)
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+
+def read_session(path: str):
+    """逐条产出 (t, direction, payload)；文本帧为 str，二进制帧为 bytes。"""
+    with _open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("不是会话录制文件: %s" % path)
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+            t, direction, kind, n = _RECORD.unpack(head)
+            payload = f.read(n)
+            yield t, direction, payload.decode("utf-8") if kind == KIND_TEXT else payload
+
+
+def split_turns(records):
+    """
+    按上行 turn-end 切分下行帧：返回 [prelude, turn1, turn2, ...]，
+    每段是 [(相对锚点的偏移秒, payload), ...]；prelude 的锚点是录制开始。下行 PONG 不计入（回放时现场回）。
+    """
+    turns = [[]]
+    anchor = 0.0
+    for t, direction, payload in records:
+        if direction == DIR_OUT:
+            if _is_turn_end(payload):
+                anchor = t
+                turns.append([])
+            continue
+        if _control(payload, "PONG") is not None:
+            continue
+        turns[-1].append((t - anchor, payload))
+    return turns
+
+
+class ReplayServer:
+    """speed > 1 加速回放，speed = 0 表示不等待、尽快发完。"""
+
+    def __init__(self, path: str, host: str = "127.0.0.1", port: int = 8766, speed: float = 1.0):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.turns = split_turns(read_session(path))
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return "ws://%s:%d/soulmate/voiceChat/v1" % (self.host, self.port)
+
+    async def _play(self, ws, frames):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for offset, payload in frames:
+            if self.speed > 0:
+                delay = start + offset / self.speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await ws.send(payload)
+
+    async def _handler(self, ws, path=None):
+        tasks = [asyncio.create_task(self._play(ws, self.turns[0]))]
+        next_turn = 1
+        try:
+            async for message in ws:
+                ping = _control(message, "PING")
+                if ping is not None:
+                    await ws.send(json.dumps({"mid": ping.get("mid"), "contentType": "PONG"}))
+                    continue
+                if _is_turn_end(message) and next_turn < len(self.turns):
+                    tasks.append(asyncio.create_task(self._play(ws, self.turns[next_turn])))
+                    next_turn += 1
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    async def start(self):
+        self._server = await websockets.serve(self._handler, self.host, self.port, max_size=None)
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self):
+        await self.start()
+        print("[replay] listening: %s（%d 轮，speed=%s）" % (self.url, len(self.turns) - 1, self.speed))
+        try:
+            await asyncio.Future()
+        finally:
+            await self.stop()
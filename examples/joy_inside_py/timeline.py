@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+逐轮时延时间线：一轮对话从我方开口起，各阶段首次发生的时刻（time.monotonic）逐一打点：
+    speech_onset        端点检测判定开口（发 CLIENT_AUDIO_START 的采集时刻）
+    first_frame_sent    本轮首个音频帧写入 WS
+    finish_sent         端点检测判定说完、发 CLIENT_AUDIO_FINISH（采集时刻，与实际上行判定同源）
+    asr_first / asr_final   首个 / 最后一个 ASR 结果（ASR_PARTIAL 只计入 asr_first）
+    llm_first           首段 LLM 文本
+    tts_sentence_start  首个 TTS_SENTENCE_START
+    tts_first_byte      首个 TTS 音频分片（二进制或 base64）
+    playback_start      首个有声采样到达声卡（PcmOutput.on_start，DAC 时刻；后端不提供时为写入时刻）
+- 下一轮开口（或 close()）时本轮结束，按 SPANS 计算各段时延并计入直方图
+- 直方图的桶计数、次数、均值、最大值覆盖全部样本；p50/p95 按最近 MAX_SAMPLES 个样本计算（长时间运行内存有界）
+- export_jsonl()：每轮一行 {"type": "turn", ...}，每段直方图一行 {"type": "histogram", ...}
+依赖: 无
+"""
+
+import collections
+import json
+import threading
+import time
+
+SPEECH_ONSET = "speech_onset"
+FIRST_FRAME_SENT = "first_frame_sent"
+FINISH_SENT = "finish_sent"
+ASR_FIRST = "asr_first"
+ASR_FINAL = "asr_final"
+LLM_FIRST = "llm_first"
+TTS_SENTENCE_START = "tts_sentence_start"
+TTS_FIRST_BYTE = "tts_first_byte"
+PLAYBACK_START = "playback_start"
+STAGES = (SPEECH_ONSET, FIRST_FRAME_SENT, FINISH_SENT, ASR_FIRST, ASR_FINAL, LLM_FIRST,
+          TTS_SENTENCE_START, TTS_FIRST_BYTE, PLAYBACK_START)
+
+# 直方图统计的时延段：(名称, 起点阶段, 终点阶段)
+SPANS = (
+    ("onset→first_frame", SPEECH_ONSET, FIRST_FRAME_SENT),
+    ("onset→finish", SPEECH_ONSET, FINISH_SENT),
+    ("onset→asr_first", SPEECH_ONSET, ASR_FIRST),
+    ("finish→asr_final", FINISH_SENT, ASR_FINAL),
+    ("asr_final→llm_first", ASR_FINAL, LLM_FIRST),
+    ("finish→tts_start", FINISH_SENT, TTS_SENTENCE_START),
+    ("tts_start→first_byte", TTS_SENTENCE_START, TTS_FIRST_BYTE),
+    ("first_byte→playback", TTS_FIRST_BYTE, PLAYBACK_START),
+    ("finish→playback", FINISH_SENT, PLAYBACK_START),  # 端到端：说完 → 听到回复
+)
+
+BUCKETS_MS = (5, 10, 20, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000)  # 各桶上界（含）
+MAX_TURNS = 1000  # 保留的已结束轮次（导出用）
+MAX_SAMPLES = 1000  # 每个直方图保留的最近样本数（算分位数用）
+
+
+def percentile(sorted_values, p: float) -> float:
+    """已排序序列的第 p 百分位（取下标 int(n × p / 100) 的样本）；空序列返回 nan。"""
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))]
+
+
+class Histogram:
+    def __init__(self, name: str, buckets=BUCKETS_MS, max_samples: int = MAX_SAMPLES):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一格为超出最大上界
+        self.n = 0
+        self.total_ms = 0.0
+        self.max_ms = None
+        self._samples = collections.deque(maxlen=max_samples)
+
+    def add(self, ms: float):
+        i = 0
+        while i < len(self.buckets) and ms > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.n += 1
+        self.total_ms += ms
+        self.max_ms = ms if self.max_ms is None else max(self.max_ms, ms)
+        self._samples.append(ms)
+
+    def percentile(self, p: float) -> float:
+        return percentile(sorted(self._samples), p)
+
+    def to_dict(self) -> dict:
+        n = self.n
+        return {
+            "type": "histogram",
+            "span": self.name,
+            "count": n,
+            "mean_ms": self.total_ms / n if n else None,
+            "p50_ms": self.percentile(50) if n else None,
+            "p95_ms": self.percentile(95) if n else None,
+            "max_ms": self.max_ms,
+            "buckets": [{"le_ms": le, "count": c} for le, c in zip(self.buckets + ("inf",), self.counts)],
+        }
+
+
+class TurnTimeline:
+    """线程安全：推流线程、rx 线程、声卡回调线程都会打点。"""
+
+    def __init__(self, mode: str = None, max_turns: int = MAX_TURNS, verbose: bool = True):
+        self.mode = mode
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._cur = None
+        self._n = 0
+        self.turns = collections.deque(maxlen=max_turns)
+        self.histograms = collections.OrderedDict((name, Histogram(name)) for name, _, _ in SPANS)
+
+    def begin(self, ts: float = None):
+        """我方开口：结束上一轮，开始新一轮。"""
+        ts = time.monotonic() if ts is None else ts
+        with self._lock:
+            done = self._finish_locked()
+            self._n += 1
+            self._cur = {SPEECH_ONSET: ts}
+        self._report(done)
+
+    def mark(self, stage: str, ts: float = None, last: bool = False) -> bool:
+        """记录本轮某阶段的时刻；默认只记首次，last=True 时以最后一次为准。没有进行中的轮次时忽略。"""
+        ts = time.monotonic() if ts is None else ts
+        with self._lock:
+            cur = self._cur
+            if cur is None or (stage in cur and not last):
+                return False
+            cur[stage] = ts
+            return True
+
+    def close(self):
+        with self._lock:
+            done = self._finish_locked()
+        self._report(done)
+
+    def _finish_locked(self):
+        cur, self._cur = self._cur, None
+        if cur is None:
+            return None
+        t0 = cur[SPEECH_ONSET]
+        spans = {}
+        for name, a, b in SPANS:
+            if a in cur and b in cur:
+                ms = (cur[b] - cur[a]) * 1000
+                spans[name] = round(ms, 2)
+                self.histograms[name].add(ms)
+        record = {
+            "type": "turn",
+            "turn": self._n,
+            "mode": self.mode,
+            "onset_monotonic": t0,
+            "stages_ms": {s: round((cur[s] - t0) * 1000, 2) for s in STAGES if s in cur},
+            "spans_ms": spans,
+        }
+        self.turns.append(record)
+        return record
+
+    def _report(self, record):
+        if record is None or not self.verbose:
+            return
+        spans = record["spans_ms"]
+        parts = ["%s %.0fms" % (name, spans[name]) for name, _, _ in SPANS if name in spans]
+        print("[TIMELINE] turn %d: %s" % (record["turn"], ", ".join(parts) or "（无回复）"))
+
+    def format(self) -> str:
+        """每段一行：名称 n / p50 / p95 / max。"""
+        lines = []
+        for h in self.histograms.values():
+            d = h.to_dict()
+            if d["count"]:
+                lines.append("  %-22s n=%-4d p50 %7.1fms  p95 %7.1fms  max %7.1fms" % (
+                    h.name, d["count"], d["p50_ms"], d["p95_ms"], d["max_ms"]))
+        return "\n".join(lines)
+
+    def export_jsonl(self, path: str) -> int:
+        """写出已结束轮次与各段直方图，返回行数。"""
+        with self._lock:
+            rows = list(self.turns) + [h.to_dict() for h in self.histograms.values()]
+        with open(path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return len(rows)
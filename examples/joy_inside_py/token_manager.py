@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+access token 缓存 + 到期前后台续期：
+- get(): 缓存有效直接返回，不再走 HMAC 签名 + HTTPS 往返
+- 缓存失效时只有一个调用方真正去取，其余并发调用方等待同一次结果
+- 到期前 REFRESH_AHEAD_S 秒由后台定时器调用 refresh_fn(refreshToken) 续期；
+  续期失败则回退到 fetch_fn 重新获取；都失败时按 REFRESH_RETRY_S 起逐次翻倍重试，
+  间隔不超过剩余有效期的一半，保证过期前还能再试；已过期则不再后台重试，由下次 get() 同步获取
+依赖: 无
+"""
+
+import threading
+import time
+
+DEFAULT_TTL_S = 3600     # 服务端未返回有效期时按 1 小时处理
+REFRESH_AHEAD_S = 60     # 提前多少秒续期
+MIN_REFRESH_DELAY_S = 1  # 续期定时器最短间隔，避免有效期异常时空转
+REFRESH_RETRY_S = 2      # 续期失败后首次重试间隔，之后逐次翻倍
+
+
+def _parse_expiry(res_json: dict, now: float, default_ttl: float) -> float:
+    """从授权结果中解析过期时刻（time.time() 秒）。兼容“剩余秒数”与“毫秒时间戳”两种写法。"""
+    for key in ("expiresIn", "expireIn", "expires_in"):
+        v = res_json.get(key)
+        if v:
+            return now + float(v)
+    for key in ("expireTime", "expiresAt", "expireAt"):
+        v = res_json.get(key)
+        if v:
+            v = float(v)
+            return v / 1000.0 if v > 1e11 else v
+    return now + default_ttl
+
+
+class TokenManager:
+    """
+    fetch_fn() -> dict | None：完整获取一次授权，返回服务端 JSON（至少含 accessToken）
+    refresh_fn(refreshToken) -> dict | None：用 refreshToken 续期；可为 None（只走 fetch_fn）
+    """
+
+    def __init__(self, fetch_fn, refresh_fn=None,
+                 refresh_ahead: float = REFRESH_AHEAD_S,
+                 default_ttl: float = DEFAULT_TTL_S):
+        self._fetch_fn = fetch_fn
+        self._refresh_fn = refresh_fn
+        self.refresh_ahead = refresh_ahead
+        self.default_ttl = default_ttl
+
+        self._lock = threading.Lock()        # 保护下面的缓存字段
+        self._fetch_lock = threading.Lock()  # 同一时刻只允许一次在途请求
+        self._access_token = None
+        self._refresh_token = None
+        self._expires_at = 0.0
+        self._timer = None
+        self._refresh_failures = 0           # 连续续期失败次数
+
+    # ---------- 对外 ----------
+    def get(self):
+        """返回有效的 accessToken；获取失败时返回 None。"""
+        token = self._cached()
+        if token is not None:
+            return token
+        with self._fetch_lock:
+            # 等锁期间可能已被别的调用方取到
+            token = self._cached()
+            if token is not None:
+                return token
+            return self._store(self._fetch_fn())
+
+    def invalidate(self):
+        """服务端返回 401 等情况下丢弃缓存，下次 get() 会重新获取；同时取消待执行的后台续期，不与前台获取抢跑。"""
+        with self._lock:
+            self._access_token = None
+            self._expires_at = 0.0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    # ---------- 内部 ----------
+    def _cached(self):
+        with self._lock:
+            if self._access_token and time.time() < self._expires_at:
+                return self._access_token
+        return None
+
+    def _store(self, res_json):
+        if not res_json or not res_json.get("accessToken"):
+            return None
+        now = time.time()
+        with self._lock:
+            self._access_token = res_json["accessToken"]
+            self._refresh_token = res_json.get("refreshToken") or self._refresh_token
+            self._expires_at = _parse_expiry(res_json, now, self.default_ttl)
+            self._refresh_failures = 0
+            self._schedule_refresh(self._expires_at - now)
+            return self._access_token
+
+    def _schedule_refresh(self, ttl: float):
+        # 调用方需持有 self._lock
+        self._start_timer(max(MIN_REFRESH_DELAY_S, ttl - self.refresh_ahead))
+
+    def _schedule_retry(self):
+        # 调用方需持有 self._lock；退避间隔不超过剩余有效期的一半，过期前总能再试
+        remaining = self._expires_at - time.time()
+        if remaining <= 0:
+            return
+        self._refresh_failures += 1
+        backoff = REFRESH_RETRY_S * 2 ** (self._refresh_failures - 1)
+        self._start_timer(min(backoff, max(MIN_REFRESH_DELAY_S, remaining / 2)))
+
+    def _start_timer(self, delay: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        with self._fetch_lock:
+            with self._lock:
+                # 等锁期间被 invalidate() 取消或被新的定时器取代（前台已取到新 token）：不再续期
+                if self._timer is not threading.current_thread():
+                    return
+                refresh_token = self._refresh_token
+            res_json = None
+            if self._refresh_fn is not None and refresh_token:
+                try:
+                    res_json = self._refresh_fn(refresh_token)
+                except Exception as e:
+                    print("[TOKEN][refresh][ERR]", e)
+            if not res_json or not res_json.get("accessToken"):
+                try:
+                    res_json = self._fetch_fn()
+                except Exception as e:
+                    print("[TOKEN][fetch][ERR]", e)
+                    res_json = None
+            if self._store(res_json) is None:
+                # 续期彻底失败：保留旧 token 直到过期，退避后再试
+                with self._lock:
+                    self._schedule_retry()
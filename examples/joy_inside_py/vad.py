@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+逐帧 VAD（向量化，每帧只算一次）：
+- frame_rms(): float32 / int16 / PCM16 bytes 统一计算归一化 RMS，一次 np.dot，无逐采样 Python 循环
+- FrameVAD.process(): 返回 VadFrame(energy, is_speech, silence_ms)，推流循环与延时统计回调共用同一结果
+依赖: numpy
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from joy_inside_py.api_config import FRAME_MS
+
+ENERGY_THRESH = 0.01     # 开口门限（归一化 RMS，与 audio_tool 一致）
+
+_INV_INT16 = 1.0 / 32768.0
+
+# energy: 归一化 RMS；is_speech: energy > 门限；silence_ms: 距最近一次有声帧的累计静音时长
+VadFrame = namedtuple("VadFrame", ["energy", "is_speech", "silence_ms"])
+
+
+def frame_rms(block) -> float:
+    """block 可为 float32 ndarray（[-1, 1]）、int16 ndarray 或 PCM16 bytes。"""
+    if isinstance(block, (bytes, bytearray, memoryview)):
+        block = np.frombuffer(block, dtype=np.int16)
+    x = block.reshape(-1)
+    n = x.size
+    if n == 0:
+        return 0.0
+    if x.dtype == np.int16:
+        x = x.astype(np.float32)
+        scale = _INV_INT16
+    else:
+        scale = 1.0
+    return float(np.sqrt(float(np.dot(x, x)) / n + 1e-12)) * scale
+
+
+class FrameVAD:
+    def __init__(self, energy_thresh: float = ENERGY_THRESH, frame_ms: float = FRAME_MS):
+        self.energy_thresh = energy_thresh
+        self.frame_ms = frame_ms
+        self.silence_ms = 0.0
+
+    def reset(self):
+        self.silence_ms = 0.0
+
+    def process(self, block) -> VadFrame:
+        energy = frame_rms(block)
+        is_speech = energy > self.energy_thresh
+        if is_speech:
+            self.silence_ms = 0.0
+        else:
+            self.silence_ms += self.frame_ms
+        return VadFrame(energy, is_speech, self.silence_ms)
@@ -0,0 +1,543 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio 语音会话引擎（事件语义与 voice.py 的 WebsocketHandler 一致）：
+- 每个会话 = 一条 websockets 连接 + 推流/播放 2 个 task，不再为每个会话起 4 个线程
+- 心跳登记到进程共享的时间轮（heartbeat.py，与线程版会话同一套语义）：PING 由时间轮线程投递到事件循环发出，
+  PONG 按 mid 配对，连续 MAX_MISSED_PONGS 次未回 PONG 判为失活并关闭连接，run() 随后返回
+- sessionId / requestId 是实例属性，同进程内的多个会话互不共享
+- 半双工门控：agent_speaking 时不推帧，我方开口则发 CLIENT_INTERRUPT（带节流）
+- TTS 流式播放（默认）：下行分片凑齐整帧即入播放队列，句边界只用于日志/收尾；
+  tts_streaming=False 时退回逐句缓冲（TTS_SENTENCE_START / *_COMPLETE 之间的分片合成一句后入队）
+- 打断：先发 CLIENT_INTERRUPT，再停播；sink.reset() 不等待旧输出退出（ffplay 切到预热的备用进程）
+依赖: websockets, numpy；默认播放器另需 av(PyAV), sounddevice
+"""
+
+import asyncio
+import base64
+import time
+import uuid
+
+from joy_inside_py.api_config import URL_VOICE_CHAT, BYTES_PER_FRAME, BYTES_PER_MS, FRAME_MS, frame_bytes
+from joy_inside_py.frame_encoder import AudioFrameEncoder
+from joy_inside_py.codec import make_codec
+from joy_inside_py.heartbeat import default_service
+from joy_inside_py.vad import frame_rms
+from joy_inside_py.player import Mp3Player, Mp3FrameSplitter
+from joy_inside_py.protocol import (Dispatcher, EVENT, ASR_TYPES, LLM_TYPES, TTS_TYPES, TTS_SENTENCE_START, INTERRUPT,
+                                     COMPLETE, SENTENCE_END_EVENTS, PONG, CLIENT_AUDIO_START, CLIENT_INTERRUPT,
+                                     client_audio_finish, control)
+
+try:
+    import websockets
+except Exception as e:
+    websockets = None
+    print("[voice_session] websockets 导入失败：", e)
+
+# 采样参数（与 audio_tool 一致）
+SR = 16000
+CHANNELS = 1
+SAMPLE_WIDTH = 2  # PCM16
+FRAME_SAMPLES = max(1, BYTES_PER_FRAME // (SAMPLE_WIDTH * CHANNELS))
+
+# 语音检测 & 结束判定（与 audio_tool 一致）
+ENERGY_THRESH = 0.01
+SILENCE_MS = 700
+INTERRUPT_DEBOUNCE_MS = 800
+
+PING_INTERVAL_S = 10
+TTS_QUEUE_SIZE = 200
+
+
+# ---------- 上行音频源（异步迭代器，每次产出一帧 PCM16） ----------
+async def pcm_file_frames(path: str, frame_bytes: int = BYTES_PER_FRAME, realtime: bool = True):
+    """按帧读取 PCM 文件；realtime=True 时按帧时长节奏产出（与 audio_tool1._stream_from_file 一致）。"""
+    with open(path, "rb") as f:
+        data = f.read()
+    loop = asyncio.get_running_loop()
+    period = frame_bytes / BYTES_PER_MS / 1000.0
+    next_t = loop.time()
+    for off in range(0, len(data), frame_bytes):
+        chunk = data[off:off + frame_bytes]
+        if len(chunk) < frame_bytes:
+            chunk = chunk + b"\x00" * (frame_bytes - len(chunk))
+        if realtime:
+            next_t += period
+            await asyncio.sleep(max(0.0, next_t - loop.time()))
+        yield chunk
+
+
+async def mic_frames(frame_samples: int = FRAME_SAMPLES):
+    """麦克风采集；sounddevice 回调线程只做 call_soon_threadsafe 投递，不阻塞事件循环。"""
+    import sounddevice as sd
+
+    loop = asyncio.get_running_loop()
+    q = asyncio.Queue(maxsize=50)
+
+    def _put(raw):
+        try:
+            q.put_nowait(raw)
+        except asyncio.QueueFull:
+            pass
+
+    def _cb(indata, frames, time_info, status):
+        loop.call_soon_threadsafe(_put, bytes(indata))
+
+    with sd.InputStream(samplerate=SR, channels=CHANNELS, blocksize=frame_samples,
+                        dtype='int16', callback=_cb):
+        while True:
+            yield await q.get()
+
+
+# ---------- 下行音频输出 ----------
+class NullSink:
+    """丢弃音频；压测或无声卡环境使用。"""
+
+    async def start(self):
+        pass
+
+    async def write(self, mp3: bytes):
+        pass
+
+    async def reset(self, since: float = None):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class FfplaySink:
+    """
+    持久 ffplay 子进程（asyncio 版）。另预热一个备用进程：reset() 时直接切到备用进程，
+    旧进程在后台 terminate / 回收，打断路径上不等待进程退出、也不等新进程启动。
+    """
+
+    def __init__(self):
+        self._proc = None
+        self._standby = None
+        self._bg = set()  # 后台回收 / 预热 task，持有引用防止被回收
+
+    @staticmethod
+    def _alive(proc) -> bool:
+        return proc is not None and proc.returncode is None
+
+    async def _spawn(self):
+        try:
+            return await asyncio.create_subprocess_exec(
+                "ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet", "-f", "mp3", "-i", "pipe:0",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except FileNotFoundError:
+            print("[FFPLAY][ERR] 未找到 ffplay，请确认已安装并在 PATH 中。")
+            return None
+
+    async def _refill(self):
+        if not self._alive(self._standby):
+            self._standby = await self._spawn()
+
+    def _background(self, coro):
+        task = asyncio.create_task(coro)
+        self._bg.add(task)
+        task.add_done_callback(self._bg.discard)
+
+    async def start(self):
+        if not self._alive(self._proc):
+            self._proc = await self._spawn()
+        if self._proc is not None:
+            self._background(self._refill())
+
+    async def write(self, mp3: bytes):
+        if not self._alive(self._proc):
+            await self.start()
+        if self._proc is not None:
+            self._proc.stdin.write(mp3)
+            await self._proc.stdin.drain()
+
+    async def reset(self, since: float = None):
+        old = self._proc
+        self._proc, self._standby = (self._standby if self._alive(self._standby) else None), None
+        if old is not None:
+            self._background(self._terminate(old))
+        if self._proc is not None:
+            self._background(self._refill())
+
+    @staticmethod
+    async def _terminate(proc):
+        if proc.returncode is not None:
+            return
+        try:
+            proc.terminate()
+            await asyncio.wait_for(proc.wait(), timeout=2)
+        except Exception:
+            pass
+
+    async def stop(self):
+        procs = [p for p in (self._proc, self._standby) if p is not None]
+        self._proc = self._standby = None
+        for task in list(self._bg):
+            task.cancel()
+        await asyncio.gather(*(self._terminate(p) for p in procs))
+
+
+class PlayerSink:
+    """进程内流式解码播放（player.Mp3Player）；reset 只清缓冲，输出流常驻不重建。"""
+
+    def __init__(self, player=None):
+        self.player = player if player is not None else Mp3Player()
+
+    async def start(self):
+        self.player.start()
+
+    async def write(self, mp3: bytes):
+        # 解码放到线程池，不占用事件循环
+        await asyncio.get_running_loop().run_in_executor(None, self.player.write, mp3)
+
+    async def reset(self, since: float = None):
+        self.player.clear(since)
+
+    async def stop(self):
+        self.player.stop()
+
+
+# websockets>=14 为新版 asyncio 实现：connect 用 additional_headers，send 支持 text=True 把字节按文本帧发送
+_WS_NEW_API = websockets is not None and int(websockets.__version__.split(".")[0]) >= 14
+
+
+def _connect(url: str, headers: dict):
+    # 心跳由协议层 PING 负责，关闭 websockets 自带的 ping
+    key = "additional_headers" if _WS_NEW_API else "extra_headers"
+    return websockets.connect(url, ping_interval=None, max_size=None, **{key: headers})
+
+
+class VoiceSession:
+    """
+    单个语音会话。frames 为 PCM16 帧的异步迭代器（可为 None：只收不发）；
+    sink 为下行 MP3 输出（默认 PlayerSink，压测传 NullSink()）；
+    frame_ms 为上行帧时长，frames 产出的帧长度应与之一致（不足补零、超出截断）；
+    codec 为上行编码（"pcm" / "opus"），压缩编码在线程池中进行，不占用事件循环。
+    """
+
+    def __init__(self, uid: str, token: str, bot_id: str,
+                 frames=None, sink=None,
+                 url: str = URL_VOICE_CHAT,
+                 ping_interval: float = PING_INTERVAL_S,
+                 verbose: bool = True,
+                 recorder=None,
+                 frame_ms: float = FRAME_MS,
+                 codec: str = "pcm",
+                 tts_streaming: bool = True):
+        self.uid = uid
+        self.token = token
+        self.bot_id = bot_id
+        # 按官方示例：sessionId = BOT_ID + UUID，但每个实例独立生成
+        self.session_id = bot_id + str(uuid.uuid4())
+        self.request_id = str(uuid.uuid4())
+        self.url = url
+        self.frames = frames
+        self.frame_ms = frame_ms
+        self.codec = codec
+        self.tts_streaming = tts_streaming
+        self.sink = sink if sink is not None else PlayerSink()
+        self.ping_interval = ping_interval
+        self.verbose = verbose
+        self.recorder = recorder  # 可选 session_record.SessionRecorder
+
+        # 半双工：对方在说话→暂停我方推流
+        self.agent_speaking = asyncio.Event()
+        self.want_interrupt = asyncio.Event()
+
+        # TTS 播放：流式模式按整帧入队，逐句模式按句入队
+        self._tts_cur = bytearray()
+        self._mp3_frames = Mp3FrameSplitter()
+        self._tts_queue = asyncio.Queue(maxsize=TTS_QUEUE_SIZE)
+
+        self._ws = None
+        self._loop = None
+        self._heartbeat = None
+        self.dispatcher = self._build_dispatcher()
+
+    @property
+    def ws_url(self) -> str:
+        return "%s?botId=%s&sessionId=%s&requestId=%s" % (
+            self.url, self.bot_id, self.session_id, self.request_id
+        )
+
+    def _log(self, *args):
+        if self.verbose:
+            print(*args)
+
+    # ---------- 发送 ----------
+    async def send(self, text: str):
+        ws = self._ws
+        if ws is None:
+            return
+        if self.recorder is not None:
+            self.recorder.record_out(text)
+        await ws.send(text)
+
+    async def send_utf8(self, data):
+        """发送已编码为 UTF-8 的文本帧（如 AudioFrameEncoder 的输出），新版 websockets 下不再解码成 str。"""
+        ws = self._ws
+        if ws is None:
+            return
+        if self.recorder is not None:
+            self.recorder.record_out(data, text=True)
+        if _WS_NEW_API:
+            await ws.send(data, text=True)
+        else:
+            await ws.send(bytes(data).decode("utf-8"))
+
+    async def close(self):
+        """主动结束会话，run() 随后返回。"""
+        ws = self._ws
+        if ws is not None:
+            await ws.close()
+
+    # ---------- 音频推流门控 / 打断 ----------
+    def gate_can_send(self) -> bool:
+        return not self.agent_speaking.is_set()
+
+    async def request_interrupt(self):
+        if self.want_interrupt.is_set():
+            return
+        t0 = time.monotonic()
+        self.want_interrupt.set()
+        # 先把打断发出去，再停播；停播不阻塞，打断 → 静音时延从 t0 起算
+        try:
+            await self.send(control(self.uid, CLIENT_INTERRUPT))
+            self._log("[CLIENT_INTERRUPT] sent")
+        except Exception as e:
+            print("[CLIENT_INTERRUPT][ERR]", e)
+        await self.clear_audio_queue(since=t0)
+
+    async def clear_audio_queue(self, since: float = None):
+        """重置输出（先停播），再清空当前句缓冲与待播队列。"""
+        await self.sink.reset(since)
+        self._tts_cur.clear()
+        self._mp3_frames.reset()
+        while not self._tts_queue.empty():
+            self._tts_queue.get_nowait()
+
+    # ---------- 心跳（回调在时间轮线程上，只往事件循环投递，不阻塞）----------
+    def _send_from_heartbeat(self, message: str):
+        asyncio.run_coroutine_threadsafe(self.send(message), self._loop)
+
+    def _on_heartbeat_dead(self, hb):
+        print("[HEARTBEAT] 连续 %d 次未收到 PONG，断开连接" % hb.missed)
+        asyncio.run_coroutine_threadsafe(self.close(), self._loop)
+
+    # ---------- 任务 ----------
+    async def _player_loop(self):
+        await self.sink.start()
+        while True:
+            mp3 = await self._tts_queue.get()  # 整句（逐句模式）或若干整帧（流式模式）
+            if self.want_interrupt.is_set():
+                continue
+            try:
+                await self.sink.write(mp3)
+            except Exception as e:
+                print("[PLAYER][ERR]", e)
+                await self.sink.reset()
+
+    async def _send_audio(self):
+        loop = asyncio.get_running_loop()
+        talking = False
+        index = 0
+        last_voice_ts = 0.0
+        last_interrupt_ts = 0.0
+        codec = make_codec(self.codec, self.frame_ms)
+        encoder = AudioFrameEncoder(self.uid, frame_bytes(self.frame_ms), codec.audio_format, codec.max_packet_bytes)
+
+        async for pcm in self.frames:
+            energy = frame_rms(pcm)
+            now = loop.time()
+
+            # —— 半双工门控：对方在讲，我方先别发；若我确实开口可请求打断 ——
+            if not self.gate_can_send():
+                if energy > ENERGY_THRESH and (now - last_interrupt_ts) * 1000 >= INTERRUPT_DEBOUNCE_MS:
+                    await self.request_interrupt()
+                    last_interrupt_ts = now
+                continue
+
+            if not talking and energy > ENERGY_THRESH:
+                talking = True
+                last_voice_ts = now
+                index = 0
+                await self.send(control(self.uid, CLIENT_AUDIO_START))
+                self._log("[send_audio] CLIENT_AUDIO_START")
+                self.on_audio_start()
+
+            if not talking:
+                continue
+
+            if codec.inline:
+                await self.send_utf8(encoder.encode(index, pcm))
+            else:
+                payload = await loop.run_in_executor(None, codec.encode, bytes(encoder.load_pcm16(pcm)))
+                await self.send_utf8(encoder.encode_payload(index, payload))
+            self.on_frame_sent(index, len(pcm))
+            index += 1
+
+            if energy > ENERGY_THRESH:
+                last_voice_ts = now
+
+            if (now - last_voice_ts) * 1000 >= SILENCE_MS:
+                await self._send_finish()
+                talking = False
+
+        # 音频源结束时若仍在说话，补发结束
+        if talking:
+            await self._send_finish()
+
+    async def _send_finish(self):
+        await self.send(client_audio_finish())
+        self._log("[send_audio] CLIENT_AUDIO_FINISH")
+        self.on_audio_finish()
+
+    # ---------- 主循环 ----------
+    async def run(self):
+        if websockets is None:
+            print("[voice_session] 未安装 websockets，无法建立连接。")
+            return
+        headers = {"Authorization": "Bearer " + self.token}
+        async with _connect(self.ws_url, headers) as ws:
+            self._ws = ws
+            self._loop = asyncio.get_running_loop()
+            self._log("[WS] connected:", self.ws_url)
+            self._heartbeat = default_service().register(self._send_from_heartbeat, self.uid,
+                                                         on_dead=self._on_heartbeat_dead,
+                                                         interval_s=self.ping_interval)
+            tasks = [asyncio.create_task(self._player_loop())]
+            if self.frames is not None:
+                tasks.append(asyncio.create_task(self._send_audio()))
+            try:
+                async for message in ws:
+                    if self.recorder is not None:
+                        self.recorder.record_in(message)
+                    await self.on_message(message)
+            except websockets.ConnectionClosed:
+                pass
+            finally:
+                self._ws = None
+                self._heartbeat.close()
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await self.sink.stop()
+                if self.recorder is not None:
+                    self.recorder.close()
+            self.on_close(ws.close_code, ws.close_reason)
+
+    # ---------- TTS 分片 / 句边界 ----------
+    async def _on_tts_audio(self, chunk):
+        if self.tts_streaming:
+            frames = self._mp3_frames.push(chunk)
+            if frames:
+                await self._tts_queue.put(frames)
+        else:
+            self._tts_cur.extend(chunk)
+
+    async def _finish_current_sentence(self):
+        if self.tts_streaming:
+            # 句末不足一帧的残余字节也交给解码器
+            tail = self._mp3_frames.flush()
+            if tail:
+                await self._tts_queue.put(tail)
+            return
+        if self._tts_cur:
+            await self._tts_queue.put(bytes(self._tts_cur))
+            self._tts_cur.clear()
+
+    # ---------- 消息分发 ----------
+    async def on_message(self, message):
+        if isinstance(message, (bytes, bytearray)):
+            # 二进制：TTS mp3 分片；打断状态下丢弃
+            if not self.want_interrupt.is_set():
+                await self._on_tts_audio(message)
+            return
+
+        result = self.dispatcher.dispatch(message)
+        if result is not None:
+            await result
+
+    def _build_dispatcher(self):
+        """下行 JSON 消息分发表；handler 为协程函数。子类 / 应用可再 on() / on_event() 追加或覆盖。"""
+        d = Dispatcher()
+        d.on_event(TTS_SENTENCE_START, self._on_sentence_start)
+        d.on_event(INTERRUPT, self._on_server_interrupt)
+        d.on_event(SENTENCE_END_EVENTS, self._on_sentence_end)
+        d.on(EVENT, self._on_event)
+        d.on(ASR_TYPES, self._on_asr)
+        d.on(LLM_TYPES, self._on_llm)
+        d.on(TTS_TYPES, self._on_tts_json)
+        d.on(PONG, self._on_pong)
+        d.on_default(self._on_unknown)
+        d.on_invalid(self._on_invalid)
+        return d
+
+    async def _on_sentence_start(self, msg):
+        self.agent_speaking.set()
+        self.want_interrupt.clear()
+        # 新句开始前，若上一句已积累音频但未 complete，先入队
+        await self._finish_current_sentence()
+        txt = msg.text.strip()
+        if txt:
+            self._log("[TTS_START]", txt)
+
+    async def _on_server_interrupt(self, msg):
+        self._log("[EVENT][INTERRUPT] received, clear audio queue")
+        self.want_interrupt.set()
+        await self.clear_audio_queue()
+
+    async def _on_sentence_end(self, msg):
+        await self._finish_current_sentence()
+        if msg.event_type == COMPLETE:
+            self.agent_speaking.clear()
+        self._log("[EVENT]", msg.body)
+
+    async def _on_event(self, msg):
+        self._log("[EVENT]", msg.body)
+
+    async def _on_asr(self, msg):
+        text = msg.text
+        if text:
+            self._log("[ASR]", text)
+
+    async def _on_llm(self, msg):
+        text = msg.text
+        if text:
+            self._log("[LLM]", text)
+
+    async def _on_tts_json(self, msg):
+        if self.want_interrupt.is_set():
+            return
+        b64 = msg.audio_b64
+        if b64:
+            try:
+                await self._on_tts_audio(base64.b64decode(b64))
+            except Exception as e:
+                print("[TTS][b64-decode][ERR]", e)
+
+    async def _on_pong(self, msg):
+        if self._heartbeat is not None:
+            self._heartbeat.pong(msg.data.get("mid"))
+
+    async def _on_unknown(self, msg):
+        self._log("[MSG][", msg.content_type, "]", msg.dumps())
+
+    async def _on_invalid(self, raw):
+        self._log("Received:", raw)
+
+    def on_close(self, close_status_code, close_msg):
+        self._log("[CLOSED]", close_status_code, close_msg)
+
+    # ---------- 扩展点（子类覆盖，默认无操作） ----------
+    def on_audio_start(self):
+        """已发送 CLIENT_AUDIO_START。"""
+
+    def on_frame_sent(self, index: int, nbytes: int):
+        """已发送一帧 AUDIO。"""
+
+    def on_audio_finish(self):
+        """已发送 CLIENT_AUDIO_FINISH。"""
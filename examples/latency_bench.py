@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+嘴到耳时延基准（离线）：真实用户感受到的是“我说完 → 扬声器出声”，而不是“说完 → TTS_SENTENCE_START”
+- 本地替身服务（mock_server）下发一段有声 MP3 作为每轮回复
+- voice3.1.py 的 WebsocketHandler 整条链路照常运行，只是麦克风 / 扬声器换成虚拟声卡（loopback.py）：
+  虚拟麦克风按实时节奏注入已知的 PCM 语句，虚拟扬声器录下播放链路写出的每一块及其到达 DAC 的时刻
+- 每轮统计：
+    onset   语句最后一个有声采样 → 录音中首个有声采样（阈值 loopback.ONSET_DBFS）
+    xcorr   同上，但用互相关定位回复音频在录音中的位置（与 onset 互相印证，不受阈值影响）
+  并拆出端点判定（说完 → 发 FINISH）与时间线里的 finish→playback（首个采样写入声卡，含 MP3 首部静音）
+--blip-ms 时每轮在语句说完前这么久掐断一次连接（模拟网络抖动），测断线重连 + 回放进行中一句的代价
+每次运行打印逐轮结果与汇总；--out 时追加一行 JSON（jsonl）
+
+python latency_bench.py
+python latency_bench.py --turns 10 --frame-ms 40 --out m2e.jsonl
+python latency_bench.py --blip-ms 500
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from joy_inside_py.api_config import FRAME_MS, FRAME_MS_CHOICES
+from joy_inside_py.audio_tool3 import HANGOVER_MS
+from joy_inside_py.loopback import (LoopbackSource, LoopbackSink, VirtualDevices, OUTPUT_LATENCY_MS, ONSET_DBFS,
+                                    first_voiced_sample)
+from joy_inside_py.mock_server import MockVoiceServer
+from joy_inside_py.player import Mp3StreamDecoder, OUTPUT_SR
+from joy_inside_py.timeline import percentile
+
+try:
+    import av
+except Exception as e:
+    av = None
+    print("[latency_bench] av(PyAV) 导入失败：", e)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PCM_FILE_PATH = os.path.join(HERE, "test.pcm")
+SR = 16000
+TTS_MS = 2000             # 回复音频取语句开头这么长（编码成 16kHz 32kbps MP3，与替身服务的分片节奏一致）
+XCORR_REF_MS = 120        # 互相关用回复音频首个有声采样起的这么长（落在替身服务的首个分片内，不受分片间欠载影响）
+IDLE_S = 0.5              # 扬声器静音这么久视为本轮播完
+WARMUP_S = 1.0            # 首轮前让端点检测的噪底稳定
+
+
+def _load_pcm(path: str) -> np.ndarray:
+    with open(path, "rb") as f:
+        return np.frombuffer(f.read(), dtype=np.int16).astype(np.float32) * (1.0 / 32768.0)
+
+
+def first_utterance(pcm: np.ndarray, pause_ms: int = HANGOVER_MS, win_ms: int = 20) -> np.ndarray:
+    """截到首个不短于 pause_ms 的停顿为止：语句中间的停顿会被端点检测判为说完，一轮就成了两轮。"""
+    win = SR * win_ms // 1000
+    n = pcm.size // win
+    rms = np.sqrt((pcm[:n * win].astype(np.float64).reshape(n, win) ** 2).mean(axis=1))
+    voiced = rms > 10 ** (ONSET_DBFS / 20.0)
+    need = pause_ms // win_ms
+    seen, quiet = False, 0
+    for i, v in enumerate(voiced):
+        if v:
+            seen, quiet = True, 0
+        elif seen:
+            quiet += 1
+            if quiet >= need:
+                return pcm[:(i + 1) * win]
+    return pcm
+
+
+def encode_mp3(pcm: np.ndarray, sample_rate: int = SR, bit_rate: int = 32000) -> bytes:
+    """float32 PCM → CBR MP3（libmp3lame）。"""
+    ctx = av.CodecContext.create("libmp3lame", "w")
+    ctx.sample_rate = sample_rate
+    ctx.layout = "mono"
+    ctx.format = "s16p"
+    ctx.bit_rate = bit_rate
+    ctx.open()
+    x = np.clip(pcm * 32767.0, -32768, 32767).astype(np.int16)
+    fs = ctx.frame_size
+    x = np.pad(x, (0, -x.size % fs))
+    out = bytearray()
+    for off in range(0, x.size, fs):
+        frame = av.AudioFrame.from_ndarray(x[None, off:off + fs], format="s16p", layout="mono")
+        frame.sample_rate = sample_rate
+        frame.pts = off
+        for packet in ctx.encode(frame):
+            out += bytes(packet)
+    for packet in ctx.encode(None):
+        out += bytes(packet)
+    return bytes(out)
+
+
+def decode_mp3(mp3: bytes) -> np.ndarray:
+    """与播放链路相同的解码器 → 输出采样率的 float32 参考音频。"""
+    chunks = Mp3StreamDecoder(OUTPUT_SR).feed(mp3)
+    return np.concatenate(chunks).astype(np.float32) * (1.0 / 32768.0)
+
+
+def _load_handler_module():
+    spec = importlib.util.spec_from_file_location("voice3_1", os.path.join(HERE, "voice3.1.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _wait(predicate, timeout: float, interval: float = 0.01):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = predicate()
+        if value:
+            return value
+        time.sleep(interval)
+    return None
+
+
+def run(args) -> dict:
+    speech = _load_pcm(args.pcm)
+    utterance = first_utterance(speech)
+    tts_mp3 = encode_mp3(speech[:int(SR * TTS_MS / 1000)])
+    reference = decode_mp3(tts_mp3)
+    ref_onset = first_voiced_sample(reference, OUTPUT_SR)
+    ref_head = reference[ref_onset:ref_onset + int(OUTPUT_SR * XCORR_REF_MS / 1000)]
+    ref_onset_s = ref_onset / OUTPUT_SR
+
+    mock = MockVoiceServer(port=args.port, sentences=1, tts_mp3=tts_mp3)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(mock.start(), loop).result(5)
+
+    source = LoopbackSource(SR)
+    sink = LoopbackSink(OUTPUT_SR)
+    devices = VirtualDevices(source, sink, args.output_latency_ms)
+    v31 = _load_handler_module()
+    handler = v31.WebsocketHandler(frame_ms=args.frame_ms, codec=args.codec, audio_backend=devices,
+                                   aec=not args.no_aec)
+    client = threading.Thread(target=handler.start, args=("latency-bench",),
+                              kwargs={"url": mock.url, "token": "local"}, daemon=True)
+    client.start()
+    if not (source.started.wait(5) and sink.started.wait(5)):
+        raise RuntimeError("虚拟声卡未启动（连接替身服务失败？）")
+    time.sleep(WARMUP_S)
+
+    rows = []
+    for turn in range(1, args.turns + 1):
+        end_ts = source.play(utterance)
+        if args.blip_ms is not None:
+            threading.Timer(max(0.0, end_ts - args.blip_ms / 1000 - time.monotonic()),
+                            lambda: asyncio.run_coroutine_threadsafe(mock.drop(), loop)).start()
+        heard = _wait(lambda: sink.onset(end_ts), args.turn_timeout)
+        xc_ts, score = None, 0.0
+        if heard is not None:
+            _wait(lambda: time.monotonic() > heard + XCORR_REF_MS / 1000 + args.output_latency_ms / 1000 + 0.05,
+                  args.turn_timeout)
+            xc_ts, score = sink.locate(ref_head, end_ts)
+        rows.append({
+            "turn": turn,
+            "speech_end": end_ts,
+            "onset_ms": (heard - end_ts) * 1000 if heard is not None else None,
+            "xcorr_ms": (xc_ts - end_ts) * 1000 if xc_ts is not None else None,
+            "xcorr_score": score,
+        })
+        # 等本轮播完再开始下一轮（半双工下对方说话期间麦克风不上行）
+        _wait(lambda: sink.idle_for(IDLE_S), args.turn_timeout)
+
+    handler.stop()
+    client.join(5)
+    asyncio.run_coroutine_threadsafe(mock.stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+
+    # 与客户端自己的时间线对齐：端点判定时延、finish→playback
+    turns = list(handler.timeline.turns)
+    for row, rec in zip(rows, turns):
+        stages = rec["stages_ms"]
+        if "finish_sent" in stages:
+            finish_ts = rec["onset_monotonic"] + stages["finish_sent"] / 1000
+            row["endpoint_ms"] = (finish_ts - row["speech_end"]) * 1000
+        row["finish_to_playback_ms"] = rec["spans_ms"].get("finish→playback")
+    return {"rows": rows, "ref_onset_ms": ref_onset_s * 1000, "utterance_ms": utterance.size * 1000 / SR}
+
+
+def _fmt(v, width=9) -> str:
+    return ("%*.1f" % (width, v)) if v is not None else "%*s" % (width, "-")
+
+
+def report(args, result: dict) -> dict:
+    rows = result["rows"]
+    print(f"[latency_bench] frame {args.frame_ms}ms, codec {args.codec}, 虚拟扬声器时延 {args.output_latency_ms:.0f}ms, "
+          f"AEC {'off' if args.no_aec else 'on'}"
+          f"{'' if args.blip_ms is None else '，每轮说完前 %.0fms 断线' % args.blip_ms}；语句 {result['utterance_ms']:.0f}ms，"
+          f"回复 MP3 首个有声采样在 {result['ref_onset_ms']:.1f}ms 处")
+    print("  turn  endpoint  fin→play  m2e(onset)  m2e(xcorr)  score")
+    for r in rows:
+        print("  %4d %s %s %s   %s   %.2f" % (r["turn"], _fmt(r.get("endpoint_ms")), _fmt(r.get("finish_to_playback_ms")),
+                                             _fmt(r["onset_ms"], 10), _fmt(r["xcorr_ms"], 10), r["xcorr_score"]))
+    onset = sorted(r["onset_ms"] for r in rows if r["onset_ms"] is not None)
+    xcorr = sorted(r["xcorr_ms"] for r in rows if r["xcorr_ms"] is not None)
+    summary = {
+        "frame_ms": args.frame_ms,
+        "codec": args.codec,
+        "aec": not args.no_aec,
+        "output_latency_ms": args.output_latency_ms,
+        "blip_ms": args.blip_ms,
+        "turns": len(rows),
+        "missed": len(rows) - len(onset),
+        "m2e_onset_p50_ms": percentile(onset, 50),
+        "m2e_onset_p95_ms": percentile(onset, 95),
+        "m2e_xcorr_p50_ms": percentile(xcorr, 50),
+        "m2e_xcorr_p95_ms": percentile(xcorr, 95),
+        "onset_xcorr_diff_max_ms": max((abs(r["onset_ms"] - r["xcorr_ms"]) for r in rows
+                                        if r["onset_ms"] is not None and r["xcorr_ms"] is not None), default=None),
+        "rows": rows,
+    }
+    print(f"  嘴到耳 p50 {summary['m2e_onset_p50_ms']:.1f}ms / p95 {summary['m2e_onset_p95_ms']:.1f}ms（onset），"
+          f"p50 {summary['m2e_xcorr_p50_ms']:.1f}ms / p95 {summary['m2e_xcorr_p95_ms']:.1f}ms（xcorr），"
+          f"未听到回复 {summary['missed']} 轮")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="嘴到耳时延：虚拟声卡 + 本地替身服务")
+    parser.add_argument("--pcm", default=PCM_FILE_PATH, help="注入虚拟麦克风的语句（16kHz 16bit 单声道 PCM）")
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--frame-ms", type=int, default=FRAME_MS, choices=FRAME_MS_CHOICES)
+    parser.add_argument("--codec", default="pcm")
+    parser.add_argument("--no-aec", action="store_true")
+    parser.add_argument("--output-latency-ms", type=float, default=OUTPUT_LATENCY_MS,
+                        help="虚拟扬声器写入 → DAC 的时延（模拟设备输出缓冲）")
+    parser.add_argument("--turn-timeout", type=float, default=10.0)
+    parser.add_argument("--blip-ms", type=float, default=None,
+                        help="每轮在语句说完前这么多 ms 掐断一次连接（验证断线重连，默认不掐断）")
+    parser.add_argument("--port", type=int, default=8767, help="本地替身服务端口")
+    parser.add_argument("--out", default=None, help="把本次运行的汇总追加写入该 jsonl 文件")
+    args = parser.parse_args()
+
+    if av is None:
+        print("[latency_bench] 需要 PyAV 生成 / 解码回复音频")
+        return
+    summary = report(args, run(args))
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+语音并发压测：单进程起 N 个会话，每个会话按实时节奏回放 PCM 文件（同 audio_tool1._stream_from_file）
+统计：
+- CLIENT_AUDIO_FINISH → 首个 TTS 字节 的 p50/p95/p99
+- 上行帧速率（帧/秒）
+- 每会话 CPU 占用（本进程 user+sys，不含本地替身服务端）
+
+python load_test.py -n 200                          # 默认启动本地替身（子进程），可离线运行
+python load_test.py -n 50 --url wss://joyinside.jd.com/soulmate/voiceChat/v1   # 打真实服务
+"""
+
+import argparse
+import asyncio
+import math
+import multiprocessing
+import os
+import resource
+import time
+
+from joy_inside_py.api_config import FRAME_MS, FRAME_MS_CHOICES, frame_bytes
+from joy_inside_py.mock_server import MockVoiceServer
+from joy_inside_py.voice_session import VoiceSession, NullSink
+
+PCM_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.pcm")
+
+class LoadSession(VoiceSession):
+    """回放 PCM → 等待本轮回复结束（COMPLETE）→ 下一轮；全部轮次结束后主动断开。"""
+
+    def __init__(self, pcm: bytes, turns: int, turn_timeout: float, **kwargs):
+        super().__init__(sink=NullSink(), verbose=False, **kwargs)
+        self.pcm = pcm
+        self.turns = turns
+        self.turn_timeout = turn_timeout
+        self.frame_bytes = frame_bytes(self.frame_ms)
+        self.frames = self._frames()
+
+        self.latencies = []
+        self.frames_sent = 0
+        self.timeouts = 0
+        self._finish_ts = None
+        self._replied = False
+
+    async def _frames(self):
+        loop = asyncio.get_running_loop()
+        period = self.frame_ms / 1000.0
+        fb = self.frame_bytes
+        silence = b"\x00" * fb
+        next_t = loop.time()
+        for _ in range(self.turns):
+            self._replied = False
+            deadline = None
+            off = 0
+            # 先放完整段语音，然后补静音直到本轮回复结束
+            while off < len(self.pcm) or not (self._replied and not self.agent_speaking.is_set()):
+                if off < len(self.pcm):
+                    frame = self.pcm[off:off + fb]
+                    if len(frame) < fb:
+                        frame = frame + silence[len(frame):]
+                    off += fb
+                else:
+                    frame = silence
+                    if deadline is None:
+                        deadline = loop.time() + self.turn_timeout
+                    elif loop.time() > deadline:
+                        self.timeouts += 1
+                        break
+                next_t += period
+                await asyncio.sleep(max(0.0, next_t - loop.time()))
+                yield frame
+        await self.close()
+
+    def on_frame_sent(self, index: int, nbytes: int):
+        self.frames_sent += 1
+
+    def on_audio_finish(self):
+        self._finish_ts = time.monotonic()
+
+    async def on_message(self, message):
+        if isinstance(message, (bytes, bytearray)) and self._finish_ts is not None:
+            self.latencies.append(time.monotonic() - self._finish_ts)
+            self._finish_ts = None
+            self._replied = True
+        await super().on_message(message)
+
+
+def _percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    # nearest-rank
+    k = max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+def _cpu_seconds() -> float:
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_utime + ru.ru_stime
+
+
+async def run_load(url: str, token: str, bot_id: str, n: int, turns: int, ramp_ms: float, turn_timeout: float,
+                   pcm: bytes, frame_ms: float = FRAME_MS):
+    sessions = [LoadSession(pcm, turns, turn_timeout, uid="load-%d" % i, token=token, bot_id=bot_id, url=url,
+                            frame_ms=frame_ms)
+                for i in range(n)]
+
+    async def _run(i, s):
+        await asyncio.sleep(i * ramp_ms / 1000.0)
+        await s.run()
+
+    cpu0, t0 = _cpu_seconds(), time.monotonic()
+    results = await asyncio.gather(*(_run(i, s) for i, s in enumerate(sessions)), return_exceptions=True)
+    cpu1, t1 = _cpu_seconds(), time.monotonic()
+
+    errors = [r for r in results if isinstance(r, Exception)]
+    latencies = sorted(x for s in sessions for x in s.latencies)
+    frames = sum(s.frames_sent for s in sessions)
+    wall = t1 - t0
+    cpu = cpu1 - cpu0
+
+    print("========== 压测结果 ==========")
+    print(f"会话数: {n}, 每会话轮次: {turns}, 帧时长: {frame_ms:g}ms, 耗时: {wall:.2f}s, 连接失败: {len(errors)}, 轮次超时: "
+          f"{sum(s.timeouts for s in sessions)}")
+    if errors:
+        print("[ERR] 首个错误:", repr(errors[0]))
+    print(f"FINISH→首个TTS字节 (n={len(latencies)}): "
+          f"p50={_percentile(latencies, 50) * 1000:.1f}ms  "
+          f"p95={_percentile(latencies, 95) * 1000:.1f}ms  "
+          f"p99={_percentile(latencies, 99) * 1000:.1f}ms")
+    print(f"上行帧: {frames}, {frames / wall:.1f} 帧/秒")
+    print(f"CPU: 共 {cpu:.2f}s（{cpu / wall * 100:.1f}%），每会话 {cpu / n * 1000:.1f}ms（{cpu / wall / n * 100:.3f}%）")
+
+
+def _serve_mock(kwargs, ready):
+    asyncio.run(MockVoiceServer(**kwargs).serve_forever(ready))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JoyInside 语音并发压测")
+    parser.add_argument("-n", "--sessions", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--ramp-ms", type=float, default=20.0, help="相邻会话的启动间隔")
+    parser.add_argument("--turn-timeout", type=float, default=10.0, help="单轮等待回复的最长时间（秒）")
+    parser.add_argument("--pcm", default=PCM_FILE_PATH)
+    parser.add_argument("--frame-ms", type=int, default=FRAME_MS, choices=FRAME_MS_CHOICES, help="上行帧时长")
+    parser.add_argument("--url", default=None, help="不填则启动本地替身服务")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--asr-delay-ms", type=int, default=150)
+    parser.add_argument("--tts-delay-ms", type=int, default=300)
+    parser.add_argument("--sentences", type=int, default=2)
+    parser.add_argument("--sentence-ms", type=int, default=1200)
+    args = parser.parse_args()
+
+    with open(args.pcm, "rb") as f:
+        pcm = f.read()
+
+    server = None
+    if args.url is None:
+        mock_kwargs = dict(port=args.port, asr_delay_ms=args.asr_delay_ms, first_tts_delay_ms=args.tts_delay_ms,
+                           sentences=args.sentences, sentence_ms=args.sentence_ms)
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=_serve_mock, args=(mock_kwargs, ready), daemon=True)
+        server.start()
+        # 等替身服务开始监听再开压；子进程启动失败（如端口被占用）时立即退出，不空等
+        while not ready.wait(0.1):
+            if not server.is_alive():
+                raise SystemExit("本地替身服务启动失败，退出码 %s" % server.exitcode)
+        url, token, bot_id = MockVoiceServer(**mock_kwargs).url, "local", "LOCAL_BOT"
+    else:
+        from auth_token_demo import get_cached_token
+        from config import BOT_ID
+        url, token, bot_id = args.url, get_cached_token(), BOT_ID
+
+    try:
+        asyncio.run(run_load(url, token, bot_id, args.sessions, args.turns, args.ramp_ms, args.turn_timeout, pcm,
+                             args.frame_ms))
+    finally:
+        if server is not None:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
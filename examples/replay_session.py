@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+回放录制的语音会话，离线复现真实下行节奏：
+python voice3.1.py --record session.rec.gz                     # 先录制一次真实会话
+python replay_session.py session.rec.gz --speed 1               # 启动回放服务
+python voice3.1.py --url ws://127.0.0.1:8766/soulmate/voiceChat/v1   # 改动后的客户端连回放服务
+python replay_session.py session.rec.gz --summary               # 只打印录制中每轮的基线时延
+"""
+
+import argparse
+import asyncio
+
+from joy_inside_py.session_record import ReplayServer, read_session, split_turns, DIR_IN, DIR_OUT
+
+
+def summary(path: str):
+    records = list(read_session(path))
+    n_in = sum(1 for r in records if r[1] == DIR_IN)
+    n_out = sum(1 for r in records if r[1] == DIR_OUT)
+    duration = records[-1][0] if records else 0.0
+    print(f"[replay] {path}: {duration:.2f}s, 上行 {n_out} 帧, 下行 {n_in} 帧")
+    for i, frames in enumerate(split_turns(records)[1:], 1):
+        first_audio = next((off for off, payload in frames if isinstance(payload, bytes)), None)
+        if first_audio is None:
+            print(f"  第{i}轮: {len(frames)} 帧, 无音频")
+        else:
+            print(f"  第{i}轮: {len(frames)} 帧, FINISH→首个TTS字节 {first_audio * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的语音会话")
+    parser.add_argument("path")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速；0 表示不等待")
+    parser.add_argument("--summary", action="store_true")
+    args = parser.parse_args()
+
+    if args.summary:
+        summary(args.path)
+        return
+    asyncio.run(ReplayServer(args.path, args.host, args.port, args.speed).serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+joy_inside_py/session_record.py 的回放服务与心跳：回放时长超过 interval × max_missed，连接不被判为失活
+录制里带几条旧 PONG（mid 对应录制时的 PING），回放时不应下发；客户端的 PING 由回放服务现场回 PONG
+运行：在\\examples\\中输入 python -m unittest discover tests
+依赖: websockets
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from joy_inside_py.heartbeat import HeartbeatService
+from joy_inside_py.session_record import SessionRecorder, ReplayServer
+
+try:
+    import websockets
+except Exception:
+    websockets = None
+
+PORT = 8797
+INTERVAL_S = 0.1
+MAX_MISSED = 3
+SESSION_S = 1.0             # 远长于 INTERVAL_S × MAX_MISSED
+STALE_MIDS = ["recorded-%d" % i for i in range(3)]
+
+
+def _record(path):
+    rec = SessionRecorder(path)
+    for mid in STALE_MIDS:
+        rec.record_out(json.dumps({"mid": mid, "contentType": "PING", "uid": "u"}))
+        rec.record_in(json.dumps({"mid": mid, "contentType": "PONG"}))
+    rec.record_out(json.dumps({"contentType": "CLIENT_AUDIO_FINISH"}))
+    rec.record_in(json.dumps({"contentType": "EVENT", "content": {"eventType": "TTS_SENTENCE_START", "text": "好"}}))
+    rec.record_in(b"\xff\xf3" * 8)
+    rec.record_in(json.dumps({"contentType": "EVENT", "content": {"eventType": "COMPLETE"}}))
+    rec.close()
+
+
+async def _session(path, service):
+    server = await ReplayServer(path, port=PORT, speed=0).start()
+    received = []
+    try:
+        async with websockets.connect("ws://127.0.0.1:%d/" % PORT, ping_interval=None) as ws:
+            loop = asyncio.get_running_loop()
+            dead = []
+            hb = service.register(lambda m: asyncio.run_coroutine_threadsafe(ws.send(m), loop),
+                                  "u", on_dead=dead.append)
+
+            async def rx():
+                async for message in ws:
+                    received.append(message)
+                    if isinstance(message, str) and '"PONG"' in message:
+                        hb.pong(json.loads(message).get("mid"))
+
+            task = asyncio.create_task(rx())
+            await asyncio.sleep(SESSION_S / 2)
+            await ws.send(json.dumps({"contentType": "CLIENT_AUDIO_FINISH"}))
+            await asyncio.sleep(SESSION_S / 2)
+            hb.close()
+            task.cancel()
+            return hb, dead, received
+    finally:
+        await server.stop()
+
+
+@unittest.skipIf(websockets is None, "需要 websockets")
+class ReplayHeartbeatTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".rec")
+        os.close(fd)
+        _record(self.path)
+        self.service = HeartbeatService(interval_s=INTERVAL_S, tick_s=0.02, max_missed=MAX_MISSED)
+
+    def tearDown(self):
+        self.service.stop()
+        os.remove(self.path)
+
+    def test_replay_answers_pings(self):
+        hb, dead, received = asyncio.run(_session(self.path, self.service))
+        self.assertEqual(dead, [])
+        self.assertGreaterEqual(hb.pongs, SESSION_S / INTERVAL_S / 2)
+        stats = self.service.stats()
+        self.assertEqual(stats["dead"], 0)
+        self.assertEqual(stats["stale"], 0)
+        # 录制里的旧 PONG 不下发，录制的那一轮照常回放
+        self.assertFalse(any(isinstance(m, str) and "recorded-" in m for m in received))
+        self.assertIn(b"\xff\xf3" * 8, received)
+
+
+if __name__ == "__main__":
+    unittest.main()
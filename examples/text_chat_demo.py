@@ -8,15 +8,14 @@
 import json
 import uuid
 
-import requests
-
-from auth_token_demo import get_token
+from auth_token_demo import get_cached_token
 from config import *
+from joy_inside_py import http_client
 from joy_inside_py.api_config import URL_TEXT_CHAT
 
 
 def chat():
-    authorization = get_token()
+    authorization = get_cached_token()
     headers = {"Authorization": "Bearer " + authorization}
     params = {
         "requestId": str(uuid.uuid4()),
@@ -37,23 +36,29 @@ def chat():
         ]
     }
 
-    res = requests.post(URL_TEXT_CHAT, stream=True, headers=headers, json=params)
-    if res.status_code != 200:
-        print("请求异常", res.status_code)
-        return
-
-    for line_str in res.iter_lines(decode_unicode=True):
-        if line_str.startswith('data:'):
-            try:
-                data = json.loads(line_str[5:].strip())
-                finish_reason = data["choices"][0]["finish_reason"]
-                if "stop" == finish_reason:
-                    print("回复结束")
-                    return
-
-                print("回复文本： ", data["choices"][0]["delta"]["content"])
-            except json.JSONDecodeError:
-                print(f"JSON解析错误: {line_str}")
+    # 流读完（含 finish_reason=stop 之后的剩余行）连接才归还连接池；
+    # with 只保证异常 / 提前 return 时关闭响应，这时流没读完，连接直接断开，下次请求重新建连
+    with http_client.post(URL_TEXT_CHAT, stream=True, headers=headers, json=params) as res:
+        if res.status_code != 200:
+            print("请求异常", res.status_code)
+            return
+
+        lines = res.iter_lines(decode_unicode=True)
+        for line_str in lines:
+            if line_str.startswith('data:'):
+                try:
+                    data = json.loads(line_str[5:].strip())
+                    finish_reason = data["choices"][0]["finish_reason"]
+                    if "stop" == finish_reason:
+                        print("回复结束")
+                        break
+
+                    print("回复文本： ", data["choices"][0]["delta"]["content"])
+                except json.JSONDecodeError:
+                    print(f"JSON解析错误: {line_str}")
+        # 回复已结束：读掉剩余的流（如 data: [DONE]），让连接归还连接池
+        for _ in lines:
+            pass
 
 
 
@@ -1,25 +1,31 @@
 # -*- coding: utf-8 -*-
 """
-语音对话示例（半双工 + 逐句播放队列，持久 ffplay，无缝衔接）
+语音对话示例（半双工 / 可选全双工 + 逐句播放队列，进程内流式解码播放，无缝衔接）
 """
 
-import json
 import threading
 import uuid
 import base64
-import subprocess
-import queue
-import os
-import signal
 import time
 
 import websocket
 
-from auth_token_demo import get_token
+from auth_token_demo import get_cached_token
 from config import BOT_ID
-from joy_inside_py.api_config import URL_VOICE_CHAT
+from joy_inside_py.api_config import URL_VOICE_CHAT, FRAME_MS
 from joy_inside_py.audio_tool import send_audio
 from joy_inside_py.event_handler import ping
+from joy_inside_py.send_queue import ConnectionWriter
+from joy_inside_py.player import Mp3Player, Mp3FrameSplitter
+from joy_inside_py.aec import EchoCanceller
+from joy_inside_py.duplex import (TurnMetrics, HALF_DUPLEX, FULL_DUPLEX, BARGE_IN_CLIENT, BARGE_IN_SERVER,
+                                   SPEECH_START, SPEECH_END, mode_label)
+from joy_inside_py.protocol import (Dispatcher, EVENT, ASR_TYPES, LLM_TYPES, TTS_TYPES, TTS_SENTENCE_START, INTERRUPT,
+                                     COMPLETE, SENTENCE_END_EVENTS, CLIENT_INTERRUPT, PONG, control)
+from joy_inside_py.pipeline import Stage, StageQueue, AUDIO, BLOCK, RX_LIMITS, TTS_QUEUE_SIZE, frame_kind
+
+# 待播队列：满了阻塞 rx 分发线程（背压停在 rx 队列，不传到读线程）
+TTS_LIMITS = {AUDIO: (TTS_QUEUE_SIZE, BLOCK)}
 
 
 class WebsocketHandler:
@@ -28,29 +34,64 @@ class WebsocketHandler:
     requestId = str(uuid.uuid4())
     uid = ""
 
-    def __init__(self):
-        # 半双工：对方在说话→暂停我方推流
+    def __init__(self, frame_ms=FRAME_MS, codec="pcm", tts_streaming=True, aec=True,
+                 duplex=HALF_DUPLEX, barge_in=BARGE_IN_CLIENT):
+        # 上行帧时长（ms），见 api_config.FRAME_MS_CHOICES
+        self.frame_ms = frame_ms
+        # 上行编码："pcm"（默认）或 "opus"（需服务端支持）
+        self.codec = codec
+        # TTS 播放：流式（默认，收齐整帧即播）或逐句（整句到齐后才播）
+        self.tts_streaming = tts_streaming
+
+        # 双工模式：半双工（默认）对方在说话→暂停我方推流；全双工照常推流，由 barge_in 决定谁来打断
+        self.duplex = duplex
+        self.barge_in = barge_in
+        self.turns = TurnMetrics(mode_label(duplex, barge_in))
         self.agent_speaking = threading.Event()
         self.want_interrupt = threading.Event()
 
         # TTS 逐句缓冲与播放
-        self._tts_cur = bytearray()           # 当前句的缓冲
+        self._tts_cur = bytearray()           # 当前句的缓冲（逐句模式）
+        self._mp3_frames = Mp3FrameSplitter()  # 流式模式：分片凑齐整帧即送播
         self._tts_lock = threading.Lock()
-        self._tts_queue = queue.Queue(maxsize=200)  # 待播句队列（bytes）
-
-        # 持久 ffplay
-        self._ffplay = None
-        self._ffplay_lock = threading.Lock()
+        self._tts_queue = StageQueue("tts", TTS_LIMITS)  # 待播队列（整句或整帧 bytes）
+
+        # 接收流水线：读线程只按帧类型入队，解析 / 解码 / 分发在 rx 线程上
+        self._rx = Stage("rx", self._dispatch, RX_LIMITS)
+        self.dispatcher = self._build_dispatcher()
+
+        # 进程内 MP3 播放器：输出流常驻，打断时只清缓冲，不重建
+        self._player = Mp3Player()
+        # 回声消除：播放器输出的每一块作为参考，从采集里减掉（扬声器外放时避免自我打断）
+        self.aec = EchoCanceller() if aec else None
+        if self.aec is not None:
+            self._player.output.tap = self.aec.reference.push
+        elif duplex == FULL_DUPLEX:
+            print("[WARN] 全双工未开回声消除：外放时 TTS 会被当成我方开口，建议戴耳机")
         self._player_started = False
         self._player_lock = threading.Lock()
 
         # 供 send_audio 使用的 ws 引用
         self._ws_ref_lock = threading.Lock()
         self._ws_ref = None
+        self._heartbeat = None  # 进程共享心跳服务里的登记
+        self._writer = None     # 本连接的写线程
 
     # ---------- 音频推流门控 / 打断 ----------
     def gate_can_send(self) -> bool:
-        return not self.agent_speaking.is_set()
+        return self.duplex == FULL_DUPLEX or not self.agent_speaking.is_set()
+
+    def _on_speech_event(self, kind, ts):
+        """推流线程：我方开口 / 说完（采集时刻）。全双工 + 本地打断时，对方说话期间开口即打断。"""
+        if kind == SPEECH_END:
+            self.turns.user_end(ts)
+            return
+        if kind != SPEECH_START:
+            return
+        speaking = self.agent_speaking.is_set()
+        self.turns.user_start(ts, speaking)
+        if speaking and self.duplex == FULL_DUPLEX and self.barge_in == BARGE_IN_CLIENT:
+            self.request_interrupt()
 
     def request_interrupt(self):
         with self._ws_ref_lock:
@@ -58,107 +99,54 @@ class WebsocketHandler:
         if ws is None:
             return
         if not self.want_interrupt.is_set():
+            t0 = time.monotonic()
             self.want_interrupt.set()
-            # 清空音频队列并停止当前播放
-            self._clear_audio_queue()
+            self.turns.interrupted(t0, BARGE_IN_CLIENT)
+            self._end_agent_turn()
+            # 先发打断，再停播；停播与清队列都不阻塞推流线程，打断 → 静音时延从 t0 起算
             # 创建正确的 CLIENT_INTERRUPT 消息格式
-            mid = str(uuid.uuid4())
-            payload = json.dumps({
-                "mid": mid,
-                "contentType": "CLIENT_INTERRUPT",
-                "uid": self.uid
-            })
+            payload = control(self.uid, CLIENT_INTERRUPT)
             try:
                 ws.send(payload)
                 print("[TX-TEXT]", payload)
                 print("[CLIENT_INTERRUPT] sent")
             except Exception as e:
                 print("[CLIENT_INTERRUPT][ERR]", e)
-
-    def _clear_audio_queue(self):
-        """清空音频队列并停止当前播放"""
-        # 清空当前缓冲
+            self._clear_audio_queue(since=t0)
+
+    def _end_agent_turn(self):
+        # 全双工：被打断即视为对方本轮结束（之后的开口不再算作插话）；半双工仍等 COMPLETE 才放开门控
+        if self.duplex == FULL_DUPLEX:
+            self.agent_speaking.clear()
+            self.turns.agent_done()
+
+    def _clear_audio_queue(self, since=None):
+        """停止当前播放并清空音频队列"""
+        # 输出流常驻：只丢弃未播放的数据，下一个输出块内即静音；解码器重置推迟到下一次 write
+        self._player.clear(since)
+
+        # 已收到、还没分发的 TTS 分片同样作废；控制消息保留（句末 / COMPLETE 仍要处理）
+        self._rx.queue.clear(AUDIO)
+        # 清空待播队列并递增 epoch 放在 _tts_lock 内（调用方已先置 want_interrupt），与分发线程“查标志 + 取 epoch”互斥；
+        # 之前读到旧 epoch 的分发线程（含阻塞在 put 上的）入队时被丢弃。clear() 不阻塞，持锁期间没有线程在 put
         with self._tts_lock:
+            self._tts_queue.clear()
             self._tts_cur.clear()
-        
-        # 清空队列
-        while not self._tts_queue.empty():
-            try:
-                self._tts_queue.get_nowait()
-                self._tts_queue.task_done()
-            except queue.Empty:
-                break
-        
-        # 停止 ffplay 并重新启动
-        self._stop_ffplay()
-        self._start_ffplay()
+            self._mp3_frames.reset()
 
     # ---------- 持久播放器 ----------
-    def _start_ffplay(self):
-        """启动唯一的 ffplay 进程，持续写入 stdin。"""
-        with self._ffplay_lock:
-            if self._ffplay and self._ffplay.poll() is None:
-                return
-            try:
-                # -autoexit 会在 stdin EOF 才退出；我们不关闭 stdin，保持常驻
-                self._ffplay = subprocess.Popen(
-                    ["ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet", "-f", "mp3", "-i", "pipe:0"],
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                )
-                print("[FFPLAY] started pid:", self._ffplay.pid)
-            except FileNotFoundError:
-                print("[FFPLAY][ERR] 未找到 ffplay，请确认已安装并在 PATH 中。")
-            except Exception as e:
-                print("[FFPLAY][ERR]", e)
-
-    def _stop_ffplay(self):
-        with self._ffplay_lock:
-            if self._ffplay:
-                try:
-                    # 不写入 EOF，直接结束进程
-                    if os.name == "nt":
-                        self._ffplay.terminate()
-                    else:
-                        os.kill(self._ffplay.pid, signal.SIGTERM)
-                except Exception:
-                    pass
-                try:
-                    self._ffplay.wait(timeout=2)
-                except Exception:
-                    pass
-                self._ffplay = None
-                print("[FFPLAY] stopped")
-
     def _player_loop(self):
-        """顺序消费句队列，把每句 MP3 直接写入持久 ffplay 的 stdin。"""
-        self._start_ffplay()
+        """顺序消费播放队列，把 MP3（整帧或整句）交给进程内播放器（解码后进入常驻输出流）。"""
+        self._player.start()
         while True:
-            # 检查是否处于打断状态，如果是则跳过当前音频
-            if self.want_interrupt.is_set():
-                time.sleep(0.1)  # 短暂休眠以减少CPU占用
-                continue
-                
-            sentence_mp3 = self._tts_queue.get()
+            mp3 = self._tts_queue.get()
             try:
-                with self._ffplay_lock:
-                    # 如果 ffplay 意外退出，重启它
-                    if self._ffplay is None or self._ffplay.poll() is not None:
-                        self._start_ffplay()
-                    if self._ffplay and self._ffplay.stdin:
-                        # 直接写，不关闭，不 flush 强制也可（mp3足够大时自动冲刷）
-                        self._ffplay.stdin.write(sentence_mp3)
-                        self._ffplay.stdin.flush()
-                # 你也可以在两句之间加上极小的停顿（比如 5~15ms），通常不需要
-                # time.sleep(0.005)
+                # 打断状态下跳过残留音频；阻塞在队列上而不是轮询，新一句到达即可起播
+                if self.want_interrupt.is_set():
+                    continue
+                self._player.write(mp3)
             except Exception as e:
                 print("[PLAYER][ERR]", e)
-                # 出错时尝试重启
-                self._stop_ffplay()
-                self._start_ffplay()
-            finally:
-                self._tts_queue.task_done()
 
     def _ensure_player(self):
         with self._player_lock:
@@ -175,7 +163,7 @@ class WebsocketHandler:
         )
         ws = websocket.WebSocketApp(
             ws_url,
-            header=[f"Authorization: Bearer " + get_token()],
+            header=[f"Authorization: Bearer " + get_cached_token()],
             on_open=self.on_open,
             on_message=self.on_message,
             on_error=self.on_error,
@@ -185,124 +173,185 @@ class WebsocketHandler:
 
     def on_open(self, ws):
         print("[WS] connected:", ws.url)
+        # 单写线程：推流 / 打断 / 心跳只入队，控制消息先于排队的音频发出
+        ws = self._writer = ConnectionWriter(ws)
         with self._ws_ref_lock:
             self._ws_ref = ws
-        # 心跳
-        threading.Thread(target=ping, args=(ws, self.uid), daemon=True).start()
-        # 播放线程
+        # 心跳：登记到进程共享的时间轮
+        self._heartbeat = ping(ws, self.uid, on_dead=self._on_heartbeat_dead)
+        # 接收分发线程 + 播放线程
+        self._rx.start()
         self._ensure_player()
-        # 采麦推流（半双工）
+        # 采麦推流（半双工 / 全双工）
         threading.Thread(
             target=send_audio,
             args=(ws, self.uid),
             kwargs={
                 "gate_can_send": self.gate_can_send,
                 "request_interrupt": self.request_interrupt,
+                "frame_ms": self.frame_ms,
+                "aec": self.aec,
+                "speech_events": self._on_speech_event,
+                "codec": self.codec,
             },
             daemon=True
         ).start()
 
-    # ---------- TTS 句边界缓冲 ----------
-    def _enqueue_prev_sentence_if_any(self):
+    # ---------- TTS 分片 / 句边界 ----------
+    def _on_tts_audio(self, chunk):
+        # 打断先置 want_interrupt，再在 _tts_lock 内清队列（epoch 加一）；这里在同一把锁内查标志、取 epoch，
+        # 所以要么在 epoch 加一之前取到旧 epoch（入队时被丢弃），要么在之后看到打断标志直接返回
+        with self._tts_lock:
+            if self.want_interrupt.is_set():
+                return
+            epoch = self._tts_queue.epoch
+            if not self.tts_streaming:
+                self._tts_cur.extend(chunk)
+                return
+            frames = self._mp3_frames.push(chunk)
+        if frames:
+            self._tts_queue.put(frames, AUDIO, epoch=epoch)
+
+    def _flush_tts_frames(self):
+        # 流式模式下句末不足一帧的残余字节也交给解码器
         with self._tts_lock:
-            if self._tts_cur:
-                # 入队上一句，避免被覆盖
-                self._tts_queue.put(bytes(self._tts_cur))
-                self._tts_cur.clear()
+            epoch = self._tts_queue.epoch
+            tail = self._mp3_frames.flush()
+        if tail:
+            self._tts_queue.put(tail, AUDIO, epoch=epoch)
+
+    def _enqueue_prev_sentence_if_any(self):
+        # 新句开始前入队上一句，避免被覆盖
+        self._finish_current_sentence()
 
     def _finish_current_sentence(self):
+        if self.tts_streaming:
+            self._flush_tts_frames()
+            return
+        # 入队不持 _tts_lock：待播队列满时阻塞在 put 上也不会挡住打断清缓冲
         with self._tts_lock:
-            if self._tts_cur:
-                self._tts_queue.put(bytes(self._tts_cur))
-                self._tts_cur.clear()
+            epoch = self._tts_queue.epoch
+            sentence = bytes(self._tts_cur)
+            self._tts_cur.clear()
+        if sentence:
+            self._tts_queue.put(sentence, AUDIO, epoch=epoch)
 
     # ---------- 消息分发 ----------
     def on_message(self, ws, message):
+        # 读线程上只入队：不解析、不解码、不加锁，不会因为下游变慢而停止读帧
+        self._rx.put(message, frame_kind(message))
+
+    def _dispatch(self, message):
+        """rx 线程：按到达顺序解析并分发下行帧。"""
         if isinstance(message, (bytes, bytearray)):
             # 二进制：TTS mp3 分片
             # 如果处于打断状态，忽略接收到的音频数据
             if self.want_interrupt.is_set():
                 return
-            with self._tts_lock:
-                self._tts_cur.extend(message)
-            return
-
-        try:
-            data = json.loads(message)
-        except json.JSONDecodeError:
-            print("Received:", message)
+            self._on_tts_audio(message)
             return
 
-        ctype = data.get("contentType")
-        body = data.get("content") or data.get("data") or {}
-
-        if ctype == "EVENT":
-            ev = body.get("eventType")
-            if ev == "TTS_SENTENCE_START":
-                # 对方开始说：进入"对方说话"状态
-                self.agent_speaking.set()
-                self.want_interrupt.clear()  # 清除打断状态
-                # 新句开始前，若上一句已积累音频但未 complete，先入队
-                self._enqueue_prev_sentence_if_any()
-                txt = (body.get("text") or body.get("eventData", {}).get("text") or "").strip()
-                if txt:
-                    print("[TTS_START]", txt)
-                return
-
-            if ev == "INTERRUPT":
-                # 服务器发送的打断事件
-                print("[EVENT][INTERRUPT] received, clear audio queue")
-                self.want_interrupt.set()
-                self._clear_audio_queue()
-                return
-
-            if ev in ("TTS_COMPLETE", "TTS_SENTENCE_COMPLETE", "COMPLETE"):
-                # 本句（或整个轮次）结束：把当前句入队
-                self._finish_current_sentence()
-                if ev == "COMPLETE":
-                    # 整轮结束：允许我方重新说话
-                    self.agent_speaking.clear()
-                print("[EVENT]", body)
-                return
-
-            print("[EVENT]", body)
+        self.dispatcher.dispatch(message)
+
+    def _build_dispatcher(self):
+        """下行 JSON 消息分发表；应用可再用 dispatcher.on() / on_event() 追加或覆盖。"""
+        d = Dispatcher()
+        d.on_event(TTS_SENTENCE_START, self._on_sentence_start)
+        d.on_event(INTERRUPT, self._on_server_interrupt)
+        d.on_event(SENTENCE_END_EVENTS, self._on_sentence_end)
+        d.on(EVENT, self._on_event)
+        d.on(ASR_TYPES, self._on_asr)
+        d.on(LLM_TYPES, self._on_llm)
+        d.on(TTS_TYPES, self._on_tts_json)
+        d.on(PONG, self._on_pong)
+        d.on_default(self._on_unknown)
+        d.on_invalid(self._on_invalid)
+        return d
+
+    def _on_sentence_start(self, msg):
+        # 对方开始说：进入"对方说话"状态
+        self.turns.agent_start(time.monotonic())
+        self.agent_speaking.set()
+        self.want_interrupt.clear()  # 清除打断状态
+        # 新句开始前，若上一句已积累音频但未 complete，先入队
+        self._enqueue_prev_sentence_if_any()
+        txt = msg.text.strip()
+        if txt:
+            print("[TTS_START]", txt)
+
+    def _on_server_interrupt(self, msg):
+        # 服务器发送的打断事件
+        print("[EVENT][INTERRUPT] received, clear audio queue")
+        if not self.want_interrupt.is_set():
+            # 已由本地发起的打断，服务端回的 INTERRUPT 只是确认，不重复计数
+            self.turns.interrupted(time.monotonic(), BARGE_IN_SERVER)
+        self.want_interrupt.set()
+        self._end_agent_turn()
+        self._clear_audio_queue()
+
+    def _on_sentence_end(self, msg):
+        # 本句（或整个轮次）结束：把当前句入队
+        self._finish_current_sentence()
+        if msg.event_type == COMPLETE:
+            # 整轮结束：允许我方重新说话
+            self.agent_speaking.clear()
+            self.turns.agent_done()
+        print("[EVENT]", msg.body)
+
+    def _on_event(self, msg):
+        print("[EVENT]", msg.body)
+
+    def _on_asr(self, msg):
+        text = msg.text
+        if text:
+            print("[ASR]", text)
+
+    def _on_llm(self, msg):
+        text = msg.text
+        if text:
+            print("[LLM]", text)
+
+    def _on_tts_json(self, msg):
+        # 如果处于打断状态，忽略接收到的音频数据
+        if self.want_interrupt.is_set():
             return
+        # JSON base64 音频与二进制分片同样处理
+        b64 = msg.audio_b64
+        if b64:
+            try:
+                self._on_tts_audio(base64.b64decode(b64))
+            except Exception as e:
+                print("[TTS][b64-decode][ERR]", e)
 
-        if ctype in ("ASR", "RESULT_ASR", "ASR_PARTIAL"):
-            text = body.get("text") or body.get("result") or ""
-            if text:
-                print("[ASR]", text)
-            return
+    def _on_pong(self, msg):
+        if self._heartbeat is not None:
+            self._heartbeat.pong(msg.data.get("mid"))
 
-        if ctype in ("LLM", "AGENT", "RESULT_TEXT", "TEXT"):
-            text = body.get("content") or body.get("text") or ""
-            if text:
-                print("[LLM]", text)
-            return
+    def _on_heartbeat_dead(self, hb):
+        # 时间轮线程上回调，关连接可能阻塞，另起线程
+        print("[HEARTBEAT] 连续 %d 次未收到 PONG，断开连接" % hb.missed)
+        with self._ws_ref_lock:
+            ws = self._ws_ref
+        if ws is not None:
+            threading.Thread(target=ws.close, daemon=True).start()
 
-        if ctype in ("TTS", "RESULT_AUDIO", "AUDIO"):
-            # 如果处于打断状态，忽略接收到的音频数据
-            if self.want_interrupt.is_set():
-                return
-            # JSON base64 音频也归入当前句缓冲
-            b64 = body.get("audio") or body.get("audioBase64") or body.get("chunk")
-            if b64:
-                try:
-                    chunk = base64.b64decode(b64)
-                    with self._tts_lock:
-                        self._tts_cur.extend(chunk)
-                except Exception as e:
-                    print("[TTS][b64-decode][ERR]", e)
-            return
+    def _on_unknown(self, msg):
+        print("[MSG][", msg.content_type, "]", msg.dumps())
 
-        print("[MSG][", ctype, "]", json.dumps(data, ensure_ascii=False))
+    def _on_invalid(self, raw):
+        print("Received:", raw)
 
     def on_error(self, ws, error):
         print("[ERROR]", error)
 
     def on_close(self, ws, close_status_code, close_msg):
         print("[CLOSED]", close_status_code, close_msg)
-        self._stop_ffplay()
+        if self._heartbeat is not None:
+            self._heartbeat.close()
+        if self._writer is not None:
+            self._writer.stop()
+        print("[PERF]", self.turns.format())
+        self._player.stop()
 
 
 if __name__ == "__main__":
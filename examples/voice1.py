@@ -3,41 +3,31 @@
 """
 语音对话示例（保留原始结构）
 - 与原始示例相同地组织 botId/sessionId/requestId
-- on_open 启动 ping 线程 + 音频发送
+- on_open 登记心跳（进程共享的时间轮）+ 音频发送
 - on_message 解析服务端下行，并自动播放 TTS 音频（若存在）
 """
 
 import threading
 import uuid
 import json
-import tempfile
-import subprocess
-import os
 import websocket
 
-from auth_token_demo import get_token
+from auth_token_demo import get_cached_token
 from config import BOT_ID
 from joy_inside_py.api_config import URL_VOICE_CHAT
 from joy_inside_py.audio_tool import send_audio
 from joy_inside_py.event_handler import ping
+from joy_inside_py.send_queue import ConnectionWriter
+from joy_inside_py.player import Mp3Player
+
+# 进程内流式播放：分片直接解码进常驻输出流，不写临时文件、不起子进程
+# 如果没有 av / sounddevice，这里会提示但不影响收发
+_player = Mp3Player()
+
 
-# 如果没有 ffmpeg/ffplay，这里会提示但不影响收发
 def _play_mp3_bytes(mp3_bytes: bytes):
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as f:
-            f.write(mp3_bytes)
-            path = f.name
-        subprocess.run(
-            ["ffplay", "-nodisp", "-autoexit", path],
-            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False
-        )
-    except FileNotFoundError:
-        print("[WARN] 未检测到 ffplay（ffmpeg）。无法播放下行音频。")
-    finally:
-        try:
-            os.remove(path)
-        except Exception:
-            pass
+    _player.start()
+    _player.write(mp3_bytes)
 
 
 class WebsocketHandler:
@@ -45,6 +35,8 @@ class WebsocketHandler:
     sessionId = BOT_ID + str(uuid.uuid4())
     requestId = str(uuid.uuid4())
     uid = ""
+    _heartbeat = None
+    _writer = None
 
     def start(self, uid):
         self.uid = uid
@@ -53,7 +45,7 @@ class WebsocketHandler:
             URL_VOICE_CHAT, BOT_ID, self.sessionId, self.requestId
         )
 
-        headers = [f"Authorization: Bearer " + get_token()]
+        headers = [f"Authorization: Bearer " + get_cached_token()]
 
         ws = websocket.WebSocketApp(
             ws_url,
@@ -67,8 +59,9 @@ class WebsocketHandler:
 
     def on_open(self, ws):
         print("[WS] connected:", ws.url)
-        # 按原始示例：启动心跳线程
-        threading.Thread(target=ping, args=(ws, self.uid), daemon=True).start()
+        # 心跳与音频都交给本连接的写线程发送；心跳登记到进程共享的时间轮，不再单起线程
+        ws = self._writer = ConnectionWriter(ws)
+        self._heartbeat = ping(ws, self.uid)
         # 发送音频（改为麦克风优先；audio_tool 内部已处理）
         threading.Thread(target=send_audio, args=(ws, self.uid), daemon=True).start()
 
@@ -111,6 +104,8 @@ class WebsocketHandler:
                 print("[TTS] 无音频字段。")
 
         elif ctype in ("EVENT", "STATE", "PONG"):
+            if ctype == "PONG" and self._heartbeat is not None:
+                self._heartbeat.pong(data.get("mid"))
             print("[EVENT]", body)
 
         else:
@@ -121,6 +116,11 @@ class WebsocketHandler:
 
     def on_close(self, ws, close_status_code, close_msg):
         print("WebSocket closed", close_status_code, close_msg)
+        if self._heartbeat is not None:
+            self._heartbeat.close()
+        if self._writer is not None:
+            self._writer.stop()
+        _player.stop()
 
 
 if __name__ == "__main__":
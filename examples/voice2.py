@@ -1,24 +1,23 @@
 # -*- coding: utf-8 -*-
 """
-语音对话示例（半双工 + 逐句播放队列，持久 ffplay，无缝衔接）
+语音对话示例（半双工 + 逐句播放队列，进程内流式解码播放，无缝衔接）
 """
 
 import json
 import threading
 import uuid
 import base64
-import subprocess
 import queue
-import os
-import signal
 
 import websocket
 
-from auth_token_demo import get_token
+from auth_token_demo import get_cached_token
 from config import BOT_ID
 from joy_inside_py.api_config import URL_VOICE_CHAT
 from joy_inside_py.audio_tool import send_audio
 from joy_inside_py.event_handler import ping
+from joy_inside_py.send_queue import ConnectionWriter
+from joy_inside_py.player import Mp3Player
 
 
 class WebsocketHandler:
@@ -37,15 +36,16 @@ class WebsocketHandler:
         self._tts_lock = threading.Lock()
         self._tts_queue = queue.Queue(maxsize=200)  # 待播句队列（bytes）
 
-        # 持久 ffplay
-        self._ffplay = None
-        self._ffplay_lock = threading.Lock()
+        # 进程内 MP3 播放器：输出流常驻，打断时只清缓冲，不重建
+        self._player = Mp3Player()
         self._player_started = False
         self._player_lock = threading.Lock()
 
         # 供 send_audio 使用的 ws 引用
         self._ws_ref_lock = threading.Lock()
         self._ws_ref = None
+        self._heartbeat = None
+        self._writer = None
 
     # ---------- 音频推流门控 / 打断 ----------
     def gate_can_send(self) -> bool:
@@ -67,64 +67,15 @@ class WebsocketHandler:
                 print("[CLIENT_INTERRUPT][ERR]", e)
 
     # ---------- 持久播放器 ----------
-    def _start_ffplay(self):
-        """启动唯一的 ffplay 进程，持续写入 stdin。"""
-        with self._ffplay_lock:
-            if self._ffplay and self._ffplay.poll() is None:
-                return
-            try:
-                # -autoexit 会在 stdin EOF 才退出；我们不关闭 stdin，保持常驻
-                self._ffplay = subprocess.Popen(
-                    ["ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet", "-f", "mp3", "-i", "pipe:0"],
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                )
-                print("[FFPLAY] started pid:", self._ffplay.pid)
-            except FileNotFoundError:
-                print("[FFPLAY][ERR] 未找到 ffplay，请确认已安装并在 PATH 中。")
-            except Exception as e:
-                print("[FFPLAY][ERR]", e)
-
-    def _stop_ffplay(self):
-        with self._ffplay_lock:
-            if self._ffplay:
-                try:
-                    # 不写入 EOF，直接结束进程
-                    if os.name == "nt":
-                        self._ffplay.terminate()
-                    else:
-                        os.kill(self._ffplay.pid, signal.SIGTERM)
-                except Exception:
-                    pass
-                try:
-                    self._ffplay.wait(timeout=2)
-                except Exception:
-                    pass
-                self._ffplay = None
-                print("[FFPLAY] stopped")
-
     def _player_loop(self):
-        """顺序消费句队列，把每句 MP3 直接写入持久 ffplay 的 stdin。"""
-        self._start_ffplay()
+        """顺序消费句队列，把每句 MP3 交给进程内播放器（解码后进入常驻输出流）。"""
+        self._player.start()
         while True:
             sentence_mp3 = self._tts_queue.get()
             try:
-                with self._ffplay_lock:
-                    # 如果 ffplay 意外退出，重启它
-                    if self._ffplay is None or self._ffplay.poll() is not None:
-                        self._start_ffplay()
-                    if self._ffplay and self._ffplay.stdin:
-                        # 直接写，不关闭，不 flush 强制也可（mp3足够大时自动冲刷）
-                        self._ffplay.stdin.write(sentence_mp3)
-                        self._ffplay.stdin.flush()
-                # 你也可以在两句之间加上极小的停顿（比如 5~15ms），通常不需要
-                # time.sleep(0.005)
+                self._player.write(sentence_mp3)
             except Exception as e:
                 print("[PLAYER][ERR]", e)
-                # 出错时尝试重启
-                self._stop_ffplay()
-                self._start_ffplay()
             finally:
                 self._tts_queue.task_done()
 
@@ -143,7 +94,7 @@ class WebsocketHandler:
         )
         ws = websocket.WebSocketApp(
             ws_url,
-            header=[f"Authorization: Bearer " + get_token()],
+            header=[f"Authorization: Bearer " + get_cached_token()],
             on_open=self.on_open,
             on_message=self.on_message,
             on_error=self.on_error,
@@ -153,10 +104,12 @@ class WebsocketHandler:
 
     def on_open(self, ws):
         print("[WS] connected:", ws.url)
+        # 单写线程：推流 / 打断 / 心跳只入队，控制消息先于排队的音频发出
+        ws = self._writer = ConnectionWriter(ws)
         with self._ws_ref_lock:
             self._ws_ref = ws
-        # 心跳
-        threading.Thread(target=ping, args=(ws, self.uid), daemon=True).start()
+        # 心跳：登记到进程共享的时间轮
+        self._heartbeat = ping(ws, self.uid)
         # 播放线程
         self._ensure_player()
         # 采麦推流（半双工）
@@ -250,6 +203,11 @@ class WebsocketHandler:
                     print("[TTS][b64-decode][ERR]", e)
             return
 
+        if ctype == "PONG":
+            if self._heartbeat is not None:
+                self._heartbeat.pong(data.get("mid"))
+            return
+
         print("[MSG][", ctype, "]", json.dumps(data, ensure_ascii=False))
 
     def on_error(self, ws, error):
@@ -257,7 +215,11 @@ class WebsocketHandler:
 
     def on_close(self, ws, close_status_code, close_msg):
         print("[CLOSED]", close_status_code, close_msg)
-        self._stop_ffplay()
+        if self._heartbeat is not None:
+            self._heartbeat.close()
+        if self._writer is not None:
+            self._writer.stop()
+        self._player.stop()
 
 
 if __name__ == "__main__":
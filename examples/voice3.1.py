@@ -1,418 +1,625 @@
-# -*- coding: utf-8 -*-
-"""
-语音对话示例（半双工 + 逐句播放队列，持久 ffplay，无缝衔接）
-"""
-
-import json
-import threading
-import uuid
-import base64
-import subprocess
-import queue
-import os
-import signal
-import time
-import datetime
-import struct
-import math
-import sys
-import os
-
-import websocket
-
-from auth_token_demo import get_token
-from config import BOT_ID
-from joy_inside_py.api_config import URL_VOICE_CHAT
-from joy_inside_py.audio_tool3 import send_audio
-from joy_inside_py.event_handler import ping
-
-# 清除可能的模块缓存
-if 'joy_inside_py.audio_tool3' in sys.modules:
-    del sys.modules['joy_inside_py.audio_tool3']
-
-class WebsocketHandler:
-    # 按官方示例：sessionId = BOT_ID + UUID
-    sessionId = BOT_ID + str(uuid.uuid4())
-    requestId = str(uuid.uuid4())
-    uid = ""
-
-    def __init__(self):
-        # 半双工：对方在说话→暂停我方推流
-        self.agent_speaking = threading.Event()
-        self.want_interrupt = threading.Event()
-
-        # TTS 逐句缓冲与播放
-        self._tts_cur = bytearray()           # 当前句的缓冲
-        self._tts_lock = threading.Lock()
-        self._tts_queue = queue.Queue(maxsize=200)  # 待播句队列（bytes）
-
-        # 持久 ffplay
-        self._ffplay = None
-        self._ffplay_lock = threading.Lock()
-        self._player_started = False
-        self._player_lock = threading.Lock()
-
-        # 供 send_audio 使用的 ws 引用
-        self._ws_ref_lock = threading.Lock()
-        self._ws_ref = None
-        
-        # 性能监测
-        self.performance_metrics = {
-            "user_speech_end_time": None,
-            "ai_speech_start_time": None,
-            "response_times": []
-        }
-        self.current_round_id = None
-        
-        # 音频处理相关
-        self.audio_buffer = bytearray()
-        self.silence_threshold = 500  # 静音阈值，可根据实际情况调整
-        self.silence_duration = 0.5  # 静音持续时间（秒）
-        self.silence_samples = 0  # 连续静音样本计数
-        self.sample_rate = 16000  # 假设采样率为16kHz
-        self.sample_width = 2  # 假设样本宽度为2字节（16位）
-        self.channels = 1  # 单声道
-
-    # ---------- 性能监测 ----------
-    def _record_user_speech_end(self):
-        """记录用户说话结束的时间"""
-        self.performance_metrics["user_speech_end_time"] = time.time()
-        print(f"[PERF] User speech ended at: {datetime.datetime.now().strftime('%H:%M:%S.%f')[:-3]}")
-
-    def _record_ai_speech_start(self):
-        """记录AI开始说话的时间"""
-        self.performance_metrics["ai_speech_start_time"] = time.time()
-        print(f"[PERF] AI speech started at: {datetime.datetime.now().strftime('%H:%M:%S.%f')[:-3]}")
-        
-        # 计算响应时间
-        if self.performance_metrics["user_speech_end_time"] is not None:
-            response_time = self.performance_metrics["ai_speech_start_time"] - self.performance_metrics["user_speech_end_time"]
-            self.performance_metrics["response_times"].append(response_time)
-            print(f"[PERF] Response time: {response_time:.3f} seconds")
-            
-            # 打印统计信息
-            if len(self.performance_metrics["response_times"]) > 0:
-                avg_time = sum(self.performance_metrics["response_times"]) / len(self.performance_metrics["response_times"])
-                print(f"[PERF] Average response time: {avg_time:.3f} seconds")
-                print(f"[PERF] Total responses: {len(self.performance_metrics['response_times'])}")
-
-    # ---------- 音频处理 ----------
-    def _calculate_rms(self, data):
-        """计算音频数据的RMS（均方根）值"""
-        # 将字节数据转换为16位整数
-        count = len(data) // self.sample_width
-        format_str = f"{count}h"  # 例如 "1920h" 表示1920个16位整数
-        
-        try:
-            # 将字节数据解包为整数列表
-            shorts = struct.unpack(format_str, data)
-            
-            # 计算平方和
-            sum_squares = 0.0
-            for sample in shorts:
-                # 归一化到[-1, 1]范围
-                normalized = sample / 32768.0
-                sum_squares += normalized * normalized
-                
-            # 计算RMS
-            rms = math.sqrt(sum_squares / count)
-            # 将RMS值转换为0-32767的范围
-            return rms * 32767
-        except struct.error:
-            return 0
-
-    def _process_audio_chunk(self, audio_data):
-        """
-        处理音频块，检测语音结束
-        audio_data: 音频数据字节
-        """
-        # 计算音频能量
-        rms = self._calculate_rms(audio_data)
-        
-        # 检测是否为静音
-        if rms < self.silence_threshold:
-            self.silence_samples += len(audio_data) // self.sample_width
-        else:
-            self.silence_samples = 0
-        
-        # 如果静音持续时间超过阈值，则认为语音结束
-        silence_seconds = self.silence_samples / self.sample_rate
-        if silence_seconds >= self.silence_duration:
-            # 记录用户说话结束的时间
-            if self.performance_metrics["user_speech_end_time"] is None:
-                self._record_user_speech_end()
-                # 重置静音计数
-                self.silence_samples = 0
-    
-    # ---------- 音频推流门控 / 打断 ----------
-    def gate_can_send(self) -> bool:
-        return not self.agent_speaking.is_set()
-
-    def request_interrupt(self):
-        with self._ws_ref_lock:
-            ws = self._ws_ref
-        if ws is None:
-            return
-        if not self.want_interrupt.is_set():
-            self.want_interrupt.set()
-            # 清空音频队列并停止当前播放
-            self._clear_audio_queue()
-            # 创建正确的 CLIENT_INTERRUPT 消息格式
-            mid = str(uuid.uuid4())
-            payload = json.dumps({
-                "mid": mid,
-                "contentType": "CLIENT_INTERRUPT",
-                "uid": self.uid
-            })
-            try:
-                ws.send(payload)
-                print("[TX-TEXT]", payload)
-                print("[CLIENT_INTERRUPT] sent")
-            except Exception as e:
-                print("[CLIENT_INTERRUPT][ERR]", e)
-
-    def _clear_audio_queue(self):
-        """清空音频队列并停止当前播放"""
-        # 清空当前缓冲
-        with self._tts_lock:
-            self._tts_cur.clear()
-        
-        # 清空队列
-        while not self._tts_queue.empty():
-            try:
-                self._tts_queue.get_nowait()
-                self._tts_queue.task_done()
-            except queue.Empty:
-                break
-        
-        # 停止 ffplay 并重新启动
-        self._stop_ffplay()
-        self._start_ffplay()
-
-    # ---------- 持久播放器 ----------
-    def _start_ffplay(self):
-        """启动唯一的 ffplay 进程，持续写入 stdin。"""
-        with self._ffplay_lock:
-            if self._ffplay and self._ffplay.poll() is None:
-                return
-            try:
-                # -autoexit 会在 stdin EOF 才退出；我们不关闭 stdin，保持常驻
-                self._ffplay = subprocess.Popen(
-                    ["ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet", "-f", "mp3", "-i", "pipe:0"],
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                )
-                print("[FFPLAY] started pid:", self._ffplay.pid)
-            except FileNotFoundError:
-                print("[FFPLAY][ERR] 未找到 ffplay，请确认已安装并在 PATH 中。")
-            except Exception as e:
-                print("[FFPLAY][ERR]", e)
-
-    def _stop_ffplay(self):
-        with self._ffplay_lock:
-            if self._ffplay:
-                try:
-                    # 不写入 EOF，直接结束进程
-                    if os.name == "nt":
-                        self._ffplay.terminate()
-                    else:
-                        os.kill(self._ffplay.pid, signal.SIGTERM)
-                except Exception:
-                    pass
-                try:
-                    self._ffplay.wait(timeout=2)
-                except Exception:
-                    pass
-                self._ffplay = None
-                print("[FFPLAY] stopped")
-
-    def _player_loop(self):
-        """顺序消费句队列，把每句 MP3 直接写入持久 ffplay 的 stdin。"""
-        self._start_ffplay()
-        while True:
-            # 检查是否处于打断状态，如果是则跳过当前音频
-            if self.want_interrupt.is_set():
-                time.sleep(0.1)  # 短暂休眠以减少CPU占用
-                continue
-                
-            sentence_mp3 = self._tts_queue.get()
-            try:
-                with self._ffplay_lock:
-                    # 如果 ffplay 意外退出，重启它
-                    if self._ffplay is None or self._ffplay.poll() is not None:
-                        self._start_ffplay()
-                    if self._ffplay and self._ffplay.stdin:
-                        # 直接写，不关闭，不 flush 强制也可（mp3足够大时自动冲刷）
-                        self._ffplay.stdin.write(sentence_mp3)
-                        self._ffplay.stdin.flush()
-                # 你也可以在两句之间加上极小的停顿（比如 5~15ms），通常不需要
-                # time.sleep(0.005)
-            except Exception as e:
-                print("[PLAYER][ERR]", e)
-                # 出错时尝试重启
-                self._stop_ffplay()
-                self._start_ffplay()
-            finally:
-                self._tts_queue.task_done()
-
-    def _ensure_player(self):
-        with self._player_lock:
-            if not self._player_started:
-                t = threading.Thread(target=self._player_loop, daemon=True)
-                t.start()
-                self._player_started = True
-
-    # ---------- WebSocket ----------
-    def start(self, uid):
-        self.uid = uid
-        ws_url = "%s?botId=%s&sessionId=%s&requestId=%s" % (
-            URL_VOICE_CHAT, BOT_ID, self.sessionId, self.requestId
-        )
-        ws = websocket.WebSocketApp(
-            ws_url,
-            header=[f"Authorization: Bearer " + get_token()],
-            on_open=self.on_open,
-            on_message=self.on_message,
-            on_error=self.on_error,
-            on_close=self.on_close
-        )
-        ws.run_forever()
-
-    def on_open(self, ws):
-        print("[WS] connected:", ws.url)
-        with self._ws_ref_lock:
-            self._ws_ref = ws
-        # 心跳
-        threading.Thread(target=ping, args=(ws, self.uid), daemon=True).start()
-        # 播放线程
-        self._ensure_player()
-        # 采麦推流（半双工）- 直接使用修改后的send_audio函数
-        threading.Thread(
-            target=send_audio,
-            args=(ws, self.uid),
-            kwargs={
-                "gate_can_send": self.gate_can_send,
-                "request_interrupt": self.request_interrupt,
-                "audio_callback": self._process_audio_chunk  # 添加音频回调
-            },
-            daemon=True
-        ).start()
-
-    # ---------- TTS 句边界缓冲 ----------
-    def _enqueue_prev_sentence_if_any(self):
-        with self._tts_lock:
-            if self._tts_cur:
-                # 入队上一句，避免被覆盖
-                self._tts_queue.put(bytes(self._tts_cur))
-                self._tts_cur.clear()
-
-    def _finish_current_sentence(self):
-        with self._tts_lock:
-            if self._tts_cur:
-                self._tts_queue.put(bytes(self._tts_cur))
-                self._tts_cur.clear()
-
-    # ---------- 消息分发 ----------
-    def on_message(self, ws, message):
-        if isinstance(message, (bytes, bytearray)):
-            # 二进制：TTS mp3 分片
-            # 如果处于打断状态，忽略接收到的音频数据
-            if self.want_interrupt.is_set():
-                return
-            with self._tts_lock:
-                self._tts_cur.extend(message)
-            return
-
-        try:
-            data = json.loads(message)
-        except json.JSONDecodeError:
-            print("Received:", message)
-            return
-
-        ctype = data.get("contentType")
-        body = data.get("content") or data.get("data") or {}
-
-        if ctype == "EVENT":
-            ev = body.get("eventType")
-            if ev == "TTS_SENTENCE_START":
-                # 对方开始说：进入"对方说话"状态
-                self.agent_speaking.set()
-                self.want_interrupt.clear()  # 清除打断状态
-                # 新句开始前，若上一句已积累音频但未 complete，先入队
-                self._enqueue_prev_sentence_if_any()
-                txt = (body.get("text") or body.get("eventData", {}).get("text") or "").strip()
-                if txt:
-                    print("[TTS_START]", txt)
-                
-                # 记录AI开始说话的时间
-                self._record_ai_speech_start()
-                return
-
-            if ev == "INTERRUPT":
-                # 服务器发送的打断事件
-                print("[EVENT][INTERRUPT] received, clear audio queue")
-                self.want_interrupt.set()
-                self._clear_audio_queue()
-                return
-
-            if ev in ("TTS_COMPLETE", "TTS_SENTENCE_COMPLETE", "COMPLETE"):
-                # 本句（或整个轮次）结束：把当前句入队
-                self._finish_current_sentence()
-                if ev == "COMPLETE":
-                    # 整轮结束：允许我方重新说话
-                    self.agent_speaking.clear()
-                print("[EVENT]", body)
-                return
-
-            print("[EVENT]", body)
-            return
-
-        if ctype in ("ASR", "RESULT_ASR", "ASR_PARTIAL"):
-            text = body.get("text") or body.get("result") or ""
-            if text:
-                print("[ASR]", text)
-                # 重置用户说话结束时间，避免重复记录
-                self.performance_metrics["user_speech_end_time"] = None
-            return
-
-        if ctype in ("LLM", "AGENT", "RESULT_TEXT", "TEXT"):
-            text = body.get("content") or body.get("text") or ""
-            if text:
-                print("[LLM]", text)
-            return
-
-        if ctype in ("TTS", "RESULT_AUDIO", "AUDIO"):
-            # 如果处于打断状态，忽略接收到的音频数据
-            if self.want_interrupt.is_set():
-                return
-            # JSON base64 音频也归入当前句缓冲
-            b64 = body.get("audio") or body.get("audioBase64") or body.get("chunk")
-            if b64:
-                try:
-                    chunk = base64.b64decode(b64)
-                    with self._tts_lock:
-                        self._tts_cur.extend(chunk)
-                except Exception as e:
-                    print("[TTS][b64-decode][ERR]", e)
-            return
-
-        print("[MSG][", ctype, "]", json.dumps(data, ensure_ascii=False))
-
-    def on_error(self, ws, error):
-        print("[ERROR]", error)
-
-    def on_close(self, ws, close_status_code, close_msg):
-        print("[CLOSED]", close_status_code, close_msg)
-        # 打印最终性能统计
-        if self.performance_metrics["response_times"]:
-            avg_time = sum(self.performance_metrics["response_times"]) / len(self.performance_metrics["response_times"])
-            print(f"[PERF] Final average response time: {avg_time:.3f} seconds")
-            print(f"[PERF] Total responses measured: {len(self.performance_metrics['response_times'])}")
-        self._stop_ffplay()
-
-
-if __name__ == "__main__":
-    userId = "123456"
-    handler = WebsocketHandler()
-    handler.start(userId)
\ No newline at end of file
+# -*- coding: utf-8 -*-
+"""
+语音对话示例（半双工 / 可选全双工 + 逐句播放队列，进程内流式解码播放，无缝衔接）
+"""
+
+import threading
+import uuid
+import base64
+import time
+import sys
+import argparse
+from collections import namedtuple
+
+import websocket
+
+from auth_token_demo import get_cached_token, token_manager
+from config import BOT_ID
+from joy_inside_py.api_config import URL_VOICE_CHAT, FRAME_MS, FRAME_MS_CHOICES
+from joy_inside_py.audio_tool3 import send_audio
+from joy_inside_py.event_handler import ping
+from joy_inside_py.player import Mp3Player, Mp3FrameSplitter
+from joy_inside_py.session_record import SessionRecorder
+from joy_inside_py.pacer import CapturePacer
+from joy_inside_py.aec import EchoCanceller
+from joy_inside_py.duplex import (TurnMetrics, HALF_DUPLEX, FULL_DUPLEX, BARGE_IN_CLIENT, BARGE_IN_SERVER,
+                                   SPEECH_START, SPEECH_FIRST_FRAME, SPEECH_END, DUPLEX_MODES, BARGE_IN_CHOICES,
+                                   mode_label)
+from joy_inside_py import timeline as tl  # 阶段名与 protocol 的事件名有重名（TTS_SENTENCE_START），按模块引用
+from joy_inside_py.codec import CODECS
+from joy_inside_py.send_queue import ConnectionWriter, format_writer_stats
+from joy_inside_py.reconnect import Backoff, UplinkRelay, REPLAY_MS
+from joy_inside_py.conn_pool import VoiceConnectionPool, format_pool_stats
+from joy_inside_py.protocol import (Dispatcher, EVENT, ASR_TYPES, LLM_TYPES, TTS_TYPES, TTS_SENTENCE_START, INTERRUPT,
+                                     COMPLETE, SENTENCE_END_EVENTS, CLIENT_INTERRUPT, ASR_PARTIAL, PONG, control)
+from joy_inside_py.pipeline import (Stage, StageQueue, AUDIO, MARK, BLOCK, DROP_OLDEST, RX_LIMITS, TTS_QUEUE_SIZE,
+                                     frame_kind, format_stats)
+
+# 清除可能的模块缓存
+if 'joy_inside_py.audio_tool3' in sys.modules:
+    del sys.modules['joy_inside_py.audio_tool3']
+
+# 句首标记：只作为播放队列里的元数据，用于统计“句首 → 首段音频送播”时延，不再决定何时送播
+SentenceMark = namedtuple("SentenceMark", ["ts"])
+
+# 待播队列：音频满了阻塞 rx 分发线程（背压停在 rx 队列，不传到读线程）；句首标记只保留最近的
+TTS_LIMITS = {AUDIO: (TTS_QUEUE_SIZE, BLOCK), MARK: (50, DROP_OLDEST)}
+
+
+class WebsocketHandler:
+    # 按官方示例：sessionId = BOT_ID + UUID
+    sessionId = BOT_ID + str(uuid.uuid4())
+    requestId = str(uuid.uuid4())
+    uid = ""
+
+    def __init__(self, recorder=None, frame_ms=FRAME_MS, codec="pcm", tts_streaming=True, aec=True,
+                 duplex=HALF_DUPLEX, barge_in=BARGE_IN_CLIENT, timeline_out=None, audio_backend=None,
+                 reconnect=True, pool=None):
+        # 上行帧时长（ms）：越短端点判定越及时，但每秒消息数和协议开销越大
+        self.frame_ms = frame_ms
+        # 上行编码："pcm"（默认）或 "opus"（需服务端支持）
+        self.codec = codec
+        # TTS 播放：流式（默认，收齐整帧即播）或逐句（整句到齐后才播）
+        self.tts_streaming = tts_streaming
+        # 会话录制（可选）：记录所有上/下行帧，供 replay_session.py 回放
+        self._recorder = recorder
+
+        # 双工模式：半双工（默认）对方在说话→暂停我方推流；全双工照常推流，由 barge_in 决定谁来打断
+        self.duplex = duplex
+        self.barge_in = barge_in
+        self.turns = TurnMetrics(mode_label(duplex, barge_in))
+        self.agent_speaking = threading.Event()
+        self.want_interrupt = threading.Event()
+
+        # TTS 逐句缓冲与播放
+        self._tts_cur = bytearray()           # 当前句的缓冲（逐句模式）
+        self._mp3_frames = Mp3FrameSplitter()  # 流式模式：分片凑齐整帧即送播
+        self._tts_lock = threading.Lock()
+        self._tts_queue = StageQueue("tts", TTS_LIMITS)  # 待播队列（整句或整帧 bytes）
+
+        # 接收流水线：读线程只按帧类型入队，解析 / 解码 / 分发在 rx 线程上
+        self._rx = Stage("rx", self._dispatch, RX_LIMITS)
+        self.dispatcher = self._build_dispatcher()
+
+        # 进程内 MP3 播放器：输出流常驻，打断时只清缓冲，不重建
+        # audio_backend：sounddevice 兼容对象，离线基准（latency_bench.py）用虚拟声卡替代麦克风 / 扬声器
+        self.audio_backend = audio_backend
+        self._player = Mp3Player(backend=audio_backend)
+        # 回声消除：播放器输出的每一块作为参考，从采集里减掉（扬声器外放时避免自我打断）
+        self.aec = EchoCanceller() if aec else None
+        if self.aec is not None:
+            self._player.output.tap = self.aec.reference.push
+        elif duplex == FULL_DUPLEX:
+            print("[WARN] 全双工未开回声消除：外放时 TTS 会被当成我方开口，建议戴耳机")
+        self._player_started = False
+        self._player_lock = threading.Lock()
+
+        # 供 send_audio 使用的 ws 引用
+        self._ws_ref_lock = threading.Lock()
+        self._ws_ref = None
+        self._app = None  # WebSocketApp，stop() 用
+        self._heartbeat = None  # 进程共享心跳服务里的登记（on_open 登记，on_close 注销）
+        self._writer = None     # 本连接的写线程（on_open 创建，on_close 停止）
+
+        # 断线重连：推流线程只持有 relay（跨连接不变），断线期间只缓存，重连后先回放进行中的一句
+        self.reconnect = reconnect
+        self._relay = UplinkRelay(max_frames=max(1, REPLAY_MS // frame_ms))
+        self._backoff = Backoff()
+        self._stopping = threading.Event()
+        self._cached_token = False  # 本次连接用的是缓存 token（401 时作废缓存）
+        self._audio_started = False
+        self._capture = None  # 采麦推流线程：会话结束时 _stopping 让它退出，退出时关闭上行发送器
+
+        # 预热连接池（可选，VoiceConnectionPool）：会话的首条连接优先从池里取，重连仍直连（沿用本会话的 sessionId）
+        # 录制会话时不取池里的连接：录制要从握手起包住 ws
+        self.pool = pool
+        self.connect_ms = None   # start() → 首条连接就绪
+        self._pool_hit = None    # 首条连接是否取自连接池（None：未使用连接池）
+        self._start_ts = None
+        
+        # 性能监测
+        self.performance_metrics = {
+            "tts_first_audio_ms": []  # TTS_SENTENCE_START → 本句首段音频交给播放器
+        }
+        self._sentence_mark = None
+        self.current_round_id = None
+        # 逐轮时间线：开口 → 首帧 → FINISH → ASR → LLM → 句首 → 首个音频字节 → 声卡出声，全部 monotonic 打点；
+        # 说完时刻取自真正发出 CLIENT_AUDIO_FINISH 的端点检测，不再另起一个能量检测
+        self.timeline = tl.TurnTimeline(self.turns.mode)
+        self.timeline_out = timeline_out  # 退出时把逐轮时间线与各段直方图导出为 JSON lines
+        self._player.output.on_start = self._on_playback_start
+        # 上行节奏：按采集时刻推帧，记录每帧发送滞后（超过两帧时长告警）
+        self.pacer = CapturePacer(lag_warn_ms=2 * frame_ms)
+
+    # ---------- 性能监测 ----------
+    def _on_playback_start(self, heard_at):
+        """声卡回调线程：空闲后首个有声采样到达 DAC。"""
+        self.timeline.mark(tl.PLAYBACK_START, heard_at)
+
+    # ---------- 音频推流门控 / 打断 ----------
+    def gate_can_send(self) -> bool:
+        return self.duplex == FULL_DUPLEX or not self.agent_speaking.is_set()
+
+    def _on_speech_event(self, kind, ts):
+        """推流线程：我方开口 / 首帧发出 / 说完。全双工 + 本地打断时，对方说话期间开口即打断。"""
+        if kind == SPEECH_END:
+            self.turns.user_end(ts)
+            self.timeline.mark(tl.FINISH_SENT, ts)
+            return
+        if kind == SPEECH_FIRST_FRAME:
+            self.timeline.mark(tl.FIRST_FRAME_SENT, ts)
+            return
+        if kind != SPEECH_START:
+            return
+        self.timeline.begin(ts)
+        speaking = self.agent_speaking.is_set()
+        self.turns.user_start(ts, speaking)
+        if speaking and self.duplex == FULL_DUPLEX and self.barge_in == BARGE_IN_CLIENT:
+            self.request_interrupt()
+
+    def request_interrupt(self):
+        with self._ws_ref_lock:
+            ws = self._ws_ref
+        if ws is None:
+            return
+        if not self.want_interrupt.is_set():
+            t0 = time.monotonic()
+            self.want_interrupt.set()
+            self.turns.interrupted(t0, BARGE_IN_CLIENT)
+            self._end_agent_turn()
+            # 先发打断，再停播；停播与清队列都不阻塞推流线程，打断 → 静音时延从 t0 起算
+            # 创建正确的 CLIENT_INTERRUPT 消息格式
+            payload = control(self.uid, CLIENT_INTERRUPT)
+            try:
+                ws.send(payload)
+                print("[TX-TEXT]", payload)
+                print("[CLIENT_INTERRUPT] sent")
+            except Exception as e:
+                print("[CLIENT_INTERRUPT][ERR]", e)
+            self._clear_audio_queue(since=t0)
+
+    def _end_agent_turn(self):
+        # 全双工：被打断即视为对方本轮结束（之后的开口不再算作插话）；半双工仍等 COMPLETE 才放开门控
+        if self.duplex == FULL_DUPLEX:
+            self.agent_speaking.clear()
+            self.turns.agent_done()
+
+    def _clear_audio_queue(self, since=None):
+        """停止当前播放并清空音频队列"""
+        # 输出流常驻：只丢弃未播放的数据，下一个输出块内即静音；解码器重置推迟到下一次 write
+        self._player.clear(since)
+
+        # 已收到、还没分发的 TTS 分片同样作废；控制消息保留（句末 / COMPLETE 仍要处理）
+        self._rx.queue.clear(AUDIO)
+        # 清空待播队列并递增 epoch 放在 _tts_lock 内（调用方已先置 want_interrupt），与分发线程“查标志 + 取 epoch”互斥；
+        # 之前读到旧 epoch 的分发线程（含阻塞在 put 上的）入队时被丢弃。clear() 不阻塞，持锁期间没有线程在 put
+        with self._tts_lock:
+            self._tts_queue.clear()
+            self._tts_cur.clear()
+            self._mp3_frames.reset()
+
+    # ---------- 持久播放器 ----------
+    def _player_loop(self):
+        """顺序消费播放队列，把 MP3（整帧或整句）交给进程内播放器；句首标记只用于统计。"""
+        self._player.start()
+        while True:
+            item = self._tts_queue.get()
+            try:
+                # 打断状态下跳过残留音频；阻塞在队列上而不是轮询，新一句到达即可起播
+                if self.want_interrupt.is_set():
+                    continue
+                if isinstance(item, SentenceMark):
+                    self._sentence_mark = item
+                    continue
+                self._player.write(item)
+                if self._sentence_mark is not None:
+                    ms = (time.monotonic() - self._sentence_mark.ts) * 1000
+                    self._sentence_mark = None
+                    self.performance_metrics["tts_first_audio_ms"].append(ms)
+                    print(f"[PERF] Sentence start → first audio queued: {ms:.1f}ms")
+            except Exception as e:
+                print("[PLAYER][ERR]", e)
+
+    def _ensure_player(self):
+        with self._player_lock:
+            if not self._player_started:
+                t = threading.Thread(target=self._player_loop, daemon=True)
+                t.start()
+                self._player_started = True
+
+    # ---------- WebSocket ----------
+    def start(self, uid, url=URL_VOICE_CHAT, token=None):
+        """
+        阻塞直到会话结束（stop() 或重连放弃）；token 为 None 时取缓存的鉴权 token（连本地替身 / 回放服务时可随意传）。
+        配置了连接池时首条连接优先取池里已就绪的（命中即省掉建连 + 鉴权的时延）。
+        连接意外断开时按退避 + 抖动重连：沿用同一 sessionId 与 token，requestId 每次连接重新生成。
+        """
+        self.uid = uid
+        self._stopping.clear()
+        self._start_ts = time.monotonic()
+        if not self._take_pooled():
+            self._connect(url, token)
+        while True:
+            if self._stopping.is_set() or not self.reconnect:
+                break
+            delay = self._backoff.next()
+            if delay is None:
+                print(f"[WS] 连续 {self._backoff.failures} 次重连失败，放弃")
+                break
+            print(f"[WS] {delay * 1000:.0f}ms 后重连（第 {self._backoff.failures} 次）")
+            if self._stopping.wait(delay):
+                break
+            self.requestId = str(uuid.uuid4())
+            self._connect(url, token)
+        self._stopping.set()  # 重连放弃 / 不重连时也结束推流线程
+        self._report()
+
+    def _take_pooled(self) -> bool:
+        """从连接池取一条已就绪的连接并阻塞到它关闭；没取到（未命中 / 刚好断开）返回 False。"""
+        if self.pool is None or self._recorder is not None:
+            return False
+        conn = self.pool.take()
+        self._pool_hit = conn is not None
+        if conn is None or not conn.hand_over(self, self.uid, on_dead=self._on_heartbeat_dead):
+            self._pool_hit = False
+            return False
+        # 沿用池里连接握手时的 sessionId / requestId，之后重连都用这个 sessionId
+        self.sessionId, self.requestId = conn.session_id, conn.request_id
+        self._app = conn.app
+        print("[WS] connected (pool):", conn.app.url)
+        self._on_connected(conn.writer, conn.heartbeat)
+        conn.closed.wait()
+        self._relay.detach()
+        return True
+
+    def _connect(self, url, token):
+        """一次连接：阻塞到这条连接关闭（或没连上）。"""
+        self._cached_token = token is None
+        if token is None:
+            token = get_cached_token()
+            if token is None:
+                print("[WS] 获取 token 失败")
+                return
+        ws_url = "%s?botId=%s&sessionId=%s&requestId=%s" % (
+            url, BOT_ID, self.sessionId, self.requestId
+        )
+        ws = websocket.WebSocketApp(
+            ws_url,
+            header=[f"Authorization: Bearer " + token],
+            on_open=self.on_open,
+            on_message=self.on_message,
+            on_error=self.on_error,
+            on_close=self.on_close
+        )
+        self._app = ws
+        # ping_timeout 让读循环的 select 最多阻塞 1s：stop() 从其他线程关掉 socket 后能及时退出并走 on_close
+        ws.run_forever(ping_timeout=1)
+        # 没连上时不一定走 on_close
+        self._relay.detach()
+
+    def stop(self):
+        """从其他线程结束会话：发 close 帧，对端回 close 后走正常收尾（on_close），不再重连，start() 随后返回。"""
+        self._stopping.set()
+        self._drop_connection()
+
+    def _drop_connection(self):
+        """只断开当前连接；开着重连时 start() 随后按退避重连。"""
+        # 先停心跳：关闭过程中不再往正在关的连接上发 PING
+        if self._heartbeat is not None:
+            self._heartbeat.close()
+        if self._app is not None:
+            self._app.close()
+
+    def on_open(self, ws):
+        print("[WS] connected:", ws.url)
+        if self._recorder is not None:
+            # 之后所有线程都经包装后的 ws 发送，上行帧一并录制
+            ws = self._recorder.wrap(ws)
+        # 单写线程：推流 / 打断 / 心跳只入队，CLIENT_INTERRUPT / FINISH 等控制消息先于排队的音频发出
+        ws = ConnectionWriter(ws)
+        # 心跳：登记到进程共享的时间轮，不再每个连接一条 sleep 线程
+        self._on_connected(ws, ping(ws, self.uid, on_dead=self._on_heartbeat_dead))
+
+    def _on_connected(self, ws, heartbeat):
+        """连接就绪（直连的 on_open，或取自连接池）：ws 为该连接的写线程，heartbeat 为其心跳登记。"""
+        self._writer = ws
+        self._heartbeat = heartbeat
+        self._backoff.reset()
+        if self.connect_ms is None:
+            self.connect_ms = (time.monotonic() - self._start_ts) * 1000
+        with self._ws_ref_lock:
+            self._ws_ref = ws
+        # 重连：先回放断线时进行中的一句，推流线程的新帧随后经 relay 续上
+        self._relay.attach(ws)
+        # 接收分发线程 + 播放线程
+        self._rx.start()
+        self._ensure_player()
+        if self._audio_started:
+            return
+        self._audio_started = True
+        # 采麦推流（半双工 / 全双工）- 直接使用修改后的send_audio函数；经 relay 发送，跨重连不中断
+        self._capture = threading.Thread(
+            target=send_audio,
+            args=(self._relay, self.uid),
+            kwargs={
+                "gate_can_send": self.gate_can_send,
+                "request_interrupt": self.request_interrupt,
+                "frame_ms": self.frame_ms,
+                "pacer": self.pacer,
+                "aec": self.aec,
+                "speech_events": self._on_speech_event,
+                "audio_backend": self.audio_backend,
+                "codec": self.codec,
+                "stop_event": self._stopping,
+            },
+            daemon=True
+        )
+        self._capture.start()
+
+    # ---------- TTS 分片 / 句边界 ----------
+    def _on_tts_audio(self, chunk):
+        # 打断先置 want_interrupt，再在 _tts_lock 内清队列（epoch 加一）；这里在同一把锁内查标志、取 epoch，
+        # 所以要么在 epoch 加一之前取到旧 epoch（入队时被丢弃），要么在之后看到打断标志直接返回
+        with self._tts_lock:
+            if self.want_interrupt.is_set():
+                return
+            epoch = self._tts_queue.epoch
+            if not self.tts_streaming:
+                self._tts_cur.extend(chunk)
+                return
+            frames = self._mp3_frames.push(chunk)
+        if frames:
+            self._tts_queue.put(frames, AUDIO, epoch=epoch)
+
+    def _flush_tts_frames(self):
+        # 流式模式下句末不足一帧的残余字节也交给解码器
+        with self._tts_lock:
+            epoch = self._tts_queue.epoch
+            tail = self._mp3_frames.flush()
+        if tail:
+            self._tts_queue.put(tail, AUDIO, epoch=epoch)
+
+    def _enqueue_prev_sentence_if_any(self):
+        # 新句开始前入队上一句，避免被覆盖
+        self._finish_current_sentence()
+
+    def _finish_current_sentence(self):
+        if self.tts_streaming:
+            self._flush_tts_frames()
+            return
+        # 入队不持 _tts_lock：待播队列满时阻塞在 put 上也不会挡住打断清缓冲
+        with self._tts_lock:
+            epoch = self._tts_queue.epoch
+            sentence = bytes(self._tts_cur)
+            self._tts_cur.clear()
+        if sentence:
+            self._tts_queue.put(sentence, AUDIO, epoch=epoch)
+
+    # ---------- 消息分发 ----------
+    def on_message(self, ws, message):
+        # 录制是线路抓包：留在读线程上，保证与上行帧的先后顺序和到达时刻准确
+        if self._recorder is not None:
+            self._recorder.record_in(message)
+        # 读线程上只入队：不解析、不解码、不加锁，不会因为下游变慢而停止读帧
+        self._rx.put(message, frame_kind(message))
+
+    def _dispatch(self, message):
+        """rx 线程：按到达顺序解析并分发下行帧。"""
+        if isinstance(message, (bytes, bytearray)):
+            # 二进制：TTS mp3 分片
+            # 如果处于打断状态，忽略接收到的音频数据
+            if self.want_interrupt.is_set():
+                return
+            self.timeline.mark(tl.TTS_FIRST_BYTE)
+            self._on_tts_audio(message)
+            return
+
+        self.dispatcher.dispatch(message)
+
+    def _build_dispatcher(self):
+        """下行 JSON 消息分发表；应用可再用 dispatcher.on() / on_event() 追加或覆盖。"""
+        d = Dispatcher()
+        d.on_event(TTS_SENTENCE_START, self._on_sentence_start)
+        d.on_event(INTERRUPT, self._on_server_interrupt)
+        d.on_event(SENTENCE_END_EVENTS, self._on_sentence_end)
+        d.on(EVENT, self._on_event)
+        d.on(ASR_TYPES, self._on_asr)
+        d.on(LLM_TYPES, self._on_llm)
+        d.on(TTS_TYPES, self._on_tts_json)
+        d.on(PONG, self._on_pong)
+        d.on_default(self._on_unknown)
+        d.on_invalid(self._on_invalid)
+        return d
+
+    def _on_sentence_start(self, msg):
+        # 对方开始说：进入"对方说话"状态
+        now = time.monotonic()
+        self.turns.agent_start(now)
+        self.timeline.mark(tl.TTS_SENTENCE_START, now)
+        self.agent_speaking.set()
+        self.want_interrupt.clear()  # 清除打断状态
+        self._relay.ack()  # 服务端已开始回复，上一句不必再回放
+        # 新句开始前，若上一句已积累音频但未 complete，先入队
+        self._enqueue_prev_sentence_if_any()
+        self._tts_queue.put(SentenceMark(time.monotonic()), MARK)
+        txt = msg.text.strip()
+        if txt:
+            print("[TTS_START]", txt)
+
+    def _on_server_interrupt(self, msg):
+        # 服务器发送的打断事件
+        print("[EVENT][INTERRUPT] received, clear audio queue")
+        if not self.want_interrupt.is_set():
+            # 已由本地发起的打断，服务端回的 INTERRUPT 只是确认，不重复计数
+            self.turns.interrupted(time.monotonic(), BARGE_IN_SERVER)
+        self.want_interrupt.set()
+        self._end_agent_turn()
+        self._relay.ack()
+        self._clear_audio_queue()
+
+    def _on_sentence_end(self, msg):
+        # 本句（或整个轮次）结束：把当前句入队
+        self._finish_current_sentence()
+        if msg.event_type == COMPLETE:
+            # 整轮结束：允许我方重新说话
+            self.agent_speaking.clear()
+            self.turns.agent_done()
+            self._relay.ack()
+        print("[EVENT]", msg.body)
+
+    def _on_event(self, msg):
+        print("[EVENT]", msg.body)
+
+    def _on_asr(self, msg):
+        now = time.monotonic()
+        self.timeline.mark(tl.ASR_FIRST, now)
+        if msg.content_type != ASR_PARTIAL:
+            self.timeline.mark(tl.ASR_FINAL, now, last=True)
+        text = msg.text
+        if text:
+            print("[ASR]", text)
+
+    def _on_llm(self, msg):
+        self.timeline.mark(tl.LLM_FIRST)
+        text = msg.text
+        if text:
+            print("[LLM]", text)
+
+    def _on_tts_json(self, msg):
+        # 如果处于打断状态，忽略接收到的音频数据
+        if self.want_interrupt.is_set():
+            return
+        # JSON base64 音频与二进制分片同样处理
+        b64 = msg.audio_b64
+        if b64:
+            self.timeline.mark(tl.TTS_FIRST_BYTE)
+            try:
+                self._on_tts_audio(base64.b64decode(b64))
+            except Exception as e:
+                print("[TTS][b64-decode][ERR]", e)
+
+    def _on_pong(self, msg):
+        if self._heartbeat is not None:
+            self._heartbeat.pong(msg.data.get("mid"))
+
+    def _on_heartbeat_dead(self, hb):
+        # 时间轮线程上回调，关连接可能阻塞（等对端 close 帧），另起线程
+        print("[HEARTBEAT] 连续 %d 次未收到 PONG，断开连接" % hb.missed)
+        threading.Thread(target=self._drop_connection, daemon=True).start()
+
+    def _on_unknown(self, msg):
+        print("[MSG][", msg.content_type, "]", msg.dumps())
+
+    def _on_invalid(self, raw):
+        print("Received:", raw)
+
+    def on_error(self, ws, error):
+        print("[ERROR]", error)
+        if self._cached_token and getattr(error, "status_code", None) == 401:
+            # 握手被拒：缓存的 token 作废，下次重连重新获取
+            token_manager.invalidate()
+
+    def on_close(self, ws, close_status_code, close_msg):
+        print("[CLOSED]", close_status_code, close_msg)
+        self._relay.detach()
+        with self._ws_ref_lock:
+            self._ws_ref = None
+        if self._heartbeat is not None:
+            self._heartbeat.close()
+        if self._writer is not None:
+            self._writer.stop()
+        if self.agent_speaking.is_set():
+            # 这条连接上的回复不会再继续：放开半双工门控，否则重连后我方一直推不了流
+            self.agent_speaking.clear()
+            self.turns.agent_done()
+
+    def _report(self):
+        """会话结束（不再重连）：等推流线程退出（关闭上行发送器），打印最终性能统计并释放播放器 / 录制。"""
+        if self._capture is not None:
+            self._capture.join(timeout=2.0)
+            self._capture = None
+            self._audio_started = False
+        self.timeline.close()
+        summary = self.timeline.format()
+        if summary:
+            print("[PERF] Turn timeline (%s):\n%s" % (self.timeline.mode, summary))
+        if self.timeline_out:
+            n = self.timeline.export_jsonl(self.timeline_out)
+            print(f"[PERF] Timeline exported: {self.timeline_out} ({n} lines)")
+        ttfa = self.performance_metrics["tts_first_audio_ms"]
+        if ttfa:
+            print(f"[PERF] Sentence start → first audio queued: mean {sum(ttfa) / len(ttfa):.1f}ms "
+                  f"(n={len(ttfa)}, {'streaming' if self.tts_streaming else 'sentence-buffered'})")
+        lag = self.pacer.stats()
+        if lag["frames"]:
+            print(f"[PERF] Uplink send lag: mean {lag['mean_lag_ms']:.1f}ms, max {lag['max_lag_ms']:.1f}ms "
+                  f"over {lag['frames']} frames (dropped {lag['dropped']}, overflows {lag['overflows']})")
+        play = self._player.stats()
+        if play["starts"] or play["stops"]:
+            print(f"[PERF] Playback start latency: {play['start_ms']:.1f}ms (n={play['starts']}), "
+                  f"interrupt → silence: mean {play['stop_ms']:.1f}ms, max {play['stop_max_ms']:.1f}ms "
+                  f"(n={play['stops']})")
+        print("[PERF] Turns:", self.turns.format())
+        hb = self._heartbeat
+        if hb is not None and hb.pings:
+            rtt = "%.1fms" % hb.rtt_ms if hb.rtt_ms is not None else "-"
+            print(f"[PERF] Heartbeat: {hb.pings} pings, {hb.pongs} pongs, last RTT {rtt}, "
+                  f"{hb.service.live} sessions on the shared wheel")
+        print("[PERF] Queues:", format_stats(self._rx.queue), "|", format_stats(self._tts_queue))
+        if self._writer is not None:
+            print("[PERF] Send queue:", format_writer_stats(self._writer))
+        if self.aec is not None and self.aec.frames:
+            echo = self.aec.stats()
+            print(f"[PERF] AEC: ERLE {echo['erle_db']:.1f}dB (mean {echo['erle_mean_db']:.1f}dB), "
+                  f"{echo['us_per_frame']:.0f}µs/frame, double-talk {echo['double_talk_pct']:.0f}%, "
+                  f"bypass {echo['bypass_pct']:.0f}%")
+        proto = self.dispatcher.stats()
+        if proto["messages"]:
+            print(f"[PERF] Protocol ({proto['backend']}): decode {proto['decode_us']:.1f}µs, "
+                  f"route {proto['route_us']:.2f}µs per message (n={proto['messages']})")
+        if self.connect_ms is not None:
+            how = {True: "pool hit", False: "pool miss"}.get(self._pool_hit, "direct")
+            print(f"[PERF] Connect: start → connected {self.connect_ms:.1f}ms ({how})")
+        if self.pool is not None:
+            print("[PERF] Pool:", format_pool_stats(self.pool))
+        rc = self._relay.stats()
+        if rc["reconnects"] or self._backoff.retries:
+            print(f"[PERF] Reconnect: {rc['reconnects']} reconnects in {self._backoff.retries} attempts, "
+                  f"outage mean {rc['outage_ms']:.0f}ms, max {rc['outage_max_ms']:.0f}ms, "
+                  f"replayed {rc['replayed']} frames (overflow {rc['overflow']}, lost {rc['lost']})")
+        self._player.stop()
+        if self._recorder is not None:
+            self._recorder.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", default=None, help="录制本次会话的所有 WS 帧到该文件（.gz 结尾则压缩）")
+    parser.add_argument("--url", default=URL_VOICE_CHAT, help="可指向 replay_session.py 启动的回放服务")
+    parser.add_argument("--frame-ms", type=int, default=FRAME_MS, choices=FRAME_MS_CHOICES,
+                        help="上行帧时长（ms），可用 frame_bench.py 比较各档的时延/开销")
+    parser.add_argument("--codec", default="pcm", choices=CODECS, help="上行编码（opus 需服务端支持）")
+    parser.add_argument("--sentence-buffer", action="store_true", help="关闭 TTS 流式播放，整句到齐后才播（对比用）")
+    parser.add_argument("--no-aec", action="store_true", help="关闭回声消除（戴耳机时可关）")
+    parser.add_argument("--duplex", choices=DUPLEX_MODES, default=HALF_DUPLEX,
+                        help="half：对方说话时暂停推流（默认）；full：对方说话时照常推流")
+    parser.add_argument("--barge-in", choices=BARGE_IN_CHOICES, default=BARGE_IN_CLIENT,
+                        help="全双工下由谁打断：client 本地检测到开口即打断；server 等服务端 INTERRUPT")
+    parser.add_argument("--timeline-out", default=None, help="退出时把逐轮时延时间线与各段直方图写成 JSON lines")
+    parser.add_argument("--no-reconnect", action="store_true", help="连接断开即结束会话（默认按退避重连并回放进行中的一句）")
+    parser.add_argument("--pool", type=int, default=0,
+                        help="预热连接池大小：启动时先建好这么多条已鉴权的连接，会话直接取用（默认 0 不预热）")
+    args = parser.parse_args()
+
+    userId = "123456"
+    pool = None
+    if args.pool > 0:
+        pool = VoiceConnectionPool(args.url, BOT_ID, get_cached_token, size=args.pool, uid=userId).start()
+        if not pool.wait_ready(1, timeout=10):
+            print("[WARN] 连接池 10s 内没有就绪的连接，会话将直连")
+    handler = WebsocketHandler(recorder=SessionRecorder(args.record) if args.record else None,
+                               frame_ms=args.frame_ms, codec=args.codec,
+                               tts_streaming=not args.sentence_buffer, aec=not args.no_aec,
+                               duplex=args.duplex, barge_in=args.barge_in, timeline_out=args.timeline_out,
+                               reconnect=not args.no_reconnect, pool=pool)
+    handler.start(userId, url=args.url)
\ No newline at end of file
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+语音对话示例（asyncio 版）：单进程内以协程承载会话，事件语义与 voice.py 相同
+python voice_async.py                  # 麦克风
+python voice_async.py test.pcm         # 文件回放
+python voice_async.py --frame-ms 40    # 调整上行帧时长
+python voice_async.py --codec opus     # Opus 上行（需服务端支持，opuslib 不可用时回退 PCM）
+"""
+
+import argparse
+import asyncio
+
+from auth_token_demo import get_cached_token
+from config import BOT_ID
+from joy_inside_py.api_config import FRAME_MS, FRAME_MS_CHOICES, frame_bytes
+from joy_inside_py.codec import CODECS
+from joy_inside_py.voice_session import VoiceSession, mic_frames, pcm_file_frames
+
+
+async def main(uid, pcm_path=None, frame_ms=FRAME_MS, codec="pcm"):
+    loop = asyncio.get_running_loop()
+    # token 获取是阻塞 HTTP 调用，放到线程池里，命中缓存时几乎不耗时
+    token = await loop.run_in_executor(None, get_cached_token)
+    fb = frame_bytes(frame_ms)
+    frames = pcm_file_frames(pcm_path, fb) if pcm_path else mic_frames(fb // 2)
+    session = VoiceSession(uid, token, BOT_ID, frames=frames, frame_ms=frame_ms, codec=codec)
+    await session.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pcm", nargs="?", default=None, help="16kHz/16bit/单声道 PCM 文件，不填则用麦克风")
+    parser.add_argument("--frame-ms", type=int, default=FRAME_MS, choices=FRAME_MS_CHOICES, help="上行帧时长")
+    parser.add_argument("--codec", default="pcm", choices=CODECS, help="上行编码")
+    args = parser.parse_args()
+
+    userId = "123456"
+    asyncio.run(main(userId, args.pcm, args.frame_ms, args.codec))